@@ -1,9 +1,20 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from models import db, Client, PendingBill, Entry, ReconBasket
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from models import db, Client, PendingBill, Entry, ReconBasket, ReconRun, ReconBill, ColumnMappingProfile
+import hashlib
+import os
+import numpy as np
 import pandas as pd
-from difflib import SequenceMatcher
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update, case, or_, and_, func, select
 import io
+from utils.name_matching import name_similarity, score_pairs
+from utils.bill_numbers import bill_no_number
+from utils.bill_registry import sync_bills
+from utils.client_balances import refresh_client_balances
+from utils.stock_ledger import invalidate_stock_snapshots
+from utils.column_mapping import (register_mapping_kind, read_mapped_table, read_headers, save_profile,
+                                  MAPPING_KINDS)
 
 # Module configuration
 MODULE_CONFIG = {
@@ -39,7 +50,426 @@ def read_table(file_storage):
 def name_score(a, b):
     if not a or not b:
         return 0
-    return int(SequenceMatcher(None, str(a).lower(), str(b).lower()).ratio() * 100)
+    return name_similarity(a, b)
+
+
+# Match score at or above which a finance/dispatch pair is auto-applied (GREEN)
+GREEN_THRESHOLD = 90
+
+# Rows per bulk INSERT / IN (...) lookup
+BULK_CHUNK_SIZE = 500
+
+# Below this many matched pairs scoring stays in-process (pool start-up costs more)
+PARALLEL_MIN_PAIRS = 5000
+
+# Partitions per worker, so faster workers pick up more of the load
+PARTITIONS_PER_WORKER = 4
+
+# Basket rows listed per status page
+BASKET_PAGE_SIZE = 50
+BASKET_MAX_PAGE_SIZE = 200
+
+# Superseded basket rows older than this are purged
+RECON_RETENTION_DAYS = 30
+
+BASKET_STATUSES = ['GREEN', 'YELLOW', 'RED', 'BLUE']
+
+recon_progress = {'current': 0, 'total': 0, 'done': True}
+
+
+RECON_COLUMNS = ['bill_no', 'client', 'material', 'qty']
+
+
+@register_mapping_kind('recon', RECON_COLUMNS)
+def resolve_columns(headers):
+    """
+    Detect the bill, client, material and qty columns of an uploaded table.
+
+    Only runs the first time a header row is seen; the result is saved as a
+    mapping profile (see utils/column_mapping.py).
+
+    Returns:
+        Dict mapping source headers to 'bill_no', 'client', 'material' or 'qty'
+    """
+    resolved = {}
+    for c in headers:
+        lc = str(c).strip().lower()
+        if 'bill_no' not in resolved and lc == 'bill_no':
+            resolved['bill_no'] = c
+        if 'client' not in resolved and 'client' in lc:
+            resolved['client'] = c
+        if 'material' not in resolved and ('material' in lc or 'item' in lc):
+            resolved['material'] = c
+        if 'qty' not in resolved and ('qty' in lc or 'quantity' in lc):
+            resolved['qty'] = c
+    return {source: canonical for canonical, source in resolved.items()}
+
+
+def read_recon_table(file_storage):
+    """Read a finance/dispatch upload through its mapping profile (None when unreadable)."""
+    if not file_storage or not file_storage.filename:
+        return None
+    try:
+        return read_mapped_table(file_storage, 'recon')
+    except Exception:
+        return None
+
+
+def normalize_text(series):
+    """Strip a column to plain strings, with blanks and NaN as ''."""
+    text = series.astype(str).str.strip()
+    return text.mask(series.isna() | text.str.lower().eq('nan'), '')
+
+
+def normalize_bill_no(series):
+    """Normalize bill numbers for joining; float columns (e.g. 1001.0) lose the '.0'."""
+    if pd.api.types.is_float_dtype(series):
+        whole = series.notna() & (series % 1 == 0)
+        text = normalize_text(series)
+        text[whole] = series[whole].astype('int64').astype(str)
+        return text
+    return normalize_text(series)
+
+
+def prepare_frame(df):
+    """
+    Normalize a mapped upload (canonical column names) for reconciliation.
+
+    Returns:
+        DataFrame with bill_no, client, material and qty columns (defaults when missing)
+    """
+    out = pd.DataFrame(index=df.index)
+    out['bill_no'] = normalize_bill_no(df['bill_no']) if 'bill_no' in df else ''
+    out['client'] = normalize_text(df['client']) if 'client' in df else ''
+    out['material'] = normalize_text(df['material']) if 'material' in df else ''
+    out['qty'] = pd.to_numeric(df['qty'], errors='coerce').fillna(0.0) if 'qty' in df else 0.0
+    out.attrs['has_bill_no'] = 'bill_no' in df
+    return out
+
+
+def score_matches(fin_clients, inv_clients, bill_nos, workers=None):
+    """
+    Name scores for matched finance/dispatch pairs, updating ``recon_progress``.
+
+    Large inputs are partitioned by a hash of the bill number and scored in a
+    process pool across all cores; results are stitched back in input order.
+    """
+    pairs = list(zip(fin_clients, inv_clients))
+    recon_progress.update({'current': 0, 'total': len(pairs)})
+    if len(pairs) < PARALLEL_MIN_PAIRS:
+        scores = score_pairs(pairs)
+        recon_progress['current'] = len(pairs)
+        return scores
+
+    workers = workers or os.cpu_count() or 1
+    n_parts = workers * PARTITIONS_PER_WORKER
+    partition = (pd.util.hash_pandas_object(pd.Series(list(bill_nos)), index=False) % n_parts).to_numpy()
+    scores = np.zeros(len(pairs), dtype=int)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for part in range(n_parts):
+            positions = np.flatnonzero(partition == part)
+            if len(positions):
+                futures[pool.submit(score_pairs, [pairs[i] for i in positions])] = positions
+        for future in as_completed(futures):
+            positions = futures[future]
+            scores[positions] = future.result()
+            recon_progress['current'] += len(positions)
+    return scores.tolist()
+
+
+def triangulate(fin, inv):
+    """
+    Classify prepared finance and dispatch frames by bill number.
+
+    Dispatch rows are matched to the first finance row of their bill through an
+    outer merge with an indicator: GREEN (both sides, names agree), YELLOW (both
+    sides, names disagree), RED (one side only, once per source row) and BLUE
+    (dispatch without a bill number).
+
+    Returns:
+        DataFrame with bill_no, fin_client, inv_client, inv_material, inv_qty,
+        status and match_score columns
+    """
+    empty = pd.DataFrame(columns=['bill_no', 'client', 'material', 'qty'])
+    if fin is None or not fin.attrs.get('has_bill_no'):
+        fin = empty
+    if inv is None:
+        inv = empty
+
+    billed = inv['bill_no'] != ''
+    blue = inv[~billed]
+    inv = inv[billed]
+
+    # One finance row per bill to match against, remembering how many there were
+    fin_first = fin.drop_duplicates('bill_no').assign(fin_rows=fin.groupby('bill_no')['bill_no'].transform('size'))
+    merged = inv.rename(columns={'client': 'inv_client', 'material': 'inv_material', 'qty': 'inv_qty'}).merge(
+        fin_first[['bill_no', 'client', 'fin_rows']].rename(columns={'client': 'fin_client'}),
+        on='bill_no', how='outer', indicator=True)
+
+    both = merged[merged['_merge'] == 'both'].copy()
+    both['match_score'] = score_matches(both['fin_client'], both['inv_client'], both['bill_no'])
+    both['status'] = 'YELLOW'
+    both.loc[both['match_score'] >= GREEN_THRESHOLD, 'status'] = 'GREEN'
+
+    inv_only = merged[merged['_merge'] == 'left_only'].assign(status='RED', match_score=0, fin_client=None)
+    # Finance-only bills produce one RED row per finance row
+    fin_only = merged[merged['_merge'] == 'right_only']
+    fin_only = fin_only.loc[fin_only.index.repeat(fin_only['fin_rows'].astype(int))].assign(
+        status='RED', match_score=0, inv_client=None, inv_material=None, inv_qty=0.0)
+
+    blue = pd.DataFrame({'bill_no': '', 'fin_client': None, 'inv_client': blue['client'],
+                         'inv_material': blue['material'], 'inv_qty': blue['qty'],
+                         'status': 'BLUE', 'match_score': 0})
+
+    columns = ['bill_no', 'fin_client', 'inv_client', 'inv_material', 'inv_qty', 'status', 'match_score']
+    frames = [f[columns] for f in (both, inv_only, fin_only, blue) if len(f)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    result = pd.concat(frames, ignore_index=True)
+    return result.astype(object).where(result.notna(), None)
+
+
+def live_dispatch_frame(bill_nos):
+    """
+    Dispatch side of a live reconciliation, read from the database for the given bills.
+
+    OUT entries are fetched with chunked IN lookups on the indexed bill_no
+    columns; bills with a PendingBill but no dispatch entry contribute the
+    pending bill's client with no material.
+
+    Returns:
+        Prepared frame with bill_no, client, material and qty columns
+    """
+    bill_nos = [b for b in dict.fromkeys(bill_nos) if b]
+    rows = []
+    dispatched = set()
+    for i in range(0, len(bill_nos), BULK_CHUNK_SIZE):
+        chunk = bill_nos[i:i + BULK_CHUNK_SIZE]
+        entries = db.session.query(
+            Entry.bill_no, func.coalesce(Entry.client_name, Entry.client, ''), Entry.material, Entry.qty
+        ).filter(Entry.type == 'OUT', Entry.bill_no.in_(chunk))
+        for bill_no, client, material, qty in entries:
+            rows.append((bill_no, client, material or '', qty or 0.0))
+            dispatched.add(bill_no)
+    undispatched = [b for b in bill_nos if b not in dispatched]
+    for i in range(0, len(undispatched), BULK_CHUNK_SIZE):
+        chunk = undispatched[i:i + BULK_CHUNK_SIZE]
+        pending = db.session.query(PendingBill.bill_no, func.coalesce(PendingBill.client_name, '')).filter(
+            PendingBill.bill_no.in_(chunk)).distinct()
+        rows.extend((bill_no, client, '', 0.0) for bill_no, client in pending)
+
+    frame = pd.DataFrame(rows, columns=['bill_no', 'client', 'material', 'qty'])
+    frame['client'] = frame['client'].astype(str).str.strip()
+    frame['qty'] = frame['qty'].astype(float)
+    frame.attrs['has_bill_no'] = True
+    return frame
+
+
+def file_hash(file_storage):
+    """sha256 of an uploaded file's bytes (None when no file was sent)."""
+    if not file_storage or not file_storage.filename:
+        return None
+    digest = hashlib.sha256(file_storage.read()).hexdigest()
+    file_storage.stream.seek(0)
+    return digest
+
+
+def bill_signatures(fin, inv):
+    """
+    Hash each bill's finance and dispatch rows into a signature.
+
+    Row hashes are summed per bill, so the signature ignores row order but
+    changes when any row of the bill is added, removed or edited.
+
+    Returns:
+        Dict mapping bill_no to a signature string
+    """
+    frames = []
+    if fin is not None and fin.attrs.get('has_bill_no'):
+        frames.append(fin[['bill_no', 'client']].assign(side='F', material='', qty=0.0))
+    if inv is not None:
+        frames.append(inv[['bill_no', 'client', 'material', 'qty']].assign(side='I'))
+    if not frames:
+        return {}
+    rows = pd.concat(frames, ignore_index=True)
+    rows['qty'] = rows['qty'].astype(float)
+    row_hashes = pd.util.hash_pandas_object(rows[['side', 'bill_no', 'client', 'material', 'qty']], index=False)
+    sums = row_hashes.groupby(rows['bill_no'].to_numpy()).sum()
+    return {bill: format(int(value), '016x') for bill, value in sums.items()}
+
+
+def previous_bill_states(bill_nos):
+    """Return {bill_no: (signature, status)} of earlier runs, using chunked IN lookups."""
+    bill_nos = list(bill_nos)
+    states = {}
+    for i in range(0, len(bill_nos), BULK_CHUNK_SIZE):
+        chunk = bill_nos[i:i + BULK_CHUNK_SIZE]
+        rows = db.session.query(ReconBill.bill_no, ReconBill.signature, ReconBill.status).filter(
+            ReconBill.bill_no.in_(chunk))
+        states.update((row.bill_no, (row.signature, row.status)) for row in rows)
+    return states
+
+
+def bills_to_rescore(signatures):
+    """
+    Bills of this upload that need scoring.
+
+    Bills already reconciled GREEN are never re-applied, and bills whose rows
+    are unchanged since their last run keep their previous result.
+    """
+    previous = previous_bill_states(signatures)
+    rescore = set()
+    for bill, signature in signatures.items():
+        state = previous.get(bill)
+        if state is None or (state[1] != 'GREEN' and state[0] != signature):
+            rescore.add(bill)
+    return rescore
+
+
+def restrict_to_bills(frame, bills):
+    if frame is None:
+        return None
+    restricted = frame[frame['bill_no'].isin(bills)]
+    restricted.attrs = dict(frame.attrs)
+    return restricted
+
+
+def bill_statuses(result):
+    """Overall status per bill: GREEN only when every row is GREEN, else the worst row status."""
+    rank = {'RED': 0, 'YELLOW': 1, 'BLUE': 2, 'GREEN': 3}
+    ranked = result['status'].map(rank)
+    worst = ranked.groupby(result['bill_no']).min()
+    names = {value: key for key, value in rank.items()}
+    return {bill: names[value] for bill, value in worst.items()}
+
+
+def record_bill_states(run, signatures, result):
+    """Replace the ReconBill rows of the rescored bills with this run's state."""
+    statuses = bill_statuses(result) if len(result) else {}
+    bill_nos = list(signatures)
+    for i in range(0, len(bill_nos), BULK_CHUNK_SIZE):
+        chunk = bill_nos[i:i + BULK_CHUNK_SIZE]
+        ReconBill.query.filter(ReconBill.bill_no.in_(chunk)).delete(synchronize_session=False)
+    bulk_insert(ReconBill, [{
+        'bill_no': bill, 'signature': signature, 'status': statuses.get(bill, 'GREEN'), 'run_id': run.id
+    } for bill, signature in signatures.items()])
+
+
+def latest_basket_query():
+    """ReconBasket rows from the latest run of each bill (plus rows from before runs were recorded)."""
+    return ReconBasket.query.outerjoin(ReconBill, ReconBill.bill_no == ReconBasket.bill_no).filter(
+        or_(ReconBill.id.is_(None), ReconBasket.run_id == ReconBill.run_id))
+
+
+def filtered_basket_query(bill_no=None, client=None):
+    """Latest basket rows, optionally filtered by bill number prefix and client name."""
+    query = latest_basket_query()
+    if bill_no:
+        query = query.filter(ReconBasket.bill_no.like(f'{bill_no}%'))
+    if client:
+        query = query.filter(or_(ReconBasket.fin_client.ilike(f'%{client}%'),
+                                 ReconBasket.inv_client.ilike(f'%{client}%')))
+    return query
+
+
+def encode_cursor(row):
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+
+def decode_cursor(cursor):
+    """Parse a 'created_at_id' cursor; None when missing or malformed."""
+    try:
+        created_at, row_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def basket_page(query, status, after=None, per_page=BASKET_PAGE_SIZE):
+    """
+    One keyset page of a status, newest first, served by the (status, created_at) index.
+
+    Returns:
+        Tuple of (rows, cursor of the next page or None)
+    """
+    query = query.filter(ReconBasket.status == status)
+    position = decode_cursor(after)
+    if position:
+        created_at, row_id = position
+        query = query.filter(or_(ReconBasket.created_at < created_at,
+                                 and_(ReconBasket.created_at == created_at, ReconBasket.id < row_id)))
+    rows = query.order_by(ReconBasket.created_at.desc(), ReconBasket.id.desc()).limit(per_page + 1).all()
+    next_cursor = encode_cursor(rows[per_page - 1]) if len(rows) > per_page else None
+    return rows[:per_page], next_cursor
+
+
+def purge_resolved_basket_rows(days=RECON_RETENTION_DAYS):
+    """Delete basket rows older than ``days`` that a later run of their bill has superseded."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    superseded = select(ReconBasket.id).join(ReconBill, ReconBill.bill_no == ReconBasket.bill_no).where(
+        ReconBasket.created_at < cutoff,
+        or_(ReconBasket.run_id.is_(None), ReconBasket.run_id != ReconBill.run_id))
+    deleted = ReconBasket.query.filter(ReconBasket.id.in_(superseded)).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def bulk_insert(model, rows):
+    """Insert dict rows with executemany in chunks."""
+    if 'bill_no_num' in model.__table__.c:
+        # Core inserts skip the ORM hook that keeps bill_no_num in step
+        for row in rows:
+            row['bill_no_num'] = bill_no_number(row.get('bill_no'))
+    for i in range(0, len(rows), BULK_CHUNK_SIZE):
+        db.session.execute(insert(model), rows[i:i + BULK_CHUNK_SIZE])
+
+
+def existing_pending_bill_nos(bill_nos):
+    """Return the subset of bill numbers that already have a PendingBill, using chunked IN lookups."""
+    bill_nos = list(bill_nos)
+    found = set()
+    for i in range(0, len(bill_nos), BULK_CHUNK_SIZE):
+        chunk = bill_nos[i:i + BULK_CHUNK_SIZE]
+        found.update(b for (b,) in db.session.query(PendingBill.bill_no).filter(PendingBill.bill_no.in_(chunk)))
+    return found
+
+
+def apply_triangulation(result, run_id=None, apply_green=True):
+    """
+    Persist a triangulation result.
+
+    GREEN rows are auto-applied as dispatch entries (plus a PendingBill when the
+    bill is unknown) unless ``apply_green`` is off, as in live mode where the
+    dispatch side already is the database; everything else goes to the Recon
+    Basket under ``run_id``.
+    """
+    green = result[result['status'] == 'GREEN']
+    if apply_green and len(green):
+        now = datetime.utcnow()
+        today_str, time_str = now.strftime('%Y-%m-%d'), now.time().isoformat()
+        bulk_insert(Entry, [{
+            'date': today_str, 'time': time_str, 'type': 'OUT',
+            'material': r.inv_material or '', 'client_name': r.fin_client or r.inv_client,
+            'client_code': None, 'qty': r.inv_qty or 0.0, 'bill_no': r.bill_no, 'created_by': 'import'
+        } for r in green.itertuples(index=False)])
+        invalidate_stock_snapshots(green['inv_material'].fillna(''), since=today_str)
+
+        # Ensure a pending bill exists for every auto-applied bill
+        first_per_bill = green.drop_duplicates('bill_no')
+        known = existing_pending_bill_nos(first_per_bill['bill_no'])
+        bulk_insert(PendingBill, [{
+            'bill_no': r.bill_no, 'client_name': r.fin_client, 'client_code': None, 'amount': 0, 'date': None
+        } for r in first_per_bill.itertuples(index=False) if r.bill_no not in known])
+        # Core inserts bypass the registry's flush hook
+        sync_bills(first_per_bill['bill_no'])
+
+    basket = result[result['status'] != 'GREEN']
+    bulk_insert(ReconBasket, [{
+        'bill_no': r.bill_no, 'fin_client': r.fin_client, 'inv_client': r.inv_client,
+        'inv_material': r.inv_material, 'inv_qty': r.inv_qty or 0.0,
+        'status': r.status, 'match_score': int(r.match_score or 0), 'run_id': run_id
+    } for r in basket.itertuples(index=False)])
 
 
 @bp.route('/', methods=['GET', 'POST'])
@@ -47,139 +477,124 @@ def upload():
     if request.method == 'POST':
         index_file = request.files.get('index_file')
         finance_file = request.files.get('finance_file')
-        dispatch_file = request.files.get('dispatch_file')
+        live = request.form.get('mode') == 'live'
+        # Live mode reads the dispatch side from the database, never from a file
+        dispatch_file = None if live else request.files.get('dispatch_file')
 
         ledger_df = read_table(index_file) if index_file else None
-        fin_df = read_table(finance_file) if finance_file else None
-        inv_df = read_table(dispatch_file) if dispatch_file else None
+        fin_df = read_recon_table(finance_file)
+        inv_df = read_recon_table(dispatch_file)
 
         ledger_map = {}
         if ledger_df is not None:
             # try to detect columns
-            cols = [c.lower() for c in ledger_df.columns]
-            name_col = None
-            code_col = None
-            for c in ledger_df.columns:
-                lc = c.lower()
-                if 'code' in lc:
-                    code_col = c
-                if 'name' in lc:
-                    name_col = c
+            code_col = next((c for c in reversed(list(ledger_df.columns)) if 'code' in str(c).lower()), None)
+            name_col = next((c for c in reversed(list(ledger_df.columns)) if 'name' in str(c).lower()), None)
             if name_col and code_col:
-                for _, r in ledger_df.iterrows():
-                    try:
-                        ledger_map[str(r[code_col]).strip()] = str(r[name_col]).strip()
-                    except Exception:
-                        continue
-
-        # normalize df column names
-        def norm(df):
-            if df is None:
-                return None
-            df = df.copy()
-            df.columns = [c.strip() for c in df.columns]
-            return df
-
-        fin_df = norm(fin_df)
-        inv_df = norm(inv_df)
-
-        # Build quick lookup by bill_no
-        fin_by_bill = {}
-        if fin_df is not None and 'bill_no' in [c.lower() for c in fin_df.columns]:
-            for _, r in fin_df.iterrows():
-                bill = str(r[[c for c in fin_df.columns if c.lower() == 'bill_no'][0]]).strip()
-                fin_by_bill.setdefault(bill, []).append(r)
-
-        inv_rows = []
-        if inv_df is not None:
-            for _, r in inv_df.iterrows():
-                inv_rows.append(r)
-
-        # Triangulate
-        for r in inv_rows:
-            # try extract bill_no and client
-            bill_col = [c for c in inv_df.columns if c.lower() == 'bill_no']
-            bill = ''
-            if bill_col:
-                bill = str(r[bill_col[0]]).strip()
-            inv_client_col = [c for c in inv_df.columns if 'client' in c.lower()]
-            inv_client = ''
-            if inv_client_col:
-                inv_client = str(r[inv_client_col[0]]).strip()
-            material_col = [c for c in inv_df.columns if 'material' in c.lower() or 'item' in c.lower()]
-            material = ''
-            if material_col:
-                material = str(r[material_col[0]]).strip()
-            qty_col = [c for c in inv_df.columns if 'qty' in c.lower() or 'quantity' in c.lower()]
-            qty = 0
-            if qty_col:
-                try:
-                    qty = float(r[qty_col[0]])
-                except Exception:
-                    qty = 0
-
-            if not bill or bill == 'nan' or bill.strip() == '':
-                # BLUE: unbilled dispatch
-                basket = ReconBasket(bill_no='', inv_date=None, inv_client=inv_client, inv_material=material, inv_qty=qty, status='BLUE', match_score=0)
-                db.session.add(basket)
-                continue
-
-            fin_list = fin_by_bill.get(bill, [])
-            if fin_list:
-                # match against first finance row
-                fin_r = fin_list[0]
-                fin_client_col = [c for c in fin_df.columns if 'client' in c.lower()]
-                fin_client = ''
-                if fin_client_col:
-                    fin_client = str(fin_r[fin_client_col[0]]).strip()
-                score = name_score(fin_client, inv_client)
-                if score >= 90:
-                    # GREEN: auto-save to DB (create Entry if not exists)
-                    entry = Entry(date=datetime.utcnow().date(), time=datetime.utcnow().time().isoformat(), type='OUT', material=material, client_name=fin_client or inv_client, client_code=None, qty=qty, bill_no=bill, created_by='import')
-                    db.session.add(entry)
-                    # ensure pending bill exists
-                    pending = PendingBill.query.filter_by(bill_no=bill).first()
-                    if not pending:
-                        pending = PendingBill(bill_no=bill, client_name=fin_client, client_code=None, amount=0, date=None)
-                        db.session.add(pending)
-                    # do not add to basket (auto-applied)
-                else:
-                    # YELLOW: conflict
-                    basket = ReconBasket(bill_no=bill, fin_client=fin_client, inv_client=inv_client, inv_material=material, inv_qty=qty, status='YELLOW', match_score=score)
-                    db.session.add(basket)
-            else:
-                # RED: waiting - exists in dispatch but not in finance
-                basket = ReconBasket(bill_no=bill, inv_client=inv_client, inv_material=material, inv_qty=qty, status='RED', match_score=0)
-                db.session.add(basket)
-
-        # Now check finance-only bills (in finance but not in dispatch)
-        if fin_df is not None:
-            for _, r in fin_df.iterrows():
-                bill = str(r[[c for c in fin_df.columns if c.lower() == 'bill_no'][0]]).strip()
-                if inv_df is None or bill not in [str(x[[c for c in inv_df.columns if c.lower() == 'bill_no'][0]]).strip() for _, x in inv_df.iterrows()]:
-                    # RED entry (finance only)
-                    client_col = [c for c in fin_df.columns if 'client' in c.lower()]
-                    fin_client = ''
-                    if client_col:
-                        fin_client = str(r[client_col[0]]).strip()
-                    basket = ReconBasket(bill_no=bill, fin_client=fin_client, status='RED', match_score=0)
-                    db.session.add(basket)
+                ledger_map = dict(zip(normalize_text(ledger_df[code_col]), normalize_text(ledger_df[name_col])))
 
-        db.session.commit()
-        flash('Files processed. Review the Recon Basket.', 'success')
+        fin = prepare_frame(fin_df) if fin_df is not None else None
+        if live:
+            if fin is None or not fin.attrs.get('has_bill_no'):
+                flash('Live reconciliation needs a finance file with a bill_no column.', 'danger')
+                return redirect(url_for('data_lab.upload'))
+            inv = live_dispatch_frame(fin['bill_no'])
+        else:
+            inv = prepare_frame(inv_df) if inv_df is not None else None
+
+        finance_hash, dispatch_hash = file_hash(finance_file), file_hash(dispatch_file)
+        # In live mode the database may have moved on, so the same file is worth running again
+        if not live and (finance_hash or dispatch_hash):
+            previous_run = ReconRun.query.filter_by(finance_hash=finance_hash, dispatch_hash=dispatch_hash).order_by(
+                ReconRun.id.desc()).first()
+            if previous_run:
+                flash(f'These files were already reconciled in run #{previous_run.id}.', 'info')
+                return redirect(url_for('data_lab.view_basket'))
+
+        signatures = bill_signatures(fin, inv)
+        rescore = bills_to_rescore(signatures)
+        run = ReconRun(
+            mode='live' if live else 'files',
+            finance_file=finance_file.filename if finance_hash else None, finance_hash=finance_hash,
+            dispatch_file=dispatch_file.filename if dispatch_hash else None, dispatch_hash=dispatch_hash,
+            bills_scored=len(rescore), bills_skipped=len(signatures) - len(rescore))
+        db.session.add(run)
+        db.session.flush()
+
+        recon_progress.update({'current': 0, 'total': 0, 'done': False})
+        try:
+            # Scoring fans out to worker processes; this request stays the single DB writer
+            result = triangulate(restrict_to_bills(fin, rescore), restrict_to_bills(inv, rescore))
+            apply_triangulation(result, run.id, apply_green=not live)
+            record_bill_states(run, {bill: signatures[bill] for bill in rescore}, result)
+            db.session.commit()
+        finally:
+            recon_progress['done'] = True
+        purge_resolved_basket_rows()
+        flash(f'Run #{run.id}: {run.bills_scored} bills scored, {run.bills_skipped} unchanged or already reconciled. '
+              'Review the Recon Basket.', 'success')
         return redirect(url_for('data_lab.view_basket'))
 
     return render_template('data_lab.html')
 
 
+def parse_mapping_lines(text):
+    """Parse 'Source Header = canonical' lines into a mapping dict."""
+    mapping = {}
+    for line in (text or '').splitlines():
+        if '=' in line:
+            source, canonical = (part.strip() for part in line.rsplit('=', 1))
+            if source and canonical:
+                mapping[source] = canonical
+    return mapping
+
+
+@bp.route('/mappings', methods=['GET', 'POST'])
+def mappings():
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        sample = request.files.get('sample_file')
+        if kind not in MAPPING_KINDS or not sample or not sample.filename:
+            flash('Choose a file type and a sample file', 'danger')
+            return redirect(url_for('data_lab.mappings'))
+        try:
+            _, _, headers = read_headers(sample)
+            profile = save_profile(kind, request.form.get('name', '').strip(), headers,
+                                   parse_mapping_lines(request.form.get('mapping')))
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('data_lab.mappings'))
+        flash(f'Mapping profile "{profile.name}" saved.', 'success')
+        return redirect(url_for('data_lab.mappings'))
+
+    profiles = ColumnMappingProfile.query.order_by(ColumnMappingProfile.kind, ColumnMappingProfile.name).all()
+    return render_template('data_lab_mappings.html', profiles=profiles, kinds=MAPPING_KINDS)
+
+
+@bp.route('/status')
+def recon_status():
+    return jsonify(recon_progress)
+
+
 @bp.route('/basket')
 def view_basket():
+    filters = {'bill_no': request.args.get('bill_no', '').strip(), 'client': request.args.get('client', '').strip()}
+    per_page = min(max(request.args.get('per_page', BASKET_PAGE_SIZE, type=int), 1), BASKET_MAX_PAGE_SIZE)
+    query = filtered_basket_query(**filters)
+
+    counts = dict(query.with_entities(ReconBasket.status, func.count(ReconBasket.id)).group_by(
+        ReconBasket.status).all())
+    # Known statuses first, then any others present
+    statuses = BASKET_STATUSES + sorted(s for s in counts if s not in BASKET_STATUSES)
+
     groups = {}
-    for status in ['GREEN', 'YELLOW', 'RED', 'BLUE']:
-        groups[status] = ReconBasket.query.filter_by(status=status).all()
-    # also include any other statuses
-    others = ReconBasket.query.filter(~ReconBasket.status.in_(['GREEN', 'YELLOW', 'RED', 'BLUE'])).all()
-    return render_template('basket_view.html', groups=groups, others=others)
+    for status in statuses:
+        if not counts.get(status):
+            groups[status] = {'items': [], 'next_cursor': None}
+            continue
+        items, next_cursor = basket_page(query, status, request.args.get(f'after_{status}'), per_page)
+        groups[status] = {'items': items, 'next_cursor': next_cursor}
+    return render_template('basket_view.html', groups=groups, counts=counts, filters=filters, per_page=per_page)
 
 
 @bp.route('/correct_bill', methods=['POST'])
@@ -191,7 +606,10 @@ def correct_bill():
         flash('Missing bill or client', 'danger')
         return redirect(url_for('data_lab.view_basket'))
     # update PendingBill and Entry
+    touched_names = {client.name} | set(db.session.execute(
+        select(PendingBill.client_name).where(PendingBill.bill_no == bill_no)).scalars())
     PendingBill.query.filter_by(bill_no=bill_no).update({'client_name': client.name, 'client_code': client.code})
+    refresh_client_balances(touched_names)
     Entry.query.filter_by(bill_no=bill_no).update({'client_name': client.name, 'client_code': client.code})
     # remove basket entries for that bill
     ReconBasket.query.filter_by(bill_no=bill_no).delete()
@@ -200,6 +618,124 @@ def correct_bill():
     return redirect(url_for('data_lab.view_basket'))
 
 
+def parse_decisions(payload):
+    """
+    Normalize bulk decisions into {bill_no: client_code}.
+
+    Accepts a list of {'bill_no', 'client_code'} dicts or [bill_no, client_code] pairs,
+    or text with one 'bill_no,client_code' per line.
+    """
+    if isinstance(payload, str):
+        payload = [line.split(',', 1) for line in payload.splitlines() if ',' in line]
+    decisions = {}
+    for item in payload or []:
+        if isinstance(item, dict):
+            bill_no, code = item.get('bill_no'), item.get('client_code')
+        else:
+            bill_no, code = (list(item) + [None, None])[:2]
+        bill_no, code = str(bill_no or '').strip(), str(code or '').strip()
+        if bill_no and code:
+            decisions[bill_no] = code
+    return decisions
+
+
+def finance_decisions(min_score):
+    """{bill_no: finance client name} for latest YELLOW basket bills scoring at least ``min_score``."""
+    rows = latest_basket_query().with_entities(ReconBasket.bill_no, ReconBasket.fin_client).filter(
+        ReconBasket.status == 'YELLOW', ReconBasket.match_score >= min_score,
+        ReconBasket.bill_no != '', ReconBasket.fin_client.isnot(None)).distinct()
+    return {bill_no: fin_client for bill_no, fin_client in rows}
+
+
+def apply_resolutions(names, codes):
+    """
+    Set the client of many bills at once with chunked CASE updates, and clear their basket rows.
+
+    Args:
+        names: {bill_no: client_name}
+        codes: {bill_no: client_code}; bills missing here keep their current code
+
+    Returns:
+        Dict of affected row counts per table (the caller commits)
+    """
+    counts = {'entries': 0, 'pending_bills': 0, 'basket_rows': 0}
+    bill_nos = list(names)
+    for i in range(0, len(bill_nos), BULK_CHUNK_SIZE):
+        chunk = bill_nos[i:i + BULK_CHUNK_SIZE]
+        chunk_names = {b: names[b] for b in chunk}
+        chunk_codes = {b: codes[b] for b in chunk if b in codes}
+        # Balances of both the previous and the new owners change
+        touched_names = set(chunk_names.values()) | set(db.session.execute(
+            select(PendingBill.client_name).where(PendingBill.bill_no.in_(chunk))).scalars())
+        for model, key in ((PendingBill, 'pending_bills'), (Entry, 'entries')):
+            values = {'client_name': case(chunk_names, value=model.bill_no)}
+            if chunk_codes:
+                values['client_code'] = case(chunk_codes, value=model.bill_no, else_=model.client_code)
+            result = db.session.execute(
+                update(model).where(model.bill_no.in_(chunk)).values(**values).execution_options(
+                    synchronize_session=False))
+            counts[key] += result.rowcount
+        refresh_client_balances(touched_names)
+        counts['basket_rows'] += ReconBasket.query.filter(ReconBasket.bill_no.in_(chunk)).delete(
+            synchronize_session=False)
+    return counts
+
+
+@bp.route('/resolve_bulk', methods=['POST'])
+def resolve_bulk():
+    """
+    Resolve many basket bills in one transaction.
+
+    Either explicit (bill_no, client_code) decisions, or ``accept_finance_min_score``
+    to take the finance client for every YELLOW bill scoring at least that much.
+    Accepts JSON (answers JSON) or the basket page form (redirects back).
+    """
+    payload = request.get_json(silent=True) if request.is_json else request.form
+    payload = payload or {}
+    decisions = parse_decisions(payload.get('decisions'))
+    min_score = payload.get('accept_finance_min_score')
+    unknown = []
+
+    try:
+        if decisions:
+            clients = {}
+            codes = list(set(decisions.values()))
+            for i in range(0, len(codes), BULK_CHUNK_SIZE):
+                rows = db.session.query(Client.code, Client.name).filter(Client.code.in_(codes[i:i + BULK_CHUNK_SIZE]))
+                clients.update(rows)
+            unknown = sorted(set(codes) - set(clients))
+            resolved = {b: c for b, c in decisions.items() if c in clients}
+            names = {b: clients[c] for b, c in resolved.items()}
+        elif min_score not in (None, ''):
+            names = finance_decisions(int(min_score))
+            # Finance names that match a directory client exactly also get its code
+            known = {}
+            values = list(set(names.values()))
+            for i in range(0, len(values), BULK_CHUNK_SIZE):
+                rows = db.session.query(Client.name, Client.code).filter(Client.name.in_(values[i:i + BULK_CHUNK_SIZE]))
+                known.update(rows)
+            resolved = {b: known[n] for b, n in names.items() if n in known}
+        else:
+            names, resolved = {}, {}
+
+        counts = apply_resolutions(names, resolved)
+        db.session.commit()
+    except (ValueError, TypeError):
+        db.session.rollback()
+        if request.is_json:
+            return jsonify({'success': False, 'error': 'Invalid accept_finance_min_score'}), 400
+        flash('Invalid score threshold', 'danger')
+        return redirect(url_for('data_lab.view_basket'))
+
+    if request.is_json:
+        return jsonify({'success': True, 'bills': len(names), 'unknown_client_codes': unknown, **counts})
+    message = f"Resolved {len(names)} bills ({counts['entries']} entries, {counts['pending_bills']} pending bills)."
+    if unknown:
+        message += f" Unknown client codes: {', '.join(unknown[:10])}"
+    flash(message, 'success' if names else 'warning')
+    return redirect(url_for('data_lab.view_basket'))
+
+
 @bp.route('/legacy_import', methods=['POST'])
 def legacy_import():
     # In legacy import mode we assume finance is 100% correct and overwrite dispatch typos.
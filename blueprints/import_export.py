@@ -1,10 +1,21 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, Response, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, Response, current_app, stream_with_context, jsonify
 from flask_login import login_required, current_user
+import os
 import pandas as pd
-import io
 from datetime import datetime, date
-from sqlalchemy import func
-from models import db, Material, Entry, Client, PendingBill
+from sqlalchemy import func, case, and_
+from models import db, Material, Entry, Client, PendingBill, Invoice, ExportJob
+from utils.exports import EXPORT_BATCH_SIZE, iter_query_rows, iter_file_chunks, stream_csv, write_xlsx
+from utils.data_version import get_data_version
+from utils.export_jobs import register_export_job, submit_export_job, track_rows, job_status, artifact_path
+from utils import render_cache
+from utils.ledger import client_statements, ledger_history_query
+from utils.stock_ledger import invalidate_stock_snapshots
+from utils.invoice_versions import bump_linked_invoices
+from utils.documents import invoice_cache_key, render_documents, render_invoice_html
+from utils.name_matching import build_client_index, match_client
+from utils.http_cache import data_version_etag
+from utils.column_mapping import read_mapped_table
 
 # Module configuration
 MODULE_CONFIG = {
@@ -51,70 +62,323 @@ def export_data_filter():
     fmt = request.args.get('format', 'excel')
     return export_data(fmt)
 
+# Column order shared by every tabular entries export
+ENTRY_EXPORT_HEADERS = ['Date', 'Time', 'Type', 'Material', 'ClientName', 'ClientCode',
+                        'Quantity', 'bill_no', 'nimbus_no', 'Captured By']
+
+
+# Request args that narrow an export; also part of every export cache key
+EXPORT_FILTER_ARGS = ('start_date', 'end_date', 'client', 'material', 'type')
+
+
+def export_filter_conditions(args=None):
+    """Build Entry filter conditions from the export form args (the request args by default)."""
+    args = request.args if args is None else args
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+    client_filter = args.get('client')
+    material_filter = args.get('material')
+    type_filter = args.get('type', 'BOTH')
+
+    conditions = []
+    if start_date: conditions.append(Entry.date >= start_date)
+    if end_date: conditions.append(Entry.date <= end_date)
+    if client_filter: conditions.append(Entry.client == client_filter)
+    if material_filter: conditions.append(Entry.material == material_filter)
+    if type_filter != 'BOTH': conditions.append(Entry.type == type_filter)
+    return conditions
+
+
+def apply_export_filters(query, args=None):
+    """Apply the export form filters to an Entry query."""
+    return query.filter(*export_filter_conditions(args))
+
+
+def material_analysis(args=None):
+    """Per-material received/sent/remaining totals for the filtered entries, in one grouped query."""
+    rows = db.session.query(
+        Material.name,
+        func.coalesce(func.sum(case((Entry.type == 'IN', Entry.qty), else_=0)), 0).label('total_in'),
+        func.coalesce(func.sum(case((Entry.type == 'OUT', Entry.qty), else_=0)), 0).label('total_out')
+    ).outerjoin(Entry, and_(Entry.material == Material.name, *export_filter_conditions(args))
+    ).group_by(Material.id, Material.name).order_by(Material.id).all()
+    return {row.name: {'total': row.total_in, 'sent': row.total_out, 'remaining': row.total_in - row.total_out}
+            for row in rows}
+
+
+def iter_export_rows(args=None):
+    """Yield filtered entries as export row tuples, fetched in batches."""
+    query = apply_export_filters(db.session.query(
+        Entry.date, Entry.time, Entry.type, Entry.material, Entry.client,
+        Entry.client_code, Entry.qty, Entry.bill_no, Entry.nimbus_no, Entry.created_by
+    ), args).order_by(Entry.date.desc(), Entry.time.desc())
+    for e_date, e_time, e_type, material, client, client_code, qty, bill_no, nimbus_no, created_by in iter_query_rows(query):
+        yield (e_date, e_time, e_type, material, client or '', client_code or '',
+               qty, bill_no or '', nimbus_no or '', created_by or 'System')
+
+
+PENDING_BILL_EXPORT_HEADERS = ['ClientCode', 'BillNo', 'ClientName', 'Amount', 'Reason', 'NimbusNo']
+
+
+def iter_pending_bill_rows():
+    """Yield every pending bill as an export row tuple, fetched in batches."""
+    return iter_query_rows(db.session.query(
+        PendingBill.client_code, PendingBill.bill_no, PendingBill.client_name,
+        PendingBill.amount, PendingBill.reason, PendingBill.nimbus_no
+    ).order_by(PendingBill.id.asc()))
+
+
+LEDGER_EXPORT_HEADERS = ['Date', 'Description', 'BillNo', 'Debit', 'Credit']
+
+
+def parse_iso_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def statement_contexts(clients, start_date=None, end_date=None):
+    """
+    Template variables of the statements of ``clients`` over [start_date, end_date].
+
+    Clients are computed in grouped chunks (see ``client_statements``); the
+    opening balance sums the movements before the range and the rows in range
+    carry a running balance.
+    """
+    for client, statement in client_statements(clients, start_date, end_date):
+        yield dict(statement, client=client, start_date=start_date, end_date=end_date, today=date.today())
+
+
+def statement_clients(codes):
+    """Clients with the given codes, or every active client, in code order."""
+    clients = Client.query.filter(Client.code.in_(codes)) if codes else Client.query.filter(Client.is_active == True)
+    return clients.order_by(Client.code).all()
+
+
+def tabular_chunks(headers, rows, fmt):
+    """Encode rows as CSV text chunks or as a spooled xlsx file read back in chunks."""
+    if fmt == 'csv':
+        return stream_csv(headers, rows)
+    return iter_file_chunks(write_xlsx(headers, rows))
+
+
+def render_inventory_report(args, today):
+    """
+    Render the inventory analysis report, reusing a cached render when possible.
+
+    Returns:
+        Tuple of (body bytes, extension) where extension is 'pdf', or 'html'
+        when flask_weasyprint is not installed
+    """
+    try:
+        from flask_weasyprint import HTML
+        ext = 'pdf'
+    except ImportError:
+        HTML = None
+        ext = 'html'
+
+    # The rendered report only changes with the filters, the report date or the data
+    key = render_cache.cache_key('inventory_analysis', [args.get(a) for a in EXPORT_FILTER_ARGS],
+                                 today, get_data_version())
+    body = render_cache.load('reports', key, ext)
+    if body is None:
+        entries = apply_export_filters(db.session.query(
+            Entry.date, Entry.time, Entry.type, Entry.material, Entry.client,
+            Entry.qty, Entry.bill_no, Entry.nimbus_no
+        ), args).order_by(Entry.date.desc(), Entry.time.desc()).all()
+        html = render_template('pdf_report.html', entries=entries, analysis=material_analysis(args), date=today)
+        body = HTML(string=html).write_pdf() if HTML else html.encode('utf-8')
+        render_cache.store('reports', key, ext, body)
+    return body, ext
+
+
 @import_export_bp.route('/export/<format>')
 @login_required
+@data_version_etag
 def export_data(format):
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    client_filter = request.args.get('client')
-    material_filter = request.args.get('material')
-    type_filter = request.args.get('type', 'BOTH')
-    
-    query = Entry.query
-    if start_date: query = query.filter(Entry.date >= start_date)
-    if end_date: query = query.filter(Entry.date <= end_date)
-    if client_filter: query = query.filter(Entry.client == client_filter)
-    if material_filter: query = query.filter(Entry.material == material_filter)
-    if type_filter != 'BOTH': query = query.filter(Entry.type == type_filter)
-    
-    entries = query.order_by(Entry.date.desc(), Entry.time.desc()).all()
-    
-    if format == 'pdf':
-        analysis = {}
-        for m in Material.query.all():
-            m_entries = [e for e in entries if e.material == m.name]
-            m_in = sum(e.qty for e in m_entries if e.type == 'IN')
-            m_out = sum(e.qty for e in m_entries if e.type == 'OUT')
-            analysis[m.name] = {'total': m_in, 'sent': m_out, 'remaining': m_in - m_out}
-        
-        html = render_template('pdf_report.html', entries=entries, analysis=analysis, date=date.today())
-        try:
-            from flask_weasyprint import HTML, render_pdf
-            return render_pdf(HTML(string=html), download_name=f"inventory_analysis_{date.today()}.pdf")
-        except ImportError:
-            return Response(html, mimetype="text/html")
-
-    data = []
-    for e in entries:
-        data.append({
-            'Date': e.date,
-            'Time': e.time,
-            'Type': e.type,
-            'Material': e.material,
-            'ClientName': e.client or '',
-            'ClientCode': e.client_code or '',
-            'Quantity': e.qty,
-            'bill_no': e.bill_no or '',
-            'nimbus_no': e.nimbus_no or '',
-            'Captured By': e.created_by or 'System'
-        })
-    df = pd.DataFrame(data)
-    
+    if format == 'csv':
+        # Stream straight from the cursor: constant memory, first byte sent immediately
+        return Response(stream_with_context(stream_csv(ENTRY_EXPORT_HEADERS, iter_export_rows())),
+                        mimetype="text/csv",
+                        headers={"Content-disposition": f"attachment; filename=inventory_report_{date.today()}.csv"})
+
     if format == 'excel':
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False)
-        output.seek(0)
+        # Write-only workbook spooled to a temp file, then streamed from disk
+        output = write_xlsx(ENTRY_EXPORT_HEADERS, iter_export_rows())
         return send_file(output, as_attachment=True, download_name=f"inventory_report_{date.today()}.xlsx")
-    
-    elif format == 'csv':
-        return Response(df.to_csv(index=False), mimetype="text/csv", 
-                        headers={"Content-disposition": f"attachment; filename=inventory_report_{date.today()}.csv"})
-    
+
+    if format == 'pdf':
+        today = date.today()
+        body, ext = render_inventory_report(request.args, today)
+        if ext == 'html':
+            return Response(body, mimetype="text/html")
+        return Response(body, mimetype="application/pdf",
+                        headers={"Content-disposition": f"attachment; filename=inventory_analysis_{today}.pdf"})
+
     return redirect(url_for('tracking'))
 
-import threading
-from flask import jsonify
+
+# --- Background export jobs ---
+@register_export_job('entries')
+def entries_export_job(params, progress):
+    fmt = 'csv' if params.get('format') == 'csv' else 'excel'
+    total = apply_export_filters(db.session.query(func.count(Entry.id)), params).scalar() or 0
+    rows = track_rows(iter_export_rows(params), progress, total)
+    ext = 'csv' if fmt == 'csv' else 'xlsx'
+    return f"inventory_report_{date.today()}.{ext}", tabular_chunks(ENTRY_EXPORT_HEADERS, rows, fmt)
+
+
+@register_export_job('pending_bills')
+def pending_bills_export_job(params, progress):
+    fmt = 'csv' if params.get('format') == 'csv' else 'excel'
+    total = db.session.query(func.count(PendingBill.id)).scalar() or 0
+    rows = track_rows(iter_pending_bill_rows(), progress, total)
+    ext = 'csv' if fmt == 'csv' else 'xlsx'
+    return f"pending_bills_{date.today()}.{ext}", tabular_chunks(PENDING_BILL_EXPORT_HEADERS, rows, fmt)
+
+
+@register_export_job('ledger')
+def ledger_export_job(params, progress):
+    client = db.session.get(Client, int(params.get('client_id') or 0))
+    if not client:
+        raise ValueError('Client not found')
+    fmt = 'csv' if params.get('format') == 'csv' else 'excel'
+    rows = db.session.execute(ledger_history_query(client), execution_options={'yield_per': EXPORT_BATCH_SIZE})
+    rows = track_rows(rows, progress, 0)
+    ext = 'csv' if fmt == 'csv' else 'xlsx'
+    return f"ledger_{client.code}_{date.today()}.{ext}", tabular_chunks(LEDGER_EXPORT_HEADERS, rows, fmt)
+
+
+@register_export_job('pdf_report')
+def pdf_report_export_job(params, progress):
+    today = date.today()
+    body, ext = render_inventory_report(params, today)
+    progress['current'] = progress['total'] = 1
+    return f"inventory_analysis_{today}.{ext}", [body]
+
+
+def document_specs(params):
+    """(name, cache namespace, cache key, render callable) for each invoice and statement a documents job covers."""
+    start_date, end_date = parse_iso_date(params.get('start_date')), parse_iso_date(params.get('end_date'))
+    codes = [c.strip() for c in (params.get('client_codes') or '').split(',') if c.strip()]
+    kinds = params.get('documents', 'both')
+    if not (start_date or end_date or codes):
+        raise ValueError('Choose a date range or a list of client codes')
+    specs = []
+
+    if kinds in ('both', 'invoices'):
+        invoices = Invoice.query
+        if start_date:
+            invoices = invoices.filter(Invoice.date >= start_date)
+        if end_date:
+            invoices = invoices.filter(Invoice.date <= end_date)
+        if codes:
+            invoices = invoices.filter(Invoice.client_code.in_(codes))
+        for inv in invoices.order_by(Invoice.date, Invoice.id):
+            name = f"invoices/invoice-{inv.invoice_no.lstrip('#')}"
+            specs.append((name, 'invoices', invoice_cache_key(inv), lambda inv=inv: render_invoice_html(inv)))
+
+    if kinds in ('both', 'statements'):
+        specs.extend(statement_specs(statement_contexts(statement_clients(codes), start_date, end_date)))
+    return specs
+
+
+def statement_specs(contexts):
+    """Document specs of computed statement contexts."""
+    # Statements span several tables, so they are keyed by the global data version
+    version = get_data_version()
+    specs = []
+    for context in contexts:
+        client = context['client']
+        key = render_cache.cache_key('statement', client.id, context['start_date'], context['end_date'], version)
+        render = lambda context=context: render_template('statement_document.html', **context)
+        specs.append((f"statements/statement-{client.code}", 'statements', key, render))
+    return specs
+
+
+@register_export_job('documents', bundle=True)
+def documents_export_job(params, progress):
+    specs = document_specs(params)
+    progress['total'] = len(specs)
+    return f"documents_{date.today()}.zip", render_documents(specs, progress)
+
+
+STATEMENT_EXPORT_HEADERS = ['ClientCode', 'Client', 'Date', 'Description', 'BillNo', 'Debit', 'Credit', 'Balance']
+
+
+def statement_workbook_rows(contexts):
+    """One block of rows per statement: opening balance, movements, closing balance."""
+    for context in contexts:
+        client = context['client']
+        yield [client.code, client.name, context['start_date'], 'Opening Balance', '', None, None,
+               context['opening_balance']]
+        for row in context['rows']:
+            yield [client.code, client.name, row['posted_at'], row['description'], row['bill_no'] or '',
+                   row['debit'], row['credit'], row['balance']]
+        yield [client.code, client.name, context['end_date'] or context['today'], 'Closing Balance', '',
+               context['total_debit'], context['total_credit'], context['closing_balance']]
+
+
+@register_export_job('statements', bundle=True)
+def statements_export_job(params, progress):
+    """Every selected client's statement as a document, plus all of them in one workbook."""
+    start_date, end_date = parse_iso_date(params.get('start_date')), parse_iso_date(params.get('end_date'))
+    codes = [c.strip() for c in (params.get('client_codes') or '').split(',') if c.strip()]
+    contexts = list(statement_contexts(statement_clients(codes), start_date, end_date))
+    specs = statement_specs(contexts)
+    progress['total'] = len(specs) + 1
+    period = f"{start_date or 'start'}_{end_date or date.today()}"
+
+    def members():
+        yield from render_documents(specs, progress)
+        workbook = write_xlsx(STATEMENT_EXPORT_HEADERS, statement_workbook_rows(contexts), sheet_title='Statements')
+        with workbook:
+            yield f"statements_{period}.xlsx", workbook.read()
+        progress['current'] += 1
+
+    return f"statements_{period}.zip", members()
+
+
+@import_export_bp.route('/export_jobs', methods=['POST'])
+@login_required
+def start_export_job():
+    data = request.get_json(silent=True) or request.form.to_dict()
+    kind = data.pop('kind', 'entries')
+    # Blank filters are dropped so equivalent requests share one artifact
+    params = {k: v for k, v in data.items() if v not in (None, '')}
+    try:
+        job, reused = submit_export_job(current_app._get_current_object(), kind, params, current_user.username)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    result = job_status(job)
+    result.update({
+        'success': True,
+        'reused': reused,
+        'status_url': url_for('import_export.export_job_status', job_id=job.id),
+        'download_url': url_for('import_export.download_export_job', job_id=job.id)
+    })
+    return jsonify(result)
+
+
+@import_export_bp.route('/export_jobs/<int:job_id>')
+@login_required
+def export_job_status(job_id):
+    job = db.session.get(ExportJob, job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    result = job_status(job)
+    result['success'] = True
+    if job.status == 'DONE':
+        result['download_url'] = url_for('import_export.download_export_job', job_id=job.id)
+    return jsonify(result)
+
+
+@import_export_bp.route('/export_jobs/<int:job_id>/download')
+@login_required
+def download_export_job(job_id):
+    job = db.session.get(ExportJob, job_id)
+    if not job or job.status != 'DONE' or not os.path.exists(artifact_path(job)):
+        return jsonify({'success': False, 'error': 'Export not ready'}), 404
+    return send_file(artifact_path(job), as_attachment=True, download_name=job.file_name,
+                     mimetype='application/zip')
 
 import_progress = {'current': 0, 'total': 0, 'done': False}
 
@@ -135,15 +399,15 @@ def import_data_ajax():
         return jsonify({'success': False, 'error': 'No file provided'})
 
     try:
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
-        else:
-            df = pd.read_excel(file)
+        df = read_mapped_table(file, 'entries')
         
         import_progress = {'current': 0, 'total': len(df), 'done': False}
+        client_index = build_client_index()
         
         if mode == 'daily' and import_date:
+            bump_linked_invoices(Entry, Entry.date == import_date)
             Entry.query.filter_by(date=import_date).delete()
+            invalidate_stock_snapshots(since=import_date)
 
         today_str = date.today().strftime('%Y-%m-%d')
         now_time_str = datetime.now().strftime('%H:%M:%S')
@@ -173,20 +437,25 @@ def import_data_ajax():
                 # Clean up name for comparison
                 clean_name = client_name.strip().upper()
                 existing_client = Client.query.filter(
-                    (func.upper(Client.name) == clean_name) | 
+                    (func.upper(Client.name) == clean_name) |
                     (Client.code == client_code if client_code else False)
                 ).first()
-                
+                exact_match = existing_client is not None
+                if not exact_match:
+                    existing_client = match_client(client_name, client_index)
+
                 if not existing_client:
                     if not client_code or client_code == '' or client_code == 'nan':
                         client_code = generate_client_code()
                     existing_client = Client(name=client_name, code=client_code)
                     db.session.add(existing_client)
                     db.session.flush()
+                    client_index.add(existing_client.id, existing_client.name)
                 else:
                     client_code = existing_client.code
-                    # Update name if it was previously less complete
-                    if len(client_name) > len(existing_client.name):
+                    # Update name if it was previously less complete. A fuzzy match is only a
+                    # guess, and ledger rows keyed by the old name would be left behind.
+                    if exact_match and len(client_name) > len(existing_client.name):
                         existing_client.name = client_name
             
             row_date = str(row.get('Date', '')).strip()
@@ -243,6 +512,7 @@ def process_jumble_import():
     now_time_str = datetime.now().strftime('%H:%M:%S')
     
     try:
+        client_index = build_client_index()
         for row in rows:
             bill_no = str(row.get('bill_no', '')).strip()
             client_name = str(row.get('client_name', '')).strip()
@@ -255,13 +525,14 @@ def process_jumble_import():
             existing_client = Client.query.filter(
                 (func.upper(Client.name) == client_name.upper()) | 
                 (Client.code == client_code)
-            ).first()
+            ).first() or match_client(client_name, client_index)
             
             if not existing_client:
                 if not client_code: client_code = generate_client_code()
                 existing_client = Client(name=client_name, code=client_code)
                 db.session.add(existing_client)
                 db.session.flush()
+                client_index.add(existing_client.id, existing_client.name)
             else:
                 client_code = existing_client.code
 
@@ -309,13 +580,11 @@ def import_pending_bills():
         return redirect(url_for('import_export.import_export_page'))
 
     try:
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
-        else:
-            df = pd.read_excel(file)
+        df = read_mapped_table(file, 'pending_bills')
 
         today_str = date.today().strftime('%Y-%m-%d')
         count = 0
+        client_index = build_client_index()
         
         for _, row in df.iterrows():
             client_name = str(row.get('ClientName', '')).strip()
@@ -336,13 +605,14 @@ def import_pending_bills():
             client = Client.query.filter(
                 (func.upper(Client.name) == clean_name) | 
                 (Client.code == client_code if client_code else False)
-            ).first()
+            ).first() or match_client(client_name, client_index)
 
             if not client:
                 if not client_code or client_code == 'nan': client_code = generate_client_code()
                 client = Client(name=client_name, code=client_code)
                 db.session.add(client)
                 db.session.flush()
+                client_index.add(client.id, client.name)
             
             client_code = client.code
             
@@ -3,6 +3,7 @@ from flask_login import login_required
 from datetime import date
 from sqlalchemy import func, case
 from models import db, Material, Entry
+from utils.http_cache import data_version_etag
 
 # Module configuration
 MODULE_CONFIG = {
@@ -16,6 +17,7 @@ inventory_bp = Blueprint('inventory', __name__)
 
 @inventory_bp.route('/stock_summary')
 @login_required
+@data_version_etag
 def stock_summary():
     sel_date = request.args.get('date', date.today().strftime('%Y-%m-%d'))
     
@@ -54,6 +56,7 @@ def stock_summary():
 
 @inventory_bp.route('/daily_transactions')
 @login_required
+@data_version_etag
 def daily_transactions():
     # Support date range and category filtering
     date_from = request.args.get('date_from') or request.args.get('date') or date.today().strftime('%Y-%m-%d')
@@ -5,9 +5,26 @@ from flask_login import LoginManager, login_user, login_required, logout_user, c
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime, date
-from sqlalchemy import func, case
+from sqlalchemy import func, case, select, update
 from types import SimpleNamespace
-from models import db, User, Client, Material, Entry, PendingBill, Booking, BookingItem, Payment, Invoice, BillCounter, DirectSale, DirectSaleItem
+from models import db, User, Client, Material, Entry, PendingBill, Booking, BookingItem, Payment, Invoice, DirectSale, DirectSaleItem
+import utils.data_version  # registers the data-version session listeners
+from utils.invoice_versions import bump_invoice_versions, bump_linked_invoices  # also registers its session listeners
+from utils.http_cache import data_version_etag
+from utils.documents import invoice_card_html, invoice_document_path
+from utils.export_jobs import fail_orphaned_jobs
+from utils.name_matching import build_client_index, match_client
+from utils.column_mapping import read_mapped_table
+from utils.bill_numbers import get_next_bill_no, peek_next_bill_no, bill_no_number, backfill_bill_no_numbers
+from utils.payment_allocation import (allocate_payment, release_payment, outstanding_by_bill, client_outstanding,
+                                      delete_bill_allocations, sync_bill_paid)
+from utils.client_balances import (client_balances, ensure_client_balances, rebuild_client_balances,
+                                    refresh_client_balances)
+from utils.receivables import (AGING_BUCKETS, AGING_EXPORT_HEADERS, UNDATED_BUCKET, aging_report,
+                               backfill_pending_bill_dates, iter_aging_export_rows)
+from utils.ledger import financial_page, material_page
+from utils.stock_ledger import current_stock, invalidate_stock_snapshots, stock_page
+from utils.bill_registry import ensure_bill_registry, find_bill_owner, first_entry_for_bill, search_bill_numbers, sync_bills
 
 app = Flask(__name__)
 # Increase max content length to 16MB to handle large JSON imports
@@ -42,18 +59,6 @@ def generate_material_code():
     return f"tmpm-{num:05d}"
 
 
-def get_next_bill_no():
-    counter = BillCounter.query.first()
-    if not counter:
-        counter = BillCounter(count=1000)
-        db.session.add(counter)
-        db.session.commit()
-    no = f"#{counter.count}"
-    counter.count += 1
-    db.session.commit()
-    return no
-
-
 def save_photo(file):
     if file and file.filename != '':
         filename = secure_filename(
@@ -106,7 +111,7 @@ def _ensure_user_password_column():
 # Run early migration once at import-time so subsequent imports/requests are safe
 
 def _ensure_model_columns():
-    """Add any missing columns declared in models but missing in the DB.
+    """Add any missing columns and indexes declared in models but missing in the DB.
 
     This is a pragmatic, best-effort migration helper to bring older SQLite
     databases in sync. It maps common SQLAlchemy types to reasonable SQLite
@@ -143,6 +148,14 @@ def _ensure_model_columns():
     except Exception:
         db.session.rollback()
 
+    # create_all() skips indexes on tables that already exist, so add any declared ones now
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception:
+                pass
+
 
 with app.app_context():
     db.create_all()
@@ -158,20 +171,33 @@ with app.app_context():
         # Best-effort: continue even if generic migration fails
         pass
 
+    try:
+        backfill_bill_no_numbers()
+    except Exception:
+        db.session.rollback()
 
-# --- Helper Functions ---
-def get_next_bill_no():
-    counter = BillCounter.query.first()
-    if not counter:
-        counter = BillCounter(count=1000)
-        db.session.add(counter)
-        db.session.commit()
-    no = f"#{counter.count}"
-    counter.count += 1
-    db.session.commit()
-    return no
+    try:
+        backfill_pending_bill_dates()
+    except Exception:
+        db.session.rollback()
+
+    try:
+        ensure_bill_registry()
+    except Exception:
+        db.session.rollback()
+
+    try:
+        ensure_client_balances()
+    except Exception:
+        db.session.rollback()
+
+    try:
+        fail_orphaned_jobs()
+    except Exception:
+        db.session.rollback()
 
 
+# --- Helper Functions ---
 def save_photo(file):
     if file and file.filename != '':
         filename = secure_filename(
@@ -191,12 +217,7 @@ def bookings_page():
     bookings = Booking.query.order_by(Booking.date_posted.desc()).all()
     clients = Client.query.filter_by(is_active=True).all()
     materials = Material.query.all()
-    counter = BillCounter.query.first()
-    if not counter:
-        counter = BillCounter(count=1000)
-        db.session.add(counter)
-        db.session.commit()
-    next_auto = f"#{counter.count}"
+    next_auto = peek_next_bill_no()
     return render_template('bookings.html',
                            bookings=bookings,
                            clients=clients,
@@ -260,12 +281,7 @@ def add_booking():
 def payments_page():
     payments = Payment.query.order_by(Payment.date_posted.desc()).all()
     clients = Client.query.filter_by(is_active=True).all()
-    counter = BillCounter.query.first()
-    if not counter:
-        counter = BillCounter(count=1000)
-        db.session.add(counter)
-        db.session.commit()
-    next_auto = f"#{counter.count}"
+    next_auto = peek_next_bill_no()
     return render_template('payments.html',
                            payments=payments,
                            clients=clients,
@@ -291,38 +307,15 @@ def add_payment():
     db.session.add(payment)
     db.session.flush()
 
-    # Apply payment to matching pending bills when possible
-    remaining = float(amount)
-    applied = []
-
-    # Prefer matching by bill_no when provided
-    if manual_bill_no:
-        pending_q = PendingBill.query.filter_by(bill_no=manual_bill_no).order_by(PendingBill.id.asc()).all()
-    else:
-        # Otherwise apply to oldest unpaid bills for this client
-        pending_q = PendingBill.query.filter_by(client_name=client_name, is_paid=False).order_by(PendingBill.id.asc()).all()
-
-    for pb in pending_q:
-        if remaining <= 0:
-            break
-        if pb.is_paid:
-            continue
-        if remaining >= (pb.amount or 0):
-            remaining -= (pb.amount or 0)
-            pb.amount = 0
-            pb.is_paid = True
-            applied.append((pb.bill_no, 'paid'))
-        else:
-            pb.amount = (pb.amount or 0) - remaining
-            applied.append((pb.bill_no, f'partial {remaining:.2f}'))
-            remaining = 0
-
+    # Apply payment to the matching bill number when provided, otherwise to the client's oldest unpaid bills
+    applied = allocate_payment(payment, bill_no=manual_bill_no)
     db.session.commit()
 
     msg = 'Payment received successfully'
     if applied:
         details = ', '.join([f"{b}: {s}" for b, s in applied])
         msg += f" — applied to: {details}"
+        msg += f" (outstanding now {client_outstanding(client_name):.2f})"
     flash(msg, 'success')
     return redirect(url_for('payments_page'))
 
@@ -338,32 +331,16 @@ def view_bill(bill_no):
     # Support both with and without #
     search_no = bill_no if bill_no.startswith('#') else f"#{bill_no}"
 
-    booking = Booking.query.filter_by(auto_bill_no=search_no).first()
-    payment = Payment.query.filter_by(auto_bill_no=search_no).first()
-    invoice = Invoice.query.filter_by(invoice_no=search_no).first()
-
-    if booking:
-        return render_template('view_bill.html', bill=booking, type='Booking', items=booking.items)
-    if payment:
-        return render_template('view_bill.html', bill=payment, type='Payment')
-    if invoice:
-        # Shape invoice into expected template fields
-        # Provide `auto_bill_no`, `amount`, `paid_amount`, `date_posted`, and `items` for compatibility
-        invoice.auto_bill_no = invoice.invoice_no
-        invoice.amount = invoice.total_amount
-        invoice.paid_amount = (invoice.total_amount - invoice.balance) if invoice.total_amount is not None and invoice.balance is not None else 0
-        invoice.date_posted = datetime.combine(invoice.date, datetime.min.time()) if invoice.date else None
-
-        # Build items list from linked DirectSale items if available, otherwise from entries
-        items = []
-        if getattr(invoice, 'direct_sales', None):
-            # Use first linked direct sale's items for display
-            if invoice.direct_sales:
-                ds = invoice.direct_sales[0]
-                items = [{'name': it.product_name, 'qty': it.qty} for it in ds.items]
-        if not items and getattr(invoice, 'entries', None):
-            items = [{'name': e.material, 'qty': e.qty} for e in invoice.entries]
-        return render_template('view_bill.html', bill=invoice, type='Invoice', items=items)
+    owner_type, record = find_bill_owner(
+        search_no, [('Booking', 'auto_bill_no'), ('Payment', 'auto_bill_no'), ('Invoice', 'invoice_no')])
+
+    if owner_type == 'Booking':
+        return render_template('view_bill.html', bill=record, type='Booking', items=record.items)
+    if owner_type == 'Payment':
+        return render_template('view_bill.html', bill=record, type='Payment')
+    if owner_type == 'Invoice':
+        # The card is cached per invoice version; only the layout is rendered per request
+        return render_template('view_bill.html', card_html=invoice_card_html(record))
 
 
     flash('Bill not found', 'danger')
@@ -373,32 +350,16 @@ def view_bill(bill_no):
 @app.route('/download_invoice/<path:bill_no>')
 @login_required
 def download_invoice(bill_no):
-    # For now, provide a simple HTML download of the invoice details. PDF generation could be added later.
     search_no = bill_no if bill_no.startswith('#') else f"#{bill_no}"
     inv = Invoice.query.filter_by(invoice_no=search_no).first()
     if not inv:
         flash('Invoice not found', 'danger')
         return redirect(url_for('index'))
 
-    # Render the invoice view and send as an attachment (HTML) for convenience
-    inv.auto_bill_no = inv.invoice_no
-    inv.amount = inv.total_amount
-    inv.paid_amount = (inv.total_amount - inv.balance) if inv.total_amount is not None and inv.balance is not None else 0
-    inv.date_posted = datetime.combine(inv.date, datetime.min.time()) if inv.date else None
-
-    items = []
-    if getattr(inv, 'direct_sales', None) and inv.direct_sales:
-        ds = inv.direct_sales[0]
-        items = [{'name': it.product_name, 'qty': it.qty} for it in ds.items]
-    if not items and getattr(inv, 'entries', None):
-        items = [{'name': e.material, 'qty': e.qty} for e in inv.entries]
-
-    rendered = render_template('view_bill.html', bill=inv, type='Invoice', items=items)
-    from flask import make_response
-    response = make_response(rendered)
-    response.headers['Content-Disposition'] = f'attachment; filename=invoice-{inv.invoice_no}.html'
-    response.headers['Content-Type'] = 'text/html; charset=utf-8'
-    return response
+    # PDF when weasyprint is installed, otherwise the standalone HTML page; cached per invoice version
+    path, file_name = invoice_document_path(inv)
+    mimetype = 'application/pdf' if file_name.endswith('.pdf') else 'text/html'
+    return send_file(path, as_attachment=True, download_name=file_name, mimetype=mimetype)
 
 
 @app.route('/edit_bill/Booking/<int:id>', methods=['POST'])
@@ -437,8 +398,14 @@ def edit_booking(id):
 @login_required
 def edit_payment(id):
     payment = Payment.query.get_or_404(id)
-    payment.amount = float(request.form.get('amount', 0))
-    payment.manual_bill_no = request.form.get('manual_bill_no')
+    amount = float(request.form.get('amount', 0))
+    manual_bill_no = request.form.get('manual_bill_no')
+    reallocate = amount != payment.amount or manual_bill_no != payment.manual_bill_no
+    payment.amount = amount
+    payment.manual_bill_no = manual_bill_no
+    if reallocate:
+        release_payment(payment.id)
+        allocate_payment(payment, bill_no=manual_bill_no)
 
     new_photo = save_photo(request.files.get('photo'))
     if new_photo:
@@ -462,12 +429,7 @@ def direct_sales_page():
     if 'Cash' not in categories:
         categories.insert(0, 'Cash')
     client_name_prefill = request.args.get('client_name', '').strip()
-    counter = BillCounter.query.first()
-    if not counter:
-        counter = BillCounter(count=1000)
-        db.session.add(counter)
-        db.session.commit()
-    next_auto = f"#{counter.count}"
+    next_auto = peek_next_bill_no()
     return render_template('direct_sales.html',
                            sales=sales,
                            materials=materials,
@@ -543,7 +505,7 @@ def add_direct_sale():
             invoice_no = get_next_bill_no()
             is_manual = False
 
-        # Ensure uniqueness
+        # Ensure uniqueness: manual invoice numbers share the auto-number namespace
         existing_global = Invoice.query.filter_by(invoice_no=invoice_no).first()
         if existing_global and not is_manual:
             # auto-generated collided; generate until unique
@@ -704,6 +666,9 @@ def edit_direct_sale(id):
         sale.photo_path = new_photo
 
     DirectSaleItem.query.filter_by(sale_id=id).delete()
+    # The bulk delete bypasses the flush listeners; the removed items may be of any material
+    invalidate_stock_snapshots(since=sale.date_posted.date().isoformat() if sale.date_posted else None)
+    bump_invoice_versions(sale_ids=[id])
 
     materials = request.form.getlist('product_name[]')
     qtys = request.form.getlist('qty[]')
@@ -739,6 +704,8 @@ def delete_bill(type, id):
         bill = None
 
     if bill:
+        if type == 'Payment':
+            release_payment(bill.id)
         db.session.delete(bill)
         db.session.commit()
         flash(f'{type} deleted successfully', 'success')
@@ -758,89 +725,41 @@ def ledger_page():
     return render_template('ledger.html', clients=clients)
 
 
+def parse_date_arg(name):
+    """A 'YYYY-MM-DD' query arg as a date; None when missing or malformed."""
+    try:
+        return datetime.strptime(request.args.get(name, ''), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
 @app.route('/ledger/<int:client_id>')
 @login_required
+@data_version_etag
 def financial_ledger(client_id):
     client = Client.query.get_or_404(client_id)
-    
+    start_date = parse_date_arg('start_date')
+    end_date = parse_date_arg('end_date')
+
     # 1. Fetch Pending Bills from PendingBill table matching client_code
     pending_bills = PendingBill.query.filter_by(client_code=client.code).order_by(PendingBill.id.desc()).all()
-    
-    # 2. Financial Ledger (Transactions) - Used for calculating balance
-    bookings = Booking.query.filter_by(client_name=client.name).all()
-    payments = Payment.query.filter_by(client_name=client.name).all()
-    direct_sales = DirectSale.query.filter_by(client_name=client.name).all()
-
-    financial_history = []
-    for b in bookings:
-        financial_history.append({
-            'date': b.date_posted,
-            'description': 'Booking',
-            'bill_no': b.auto_bill_no,
-            'debit': b.amount,
-            'credit': b.paid_amount,
-            'type': 'Booking',
-            'id': b.id
-        })
-    for p in payments:
-        financial_history.append({
-            'date': p.date_posted,
-            'description': f'Payment ({p.method})',
-            'bill_no': p.auto_bill_no,
-            'debit': 0,
-            'credit': p.amount,
-            'type': 'Payment',
-            'id': p.id
-        })
-    for s in direct_sales:
-        financial_history.append({
-            'date': s.date_posted,
-            'description': 'Direct Sale',
-            'bill_no': s.auto_bill_no,
-            'debit': s.amount,
-            'credit': s.paid_amount,
-            'type': 'DirectSale',
-            'id': s.id
-        })
-    
-    financial_history.sort(key=lambda x: x['date'], reverse=True)
 
-    # 3. Material Ledger (Deliveries and Direct Sales)
-    # We use bill_no to ensure we don't double count if a delivery and a sale share a bill_no
-    deliveries = Entry.query.filter(
-        (Entry.client_code == client.code) | (Entry.client == client.name),
-        Entry.type == 'OUT'
-    ).order_by(Entry.date.desc(), Entry.time.desc()).all()
+    # 2. Financial Ledger: one UNION ALL page with a window running balance
+    financial_history, next_after = financial_page(client, start_date, end_date, request.args.get('after'))
 
-    material_history = []
-    seen_material_bills = set()
-    
-    for d in deliveries:
-        material_history.append({
-            'date': d.date,
-            'material': d.material,
-            'qty': d.qty,
-            'bill_no': d.bill_no,
-            'nimbus_no': d.nimbus_no
-        })
-        if d.bill_no: seen_material_bills.add(d.bill_no)
-
-    for s in direct_sales:
-        if s.auto_bill_no not in seen_material_bills:
-            for item in s.items:
-                material_history.append({
-                    'date': s.date_posted.strftime('%Y-%m-%d'),
-                    'material': item.product_name,
-                    'qty': item.qty,
-                    'bill_no': s.auto_bill_no,
-                    'nimbus_no': 'Direct Sale'
-                })
+    # 3. Material Ledger (Deliveries and Direct Sales), keyset-paged the same way
+    material_history, next_material_after = material_page(client, start_date, end_date,
+                                                          request.args.get('material_after'))
 
     return render_template('client_ledger.html',
                            client=client,
                            pending_bills=pending_bills,
                            financial_history=financial_history,
-                           material_history=material_history)
+                           material_history=material_history,
+                           start_date=start_date,
+                           end_date=end_date,
+                           next_after=next_after,
+                           next_material_after=next_material_after)
 
 
 @app.route('/financial_ledger/<int:client_id>')
@@ -851,47 +770,22 @@ def financial_ledger_details(client_id):
 
 @app.route('/material_ledger/<int:mat_id>')
 @login_required
+@data_version_etag
 def material_ledger_page(mat_id):
     material = Material.query.get_or_404(mat_id)
-    # Use stock-in entries (Entry.type == 'IN') to represent additions to stock
-    stock_ins = Entry.query.filter_by(material=material.name, type='IN').all()
-    sales = DirectSaleItem.query.filter_by(product_name=material.name).all()
-
-    all_transactions = []
-    for e in stock_ins:
-        all_transactions.append({
-            'date': e.date if not isinstance(e.date, str) else datetime.strptime(e.date, '%Y-%m-%d'),
-            'item': e.material,
-            'bill_no': e.bill_no or '',
-            'add': e.qty,
-            'delivered': 0
-        })
-    for s in sales:
-        all_transactions.append({
-            'date': s.direct_sale.date_posted,
-            'item': s.product_name,
-            'bill_no': s.direct_sale.auto_bill_no,
-            'add': 0,
-            'delivered': s.qty
-        })
-
-    all_transactions.sort(key=lambda x: x['date'])
-    history = []
-    running_balance = 0
-    for t in all_transactions:
-        running_balance += (t['add'] - t['delivered'])
-        history.append({
-            'date': t['date'].strftime('%d-%m-%Y'),
-            'item': t['item'],
-            'bill_no': t['bill_no'],
-            'add': t['add'],
-            'delivered': t['delivered'],
-            'balance': running_balance
-        })
-
+    start_date = parse_date_arg('start_date')
+    end_date = parse_date_arg('end_date')
+    # IN and OUT entries plus undispatched direct-sale items, one window-balanced page
+    history, next_after, opening_balance = stock_page(material.name, start_date, end_date,
+                                                      request.args.get('after'))
     return render_template('material_ledger.html',
                            material=material,
-                           history=history)
+                           history=history,
+                           stock=current_stock(material.name),
+                           opening_balance=opening_balance,
+                           start_date=start_date,
+                           end_date=end_date,
+                           next_after=next_after)
 
 
 @app.route('/view_bill_detail/<string:type>/<int:id>')
@@ -922,6 +816,7 @@ def load_user(user_id):
 
 @app.route('/')
 @login_required
+@data_version_etag
 def index():
     today = date.today().strftime('%B %d, %Y')
     client_count = db.session.query(func.count(Client.id)).scalar() or 0
@@ -969,6 +864,14 @@ def api_clients_search():
     clients = Client.query.filter(
         db.or_(Client.name.ilike(f'%{q}%'),
                Client.code.ilike(f'%{q}%'))).limit(10).all()
+    # Top up substring hits with fuzzy matches ("ms ahmed trader" -> "M/S Ahmed Traders")
+    if len(clients) < 10 and len(q) >= 3:
+        from utils.name_matching import get_client_index
+        seen = {c.id for c in clients}
+        fuzzy_ids = [key for key, _, _ in get_client_index().search(q, limit=10) if key not in seen]
+        if fuzzy_ids:
+            by_id = {c.id: c for c in Client.query.filter(Client.id.in_(fuzzy_ids))}
+            clients += [by_id[i] for i in fuzzy_ids if i in by_id][:10 - len(clients)]
     return jsonify([{'name': c.name, 'code': c.code} for c in clients])
 
 
@@ -1071,7 +974,9 @@ def clients():
 
     # Calculate stats for all visible clients
     all_visible_clients = active_pagination.items + inactive_pagination.items
+    balances = client_balances(c.name for c in all_visible_clients)
     for c in all_visible_clients:
+        c.ledger_balance, c.pending_balance = balances.get(c.name, (0.0, 0.0))
         c.total_bills = db.session.query(func.count(PendingBill.id)).filter_by(client_code=c.code).scalar() or 0
         c.total_deliveries = db.session.query(func.sum(Entry.qty)).filter_by(client=c.name, type='OUT').scalar() or 0
 
@@ -1146,6 +1051,7 @@ def edit_client(id):
             })
             # Legacy check for name-based entries
             Entry.query.filter_by(client=old_name).update({'client': new_name})
+            refresh_client_balances([old_name, new_name])
 
         c.name = new_name
         c.code = new_code
@@ -1208,6 +1114,7 @@ def transfer_client(id):
             target_client.code
         })
 
+    refresh_client_balances([source_client.name, target_client.name])
     source_client.is_active = False
     source_client.transferred_to_id = target_client.id
     db.session.commit()
@@ -1286,6 +1193,7 @@ def dispatching():
     return render_template('dispatching.html',
                            materials=mats,
                            clients=cls,
+                           balances=client_balances(c.name for c in cls),
                            today_date=today)
 
 
@@ -1498,7 +1406,9 @@ def edit_entry(id):
     if e.type == 'OUT':
         # Case: bill removed on edit -> delete associated PendingBill
         if not e.bill_no and old_bill_no:
-            PendingBill.query.filter_by(bill_no=old_bill_no, client_code=old_client_code).delete()
+            # Deleted one by one so the balance and registry flush hooks see them
+            for stale in PendingBill.query.filter_by(bill_no=old_bill_no, client_code=old_client_code):
+                db.session.delete(stale)
         else:
             # Try to find by new bill_no first, then fall back to old bill_no
             pb = None
@@ -1588,6 +1498,7 @@ def delete_entry(id):
 
 @app.route('/client_ledger/<int:id>')
 @login_required
+@data_version_etag
 def client_ledger(id):
     client = db.session.get(Client, id)
     if client:
@@ -1621,6 +1532,7 @@ def client_ledger(id):
 
 @app.route('/tracking')
 @login_required
+@data_version_etag
 def tracking():
     s = request.args.get('start_date')
     end = request.args.get('end_date')
@@ -1915,12 +1827,16 @@ def delete_selected_data():
             Client.query.delete()
             deleted_info.append('Clients')
         if 'pending_bills' in targets:
+            delete_bill_allocations()
             PendingBill.query.delete()
             deleted_info.append('Pending Bills')
         if 'dispatching' in targets:
+            # Invoices lose the removed lines; bump them while the rows still link them
+            bump_linked_invoices(Entry, Entry.type == 'OUT')
             Entry.query.filter_by(type='OUT').delete()
             deleted_info.append('Dispatching Entries')
         if 'receiving' in targets:
+            bump_linked_invoices(Entry, Entry.type == 'IN')
             Entry.query.filter_by(type='IN').delete()
             deleted_info.append('Receiving Entries')
         if 'materials' in targets:
@@ -1928,10 +1844,13 @@ def delete_selected_data():
             deleted_info.append('Materials')
         if 'direct_sales' in targets:
             # Remove line items first to avoid FK issues, then sales
+            bump_linked_invoices(DirectSale)
             DirectSaleItem.query.delete()
             DirectSale.query.delete()
             deleted_info.append('Direct Sales')
         if 'payments' in targets:
+            # Bills settled by the removed payments stay marked paid; only the allocation records go
+            delete_bill_allocations()
             Payment.query.delete()
             deleted_info.append('Payments')
         if 'bookings' in targets:
@@ -1940,7 +1859,10 @@ def delete_selected_data():
             Booking.query.delete()
             deleted_info.append('Bookings')
 
+        if {'dispatching', 'receiving', 'materials', 'direct_sales'} & set(targets):
+            invalidate_stock_snapshots()
         db.session.commit()
+        rebuild_client_balances()
         flash(f'Data Wiped: {", ".join(deleted_info)}', 'danger')
     except Exception as e:
         db.session.rollback()
@@ -1959,7 +1881,7 @@ def delete_all_data():
 @app.route('/api/check_bill/<path:bill_no>')
 @login_required
 def check_bill_api(bill_no):
-    entry = Entry.query.filter_by(bill_no=bill_no).first()
+    entry = first_entry_for_bill(bill_no)
     if entry:
         return jsonify({
             'exists': True,
@@ -1970,6 +1892,14 @@ def check_bill_api(bill_no):
     return jsonify({'exists': False})
 
 
+@app.route('/api/bills/search')
+@login_required
+def api_bills_search():
+    """Autocomplete for bill/invoice numbers starting with ``q``."""
+    q = request.args.get('q', '').strip()
+    return jsonify(search_bill_numbers(q))
+
+
 @app.route('/toggle_bill_paid/<int:id>', methods=['POST'])
 @login_required
 def toggle_bill_paid(id):
@@ -1981,19 +1911,20 @@ def toggle_bill_paid(id):
     return jsonify({'success': False}), 404
 
 
-@app.route('/pending_bills')
-@login_required
-def pending_bills():
-    page = request.args.get('page', 1, type=int)
-    category = request.args.get('category', '').strip()
-    filters = {
-        'client_code': request.args.get('client_code', '').strip(),
-        'bill_no': request.args.get('bill_no', '').strip(),
-        'bill_from': request.args.get('bill_from', '').strip(),
-        'bill_to': request.args.get('bill_to', '').strip(),
-        'category': category,
-        'is_cash': request.args.get('is_cash', '').strip()
+def pending_bill_filters(args):
+    """Pending bills page filters from request args (or any mapping)."""
+    return {
+        'client_code': (args.get('client_code') or '').strip(),
+        'bill_no': (args.get('bill_no') or '').strip(),
+        'bill_from': (args.get('bill_from') or '').strip(),
+        'bill_to': (args.get('bill_to') or '').strip(),
+        'category': (args.get('category') or '').strip(),
+        'is_cash': (args.get('is_cash') or '').strip()
     }
+
+
+def filtered_pending_bills(filters):
+    """PendingBill query narrowed by the pending bills page filters."""
     query = PendingBill.query
     if filters['client_code']:
         query = query.filter(PendingBill.client_code == filters['client_code'])
@@ -2006,27 +1937,139 @@ def pending_bills():
         try:
             bf = int(filters['bill_from'])
             bt = int(filters['bill_to'])
-            # We need to cast bill_no to integer for comparison if possible
-            # SQLite casting: CAST(bill_no AS INTEGER)
-            query = query.filter(
-                func.cast(PendingBill.bill_no, db.Integer).between(bf, bt))
+            # Indexed integer copy of bill_no, so this is a range scan
+            query = query.filter(PendingBill.bill_no_num.between(bf, bt))
         except:
             pass
 
-    if category:
+    if filters['category']:
         query = query.join(Client,
                            PendingBill.client_code == Client.code).filter(
-                               Client.category == category)
+                               Client.category == filters['category'])
+    return query
+
+
+# Actions accepted by /pending_bills/bulk
+PENDING_BILL_BULK_ACTIONS = ('mark_paid', 'mark_unpaid', 'reassign', 'set_reason')
+
+
+def bulk_update_pending_bills(selected_ids, action, client=None, reason=None):
+    """
+    Apply one action to every selected pending bill with set-based UPDATEs.
+
+    Args:
+        selected_ids: List or SELECT of PendingBill ids
+        action: One of PENDING_BILL_BULK_ACTIONS
+        client: Target Client for 'reassign'
+        reason: New reason for 'set_reason'
+
+    Returns:
+        Dict of affected row counts (the caller commits)
+    """
+    in_selection = PendingBill.id.in_(selected_ids)
+    touched_names = set(db.session.execute(
+        select(PendingBill.client_name).where(in_selection).distinct()).scalars())
+    counts = {'bills': 0, 'entries': 0}
+
+    if action == 'reassign':
+        # Dispatch entries follow their bill, matched on the bill's current number and client;
+        # a NULL client code (triangulation auto-apply) matches entries with no code, as filter_by did
+        of_selected_bill = select(PendingBill.id).where(
+            in_selection, PendingBill.bill_no == Entry.bill_no,
+            Entry.client_code.is_not_distinct_from(PendingBill.client_code)).exists()
+        counts['entries'] = db.session.execute(
+            update(Entry).where(of_selected_bill).values(
+                client=client.name, client_name=client.name, client_code=client.code),
+            execution_options={'synchronize_session': False}).rowcount
+        values = {'client_name': client.name, 'client_code': client.code}
+        touched_names.add(client.name)
+    elif action == 'set_reason':
+        values = {'reason': reason}
+    else:
+        values = {'is_paid': action == 'mark_paid'}
+
+    counts['bills'] = db.session.execute(update(PendingBill).where(in_selection).values(**values),
+                                         execution_options={'synchronize_session': False}).rowcount
+    if action != 'set_reason':
+        refresh_client_balances(touched_names)
+    return counts
 
-    # Handle "CASH" general code requirement
-    # We can add a special filter or just ensure it shows up in search
-    if filters['bill_no'] == 'CASH':
-        query = query.filter(PendingBill.bill_no == 'CASH')
+
+@app.route('/pending_bills/bulk', methods=['POST'])
+@login_required
+def bulk_pending_bills():
+    """
+    Mark many pending bills paid/unpaid, reassign them to a client or set their reason.
+
+    Bills are chosen by id (``ids`` in JSON, ``bill_ids`` in the page form) or,
+    with ``apply_to=filter``, by the pending bills page filters. Reassignment
+    takes ``target_client_code``. Accepts JSON
+    (answers JSON) or the page form (redirects back).
+    """
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        ids = payload.get('ids') or []
+        filter_args = payload.get('filters') or {}
+    else:
+        payload = request.form
+        ids = payload.getlist('bill_ids')
+        filter_args = payload
+
+    def respond(ok, message, counts=None):
+        if request.is_json:
+            body = {'success': ok, **(counts or {})}
+            body['message' if ok else 'error'] = message
+            return jsonify(body), (200 if ok else 400)
+        flash(message, 'success' if ok else 'danger')
+        return redirect(url_for('pending_bills', **{k: v for k, v in pending_bill_filters(filter_args).items() if v}))
+
+    action = payload.get('action')
+    if action not in PENDING_BILL_BULK_ACTIONS:
+        return respond(False, 'Unknown bulk action')
+
+    if payload.get('apply_to') == 'filter':
+        filters = pending_bill_filters(filter_args)
+        if not any(filters.values()):
+            return respond(False, 'Set at least one filter before applying to all matching bills')
+        # Through a derived table, so the UPDATEs never correlate the selection to the bills being updated
+        matching = filtered_pending_bills(filters).with_entities(PendingBill.id).subquery()
+        selected_ids = select(matching.c.id)
+    else:
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            return respond(False, 'Invalid bill ids')
+        if not ids:
+            return respond(False, 'No bills selected')
+        selected_ids = ids
+
+    client = None
+    if action == 'reassign':
+        client = Client.query.filter_by(code=(payload.get('target_client_code') or '').strip()).first()
+        if not client:
+            return respond(False, 'Invalid Client Code. Client must exist in the Client Directory.')
+
+    counts = bulk_update_pending_bills(selected_ids, action, client=client,
+                                       reason=(payload.get('reason') or '').strip())
+    db.session.commit()
+    message = f"Updated {counts['bills']} bills"
+    if counts['entries']:
+        message += f" and {counts['entries']} dispatch entries"
+    return respond(True, message, counts)
+
+
+@app.route('/pending_bills')
+@login_required
+@data_version_etag
+def pending_bills():
+    page = request.args.get('page', 1, type=int)
+    filters = pending_bill_filters(request.args)
+    query = filtered_pending_bills(filters)
 
     # Sort by Bill Number ascending (numeric) for sequential view
-    pagination = query.order_by(
-        func.cast(PendingBill.bill_no, db.Integer).asc()).paginate(page=page,
-                                                                   per_page=15)
+    pagination = query.order_by(PendingBill.bill_no_num.asc(),
+                                PendingBill.id.asc()).paginate(page=page,
+                                                               per_page=15)
 
     # Alphabetical order for all client lists
     active_clients = Client.query.filter(Client.is_active == True).order_by(
@@ -2035,6 +2078,7 @@ def pending_bills():
     materials = Material.query.order_by(Material.name.asc()).all()
     return render_template('pending_bills.html',
                            bills=pagination.items,
+                           outstanding=outstanding_by_bill([b.id for b in pagination.items]),
                            pagination=pagination,
                            filters=filters,
                            clients=active_clients,
@@ -2088,19 +2132,25 @@ def edit_pending_bill(id):
         bill.client_name = client_obj.name
         bill.bill_no = request.form.get('bill_no', '').strip()
         bill.nimbus_no = request.form.get('nimbus_no', '').strip()
-        bill.amount = float(request.form.get('amount') or 0)
+        new_amount = float(request.form.get('amount') or 0)
+        amount_changed = new_amount != bill.amount
+        bill.amount = new_amount
         bill.reason = request.form.get('reason', '').strip()
         bill.photo_url = request.form.get('photo_url', '').strip()
+        if amount_changed:
+            sync_bill_paid(bill)
 
         # Global Data Consistency: Propagate changes to Dispatching entries
         # If Bill No or Client changed, update matching entries
         update_data = {
             'bill_no': bill.bill_no,
+            'bill_no_num': bill_no_number(bill.bill_no),
             'client': bill.client_name,
             'client_code': bill.client_code
         }
         Entry.query.filter_by(bill_no=old_bill_no,
                               client_code=old_client_code).update(update_data)
+        sync_bills([old_bill_no, bill.bill_no])
 
         db.session.commit()
         flash('Bill updated and synchronized across system', 'success')
@@ -2119,6 +2169,7 @@ def delete_pending_bill(id):
                 flash('Standard users cannot delete back-dated bills.',
                       'danger')
                 return redirect(url_for('pending_bills'))
+        delete_bill_allocations([bill.id])
         db.session.delete(bill)
         db.session.commit()
         flash('Bill deleted', 'warning')
@@ -2127,39 +2178,51 @@ def delete_pending_bill(id):
 
 @app.route('/export_pending_bills')
 @login_required
+@data_version_etag
 def export_pending_bills():
-    import pandas as pd
-    import io
+    from flask import Response, stream_with_context
+    from utils.exports import stream_csv, write_xlsx
+    from blueprints.import_export import PENDING_BILL_EXPORT_HEADERS, iter_pending_bill_rows
     fmt = request.args.get('format', 'excel')
-    bills = PendingBill.query.all()
-    data = [{
-        'ClientCode': b.client_code,
-        'BillNo': b.bill_no,
-        'ClientName': b.client_name,
-        'Amount': b.amount,
-        'Reason': b.reason,
-        'NimbusNo': b.nimbus_no
-    } for b in bills]
-    df = pd.DataFrame(data)
+    rows = iter_pending_bill_rows()
     if fmt == 'csv':
-        from flask import Response
         return Response(
-            df.to_csv(index=False),
+            stream_with_context(stream_csv(PENDING_BILL_EXPORT_HEADERS, rows)),
             mimetype="text/csv",
             headers={
                 "Content-disposition":
                 f"attachment; filename=pending_bills_{date.today()}.csv"
             })
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
-    output.seek(0)
-    from flask import send_file
+    # Write-only workbook spooled to a temp file, then streamed from disk
+    output = write_xlsx(PENDING_BILL_EXPORT_HEADERS, rows)
     return send_file(output,
                      as_attachment=True,
                      download_name=f"pending_bills_{date.today()}.xlsx")
 
 
+@app.route('/receivables_aging')
+@login_required
+@data_version_etag
+def receivables_aging():
+    as_of = parse_date_arg('as_of') or date.today()
+    report = aging_report(as_of)
+
+    fmt = request.args.get('format')
+    if fmt in ('csv', 'excel'):
+        from flask import Response, stream_with_context
+        from utils.exports import stream_csv, write_xlsx
+        rows = iter_aging_export_rows(report)
+        if fmt == 'csv':
+            return Response(stream_with_context(stream_csv(AGING_EXPORT_HEADERS, rows)),
+                            mimetype="text/csv",
+                            headers={"Content-disposition": f"attachment; filename=receivables_aging_{as_of}.csv"})
+        return send_file(write_xlsx(AGING_EXPORT_HEADERS, rows), as_attachment=True,
+                         download_name=f"receivables_aging_{as_of}.xlsx")
+
+    return render_template('receivables_aging.html', report=report, buckets=AGING_BUCKETS,
+                           undated=UNDATED_BUCKET)
+
+
 @app.route('/import_pending_bills', methods=['POST'])
 @login_required
 def import_pending_bills():
@@ -2171,14 +2234,11 @@ def import_pending_bills():
         return redirect(url_for('pending_bills'))
 
     try:
-        if file.filename.endswith('.csv'):
-            # Use low_memory=False to avoid DtypeWarning and handle large files better
-            df = pd.read_csv(file, low_memory=False)
-        else:
-            df = pd.read_excel(file)
+        df = read_mapped_table(file, 'pending_bills')
 
         # Mandatory Rule: Every row with a Bill No is required
         count = 0
+        client_index = build_client_index()
         for _, row in df.iterrows():
             bill_no = str(row.get('BillNo', '')).strip() if pd.notna(
                 row.get('BillNo')) else ''
@@ -2214,7 +2274,7 @@ def import_pending_bills():
                 client = Client.query.filter_by(code=code).first()
 
             if not client and name and name != 'Unknown' and name != 'EMPTY' and name != 'NO NAME':
-                client = Client.query.filter_by(name=name).first()
+                client = Client.query.filter_by(name=name).first() or match_client(name, client_index)
 
             if not client:
                 new_code = code if code and code != 'NA' else generate_client_code(
@@ -2222,6 +2282,7 @@ def import_pending_bills():
                 client = Client(code=new_code, name=name, is_active=True)
                 db.session.add(client)
                 db.session.flush()
+                client_index.add(client.id, client.name)
 
             # Add pending bill
             bill = PendingBill(
@@ -2259,6 +2320,7 @@ def confirm_import():
         import json
         imported_list = json.loads(data)
         count = 0
+        client_index = build_client_index()
         for item in imported_list:
             client = None
             code = item.get('client_code', '').strip()
@@ -2267,7 +2329,7 @@ def confirm_import():
             if code and code != 'NA':
                 client = Client.query.filter_by(code=code).first()
             if not client and name and name != 'EMPTY' and name != 'NO NAME' and name != 'NO BILL':
-                client = Client.query.filter_by(name=name).first()
+                client = Client.query.filter_by(name=name).first() or match_client(name, client_index)
 
             if not client:
                 # If name is 'Unknown', still create or find it
@@ -2276,6 +2338,7 @@ def confirm_import():
                 client = Client(code=new_code, name=name, is_active=True)
                 db.session.add(client)
                 db.session.flush()  # Get ID and ensure code is unique
+                client_index.add(client.id, client.name)
 
             bill = PendingBill(
                 client_code=client.code,
@@ -2300,6 +2363,13 @@ def confirm_import():
     return redirect(url_for('pending_bills'))
 
 
+@app.cli.command('rebuild-client-balances')
+def rebuild_client_balances_command():
+    """Recompute the materialized client balances from the ledger tables."""
+    count = rebuild_client_balances()
+    print(f"Rebuilt balances for {count} clients")
+
+
 # `_ensure_user_password_column` moved earlier to run at module import-time to
 # ensure the `password_hash` column exists before any queries execute.
 
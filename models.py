@@ -51,7 +51,7 @@ class GRNItem(db.Model):
 
 class Booking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_name = db.Column(db.String(100))
+    client_name = db.Column(db.String(100), index=True)
     location = db.Column(db.String(100))
     amount = db.Column(db.Float)
     paid_amount = db.Column(db.Float, default=0.0)
@@ -70,7 +70,7 @@ class BookingItem(db.Model):
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_name = db.Column(db.String(100))
+    client_name = db.Column(db.String(100), index=True)
     amount = db.Column(db.Float)
     method = db.Column(db.String(50))
     date_posted = db.Column(db.DateTime, default=datetime.utcnow)
@@ -79,6 +79,36 @@ class Payment(db.Model):
     photo_path = db.Column(db.String(200))
 
 
+class ClientBalance(db.Model):
+    # Materialized per-client balances, kept current by utils/client_balances.py
+    id = db.Column(db.Integer, primary_key=True)
+    client_name = db.Column(db.String(100), unique=True, index=True)
+    # Bookings and direct sales billed minus everything paid against them
+    ledger_balance = db.Column(db.Float, default=0.0)
+    # Outstanding amount of unpaid pending bills
+    pending_balance = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MaterialStockSnapshot(db.Model):
+    # Stock of a material before a month's first day; see utils/stock_ledger.py
+    __table_args__ = (db.UniqueConstraint('material', 'day', name='uq_stock_snapshot_material_day'),)
+    id = db.Column(db.Integer, primary_key=True)
+    material = db.Column(db.String(100), nullable=False, index=True)
+    day = db.Column(db.String(10), nullable=False)  # 'YYYY-MM-01', compared with Entry.date
+    balance = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class PaymentAllocation(db.Model):
+    # Amount of a payment applied to a pending bill; see utils/payment_allocation.py
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'), index=True)
+    bill_id = db.Column(db.Integer, db.ForeignKey('pending_bill.id'), index=True)
+    amount = db.Column(db.Float, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     client_code = db.Column(db.String(50), index=True)
@@ -93,14 +123,62 @@ class Invoice(db.Model):
     is_cash = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.String(20))
     created_by = db.Column(db.String(100))
+    # Bumped when the invoice, its entries or its direct sales change; see utils/invoice_versions.py
+    version = db.Column(db.Integer, default=1)
 
 class BillCounter(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     count = db.Column(db.Integer, default=1000)
 
+class BillRegistry(db.Model):
+    # Every bill/invoice number and the record that owns it; see utils/bill_registry.py
+    __table_args__ = (
+        db.Index('idx_bill_registry_bill_owner', 'bill_no', 'owner_type'),
+        db.Index('idx_bill_registry_owner', 'owner_type', 'owner_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    bill_no = db.Column(db.String(100), nullable=False)
+    owner_type = db.Column(db.String(20), nullable=False)  # Booking/Payment/DirectSale/Invoice/PendingBill/Entry
+    owner_id = db.Column(db.Integer, nullable=False)
+    field = db.Column(db.String(20), nullable=False)  # column holding the number, e.g. auto_bill_no
+
+class DataVersion(db.Model):
+    # Single row (id=1) bumped on every committed change to business data; see utils/data_version.py
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+class ExportJob(db.Model):
+    # Background export; the artifact is a zip under instance/exports (see utils/export_jobs.py)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text)  # JSON-encoded request parameters
+    cache_key = db.Column(db.String(64), index=True)
+    status = db.Column(db.String(20), default='QUEUED', index=True)  # QUEUED/RUNNING/DONE/FAILED
+    file_name = db.Column(db.String(200))
+    error = db.Column(db.String(500))
+    created_by = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    worker_pid = db.Column(db.Integer)  # process whose thread pool runs the job
+    progress_current = db.Column(db.Integer, default=0)  # rows/documents written so far
+    progress_total = db.Column(db.Integer, default=0)
+
+class ColumnMappingProfile(db.Model):
+    # Header mapping for uploaded files, keyed by a hash of the header row (see utils/column_mapping.py)
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'signature', name='uq_column_mapping_kind_signature'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    kind = db.Column(db.String(50), nullable=False)  # recon/entries/pending_bills
+    signature = db.Column(db.String(64), nullable=False, index=True)
+    headers = db.Column(db.Text)  # JSON list of the file's headers
+    mapping = db.Column(db.Text, nullable=False)  # JSON {source header: canonical column}
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class DirectSale(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_name = db.Column(db.String(100))
+    client_name = db.Column(db.String(100), index=True)
     amount = db.Column(db.Float)
     paid_amount = db.Column(db.Float, default=0.0)
     date_posted = db.Column(db.DateTime, default=datetime.utcnow)
@@ -126,6 +204,8 @@ class PendingBill(db.Model):
     client_code = db.Column(db.String(50), index=True)
     client_name = db.Column(db.String(100), index=True)
     bill_no = db.Column(db.String(100), index=True)
+    # Integer value of bill_no (as SQLite's CAST would give) for indexed ordering and range filters
+    bill_no_num = db.Column(db.Integer, index=True)
     nimbus_no = db.Column(db.String(100), index=True)
     amount = db.Column(db.Float, default=0)
     date = db.Column(db.Date)
@@ -135,6 +215,8 @@ class PendingBill(db.Model):
     # Indicates this pending bill was recorded for a cash delivery (no invoice)
     is_cash = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.String(20))
+    # Date part of created_at as a real, indexed date (for aging); see utils/receivables.py
+    created_on = db.Column(db.Date, index=True)
     created_by = db.Column(db.String(100))
 
 class Entry(db.Model):
@@ -154,6 +236,7 @@ class Entry(db.Model):
     client_code = db.Column(db.String(50), index=True)
     qty = db.Column(db.Float, nullable=False)
     bill_no = db.Column(db.String(100), index=True)
+    bill_no_num = db.Column(db.Integer, index=True)  # see PendingBill.bill_no_num
     auto_bill_no = db.Column(db.String(100), index=True)
     nimbus_no = db.Column(db.String(100), index=True)
     # Optional link to an Invoice when this entry is billed
@@ -164,6 +247,9 @@ class Entry(db.Model):
 
 
 class ReconBasket(db.Model):
+    __table_args__ = (
+        db.Index('idx_recon_basket_status_created', 'status', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     bill_no = db.Column(db.String(100), index=True)
     # Side A - Finance
@@ -181,3 +267,27 @@ class ReconBasket(db.Model):
     status = db.Column(db.String(20), default='RED', index=True)  # GREEN/YELLOW/RED/BLUE
     match_score = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Recon run that produced this row (NULL for rows from before runs were recorded)
+    run_id = db.Column(db.Integer, db.ForeignKey('recon_run.id'), index=True, nullable=True)
+
+
+class ReconRun(db.Model):
+    # One data_lab upload; identical re-uploads are recognised by their file hashes
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(20), default='files')  # files: finance vs dispatch upload; live: finance vs database
+    finance_file = db.Column(db.String(200))
+    finance_hash = db.Column(db.String(64), index=True)
+    dispatch_file = db.Column(db.String(200))
+    dispatch_hash = db.Column(db.String(64), index=True)
+    bills_scored = db.Column(db.Integer, default=0)
+    bills_skipped = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ReconBill(db.Model):
+    # Latest reconciliation state of each bill ('' groups dispatch rows without a bill number)
+    id = db.Column(db.Integer, primary_key=True)
+    bill_no = db.Column(db.String(100), unique=True, nullable=False)
+    signature = db.Column(db.String(32))  # hash of the bill's finance and dispatch rows
+    status = db.Column(db.String(20))  # GREEN when every row was auto-applied
+    run_id = db.Column(db.Integer, db.ForeignKey('recon_run.id'), index=True)
@@ -0,0 +1,99 @@
+import io
+import os
+import sys
+import time
+import zipfile
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Client, Invoice, Payment, Booking, User
+from utils import render_cache
+from utils.documents import document_extension, invoice_cache_key
+from werkzeug.security import generate_password_hash
+
+
+def _wait_for(c, status_url):
+    for _ in range(100):
+        status = c.get(status_url).get_json()
+        if status['status'] in ('DONE', 'FAILED'):
+            return status
+        time.sleep(0.05)
+    return status
+
+
+def test_documents_job_bundles_invoices_and_statements():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='docbatcher').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'docbatcher',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='docbatcher', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        client = Client.query.filter_by(code='DOC01').first()
+        if not client:
+            client = Client(name='DocBatchClient', code='DOC01')
+            db.session.add(client)
+        Invoice.query.filter_by(client_code='DOC01').delete()
+        inv = Invoice(client_code='DOC01', client_name='DocBatchClient', invoice_no='#DOC-INV-1',
+                      date=date(2026, 5, 2), total_amount=500.0, balance=200.0)
+        db.session.add(inv)
+        db.session.add(Booking(client_name='DocBatchClient', amount=1000.0, paid_amount=0.0,
+                               auto_bill_no='#DOC-BK-0', date_posted=datetime(2026, 4, 20)))
+        db.session.add(Payment(client_name='DocBatchClient', amount=300.0, method='Cash',
+                               auto_bill_no='#DOC-PAY-1', date_posted=datetime(2026, 5, 3)))
+        db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/login', data={'username': 'docbatcher', 'password': 'testpass'}, follow_redirects=True)
+        assert resp.status_code == 200
+
+        job = c.post('/export_jobs', data={'kind': 'documents', 'start_date': '2026-05-01', 'end_date': '2026-05-31',
+                                           'client_codes': 'DOC01'}).get_json()
+        assert job['success']
+        status = _wait_for(c, job['status_url'])
+        assert status['status'] == 'DONE'
+        assert status['current'] == status['total'] == 2
+
+        ext = document_extension()
+        with zipfile.ZipFile(io.BytesIO(c.get(job['download_url']).data)) as zf:
+            names = sorted(zf.namelist())
+            assert names == [f'invoices/invoice-DOC-INV-1.{ext}', f'statements/statement-DOC01.{ext}']
+            if ext == 'html':
+                statement = zf.read(f'statements/statement-DOC01.{ext}').decode('utf-8')
+                # April booking is the opening balance, May payment is a row
+                assert '1,000.00' in statement and '#DOC-PAY-1' in statement and '700.00' in statement
+                assert '#DOC-BK-0' not in statement
+
+        # Each invoice was cached under its invoice version
+        assert render_cache.load('invoices', invoice_cache_key(inv), ext)
+
+        # The single-invoice download is served from the same cache
+        resp = c.get('/download_invoice/DOC-INV-1')
+        assert resp.status_code == 200
+        assert f'invoice-#DOC-INV-1.{ext}' in resp.headers['Content-Disposition']
+
+        page = c.get('/view_bill/DOC-INV-1')
+        assert page.status_code == 200 and b'Download PDF' in page.data
+
+        # No filters at all is refused instead of rendering everything
+        bad = c.post('/export_jobs', data={'kind': 'documents'}).get_json()
+        assert _wait_for(c, bad['status_url'])['status'] == 'FAILED'
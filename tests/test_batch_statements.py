@@ -0,0 +1,101 @@
+import io
+import os
+import sys
+import time
+import zipfile
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import load_workbook
+
+from app import create_app
+from models import db, Booking, Client, DirectSale, Payment, User
+from utils.documents import document_extension
+from utils.ledger import client_statements
+from werkzeug.security import generate_password_hash
+
+
+def _wait_for(c, status_url):
+    for _ in range(100):
+        status = c.get(status_url).get_json()
+        if status['status'] in ('DONE', 'FAILED'):
+            return status
+        time.sleep(0.05)
+    return status
+
+
+def test_statements_job_bundles_documents_and_workbook():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='stmtbatcher').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'stmtbatcher',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='stmtbatcher', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        clients = []
+        for n in (1, 2, 3):
+            name, code = f'StmtBatchClient{n}', f'STB0{n}'
+            for model in (Booking, Payment, DirectSale):
+                for row in model.query.filter_by(client_name=name):
+                    db.session.delete(row)
+            client = Client.query.filter_by(code=code).first()
+            if not client:
+                client = Client(name=name, code=code)
+                db.session.add(client)
+            clients.append(client)
+            db.session.add(Booking(client_name=name, amount=1000.0 * n, paid_amount=0.0,
+                                   auto_bill_no=f'#STB-BK-{n}', date_posted=datetime(2026, 4, 20)))
+            db.session.add(Payment(client_name=name, amount=100.0 * n, method='Cash',
+                                   auto_bill_no=f'#STB-PAY-{n}', date_posted=datetime(2026, 5, 3)))
+            db.session.add(DirectSale(client_name=name, amount=50.0, paid_amount=20.0,
+                                      auto_bill_no=f'#STB-DS-{n}', date_posted=datetime(2026, 5, 9)))
+        db.session.commit()
+
+        # Grouped chunks give the same statements as one client per query
+        together = dict(client_statements(clients, date(2026, 5, 1), date(2026, 5, 31)))
+        alone = dict(client_statements(clients, date(2026, 5, 1), date(2026, 5, 31), chunk_size=1))
+        assert together == alone
+        second = together[clients[1]]
+        assert second['opening_balance'] == 2000.0
+        assert [r['balance'] for r in second['rows']] == [1800.0, 1830.0]
+        assert second['closing_balance'] == 1830.0 and second['total_credit'] == 220.0
+
+        c = app.test_client()
+        resp = c.post('/login', data={'username': 'stmtbatcher', 'password': 'testpass'}, follow_redirects=True)
+        assert resp.status_code == 200
+
+        job = c.post('/export_jobs', data={'kind': 'statements', 'start_date': '2026-05-01', 'end_date': '2026-05-31',
+                                           'client_codes': 'STB01,STB02,STB03'}).get_json()
+        assert job['success']
+        status = _wait_for(c, job['status_url'])
+        assert status['status'] == 'DONE'
+        assert status['current'] == status['total'] == 4
+
+        ext = document_extension()
+        with zipfile.ZipFile(io.BytesIO(c.get(job['download_url']).data)) as zf:
+            names = sorted(zf.namelist())
+            assert names == [f'statements/statement-STB0{n}.{ext}' for n in (1, 2, 3)] + [
+                'statements_2026-05-01_2026-05-31.xlsx']
+            sheet = load_workbook(io.BytesIO(zf.read('statements_2026-05-01_2026-05-31.xlsx'))).active
+            rows = [row for row in sheet.iter_rows(values_only=True)][1:]
+        assert len(rows) == 3 * 4
+        closing = [row for row in rows if row[3] == 'Closing Balance']
+        assert [(row[0], row[7]) for row in closing] == [('STB01', 930.0), ('STB02', 1830.0), ('STB03', 2730.0)]
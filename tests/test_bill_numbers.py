@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from models import BillCounter
+from utils.bill_numbers import reserve_bill_numbers, BILL_COUNTER_START
+
+
+def allocate(db_path, rounds, block):
+    engine = create_engine(f'sqlite:///{db_path}', connect_args={'timeout': 30})
+    numbers = []
+    for _ in range(rounds):
+        numbers.extend(reserve_bill_numbers(block, engine=engine))
+    engine.dispose()
+    return numbers
+
+
+def test_concurrent_workers_never_share_a_bill_number(tmp_path):
+    db_path = str(tmp_path / 'counter.db')
+    engine = create_engine(f'sqlite:///{db_path}')
+    BillCounter.__table__.create(engine)
+    engine.dispose()
+
+    jobs = [(db_path, 50, 1 if i % 2 else 7) for i in range(8)]
+    with multiprocessing.get_context('fork').Pool(8) as pool:
+        results = pool.starmap(allocate, jobs)
+
+    numbers = [n for worker in results for n in worker]
+    expected = sum(rounds * block for _, rounds, block in jobs)
+    assert len(numbers) == expected
+    assert len(set(numbers)) == expected
+    # Blocks are contiguous, so together they cover the range without gaps
+    assert sorted(numbers) == list(range(BILL_COUNTER_START, BILL_COUNTER_START + expected))
+
+
+def test_bill_no_num_is_kept_in_step_and_drives_the_pending_bills_page():
+    from app import create_app
+    from models import db, PendingBill, User
+    from werkzeug.security import generate_password_hash
+    from utils.bill_numbers import bill_no_number, backfill_bill_no_numbers
+
+    assert bill_no_number('1001') == 1001
+    assert bill_no_number(' 77-A') == 77
+    assert bill_no_number('#1001') == 0
+    assert bill_no_number(None) is None
+
+    app = create_app()
+    app.testing = True
+    with app.app_context():
+        db.create_all()
+        if not User.query.filter_by(username='billnumuser').first():
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {'u': 'billnumuser', 'p': 'testpass', 'ph': generate_password_hash('testpass'), 'r': 'admin'})
+            else:
+                db.session.add(User(username='billnumuser', password_hash=generate_password_hash('testpass'), role='admin'))
+        PendingBill.query.filter(PendingBill.client_code == 'BNUM').delete()
+        for bill_no in ('970000100', '970000020', '970000003', '970000250'):
+            db.session.add(PendingBill(bill_no=bill_no, client_code='BNUM', client_name='Bill Num Client'))
+        db.session.commit()
+        assert PendingBill.query.filter_by(bill_no='970000020').one().bill_no_num == 970000020
+
+        # Edits keep the column in step
+        bill = PendingBill.query.filter_by(bill_no='970000250').one()
+        bill.bill_no = '970000002'
+        db.session.commit()
+        assert bill.bill_no_num == 970000002
+
+        # Rows written without the ORM hook are backfilled
+        from sqlalchemy import update
+        db.session.execute(update(PendingBill.__table__).where(PendingBill.__table__.c.bill_no == '970000003').values(
+            bill_no_num=None))
+        db.session.commit()
+        backfill_bill_no_numbers()
+        assert PendingBill.query.filter_by(bill_no='970000003').one().bill_no_num == 970000003
+
+        c = app.test_client()
+        c.post('/login', data={'username': 'billnumuser', 'password': 'testpass'})
+        html = c.get('/pending_bills?bill_from=970000000&bill_to=970000099').get_data(as_text=True)
+        positions = [html.find(b) for b in ('970000002', '970000003', '970000020')]
+        assert all(p >= 0 for p in positions) and positions == sorted(positions)
+        assert '970000100' not in html
+
+        # A session that already flushed writes holds SQLite's write lock; allocation joins it instead of blocking
+        from utils.bill_numbers import get_next_bill_no
+        db.session.add(PendingBill(bill_no='970000900', client_code='BNUM', client_name='Bill Num Client'))
+        db.session.flush()
+        first, second = get_next_bill_no(), get_next_bill_no()
+        assert int(second.lstrip('#')) == int(first.lstrip('#')) + 1
+        db.session.commit()
@@ -0,0 +1,84 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, BillRegistry, Booking, Entry, PendingBill, User
+from werkzeug.security import generate_password_hash
+
+
+def login(app, username):
+    with app.app_context():
+        if not User.query.filter_by(username=username).first():
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {'u': username, 'p': 'testpass', 'ph': generate_password_hash('testpass'), 'r': 'admin'})
+            else:
+                db.session.add(User(username=username, password_hash=generate_password_hash('testpass'), role='admin'))
+            db.session.commit()
+    c = app.test_client()
+    c.post('/login', data={'username': username, 'password': 'testpass'})
+    return c
+
+
+def test_registry_tracks_orm_writes_and_serves_bill_lookups():
+    app = create_app()
+    app.testing = True
+    c = login(app, 'registryuser')
+
+    with app.app_context():
+        Booking.query.filter(Booking.auto_bill_no.like('#REG%')).delete(synchronize_session=False)
+        Entry.query.filter(Entry.bill_no.like('REG-%')).delete(synchronize_session=False)
+        BillRegistry.query.filter(BillRegistry.bill_no.like('%REG%')).delete(synchronize_session=False)
+        db.session.commit()
+
+        booking = Booking(client_name='Registry Client', amount=10, auto_bill_no='#REG1', manual_bill_no='M-REG1')
+        db.session.add(booking)
+        db.session.add(Entry(date='2026-05-01', time='10:00:00', type='OUT', material='RegCement', qty=12,
+                             bill_no='REG-7'))
+        db.session.commit()
+
+        rows = {(r.owner_type, r.field) for r in BillRegistry.query.filter_by(owner_id=booking.id, owner_type='Booking')}
+        assert rows == {('Booking', 'auto_bill_no'), ('Booking', 'manual_bill_no')}
+
+        resp = c.get('/view_bill/REG1')
+        assert resp.status_code == 200 and 'Registry Client' in resp.get_data(as_text=True)
+
+        # Renumbering moves the registry row with it
+        booking.auto_bill_no = '#REG2'
+        db.session.commit()
+        assert c.get('/view_bill/REG1').status_code == 302
+        assert c.get('/view_bill/REG2').status_code == 200
+
+        data = c.get('/api/check_bill/REG-7').get_json()
+        assert data['exists'] and data['material'] == 'RegCement' and data['qty'] == 12
+
+        # A bulk delete leaves a stale registry row, which lookups ignore
+        Entry.query.filter_by(bill_no='REG-7').delete()
+        db.session.commit()
+        assert BillRegistry.query.filter_by(bill_no='REG-7').count() == 1
+        assert c.get('/api/check_bill/REG-7').get_json() == {'exists': False}
+
+        results = c.get('/api/bills/search?q=%23REG').get_json()
+        assert results == [{'bill_no': '#REG2', 'types': ['Booking']}]
+
+
+def test_sync_bills_registers_bulk_written_rows():
+    from sqlalchemy import insert
+    from utils.bill_registry import sync_bills, search_bill_numbers
+
+    app = create_app()
+    with app.app_context():
+        PendingBill.query.filter(PendingBill.bill_no.like('REGB-%')).delete(synchronize_session=False)
+        BillRegistry.query.filter(BillRegistry.bill_no.like('REGB-%')).delete(synchronize_session=False)
+        db.session.execute(insert(PendingBill), [{'bill_no': f'REGB-{i}', 'client_name': 'Bulk'} for i in range(3)])
+        assert search_bill_numbers('REGB-') == []
+
+        sync_bills(['REGB-0', 'REGB-1', 'REGB-2'])
+        db.session.commit()
+        assert [r['bill_no'] for r in search_bill_numbers('REGB-')] == ['REGB-0', 'REGB-1', 'REGB-2']
+        assert search_bill_numbers('REGB-', limit=2)[-1] == {'bill_no': 'REGB-1', 'types': ['PendingBill']}
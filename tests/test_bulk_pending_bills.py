@@ -0,0 +1,90 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Client, Entry, PendingBill, User
+from utils.client_balances import client_balance
+from werkzeug.security import generate_password_hash
+
+
+def test_bulk_pending_bill_actions_update_bills_and_entries():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='bulkbiller').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'bulkbiller',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='bulkbiller', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        for code, name in (('BLK01', 'BulkSource'), ('BLK02', 'BulkTarget')):
+            PendingBill.query.filter_by(client_code=code).delete()
+            Entry.query.filter_by(client_code=code).delete()
+            if not Client.query.filter_by(code=code).first():
+                db.session.add(Client(name=name, code=code))
+        bills = [PendingBill(client_name='BulkSource', client_code='BLK01', bill_no=f'BLK-{i}', amount=10.0)
+                 for i in range(5)]
+        db.session.add_all(bills)
+        db.session.add_all([Entry(date='2026-06-01', time='10:00:00', type='OUT', material='BulkBrand', qty=1,
+                                  client='BulkSource', client_name='BulkSource', client_code='BLK01',
+                                  bill_no=f'BLK-{i}') for i in range(5)])
+        db.session.commit()
+        ids = [b.id for b in bills]
+
+        c = app.test_client()
+        c.post('/login', data={'username': 'bulkbiller', 'password': 'testpass'}, follow_redirects=True)
+
+        resp = c.post('/pending_bills/bulk', json={'action': 'mark_paid', 'ids': ids[:2]})
+        assert resp.get_json() == {'success': True, 'bills': 2, 'entries': 0, 'message': 'Updated 2 bills'}
+        assert client_balance('BulkSource')[1] == 30.0
+
+        # Reassign everything matching a filter; entries follow in the same transaction
+        resp = c.post('/pending_bills/bulk', json={'action': 'reassign', 'apply_to': 'filter',
+                                                   'filters': {'client_code': 'BLK01'}, 'target_client_code': 'BLK02'})
+        assert resp.get_json()['bills'] == 5 and resp.get_json()['entries'] == 5
+        db.session.expire_all()
+        assert PendingBill.query.filter_by(client_code='BLK02', client_name='BulkTarget').count() == 5
+        assert Entry.query.filter_by(client_code='BLK02', client='BulkTarget').count() == 5
+        assert client_balance('BulkSource')[1] == 0.0
+        assert client_balance('BulkTarget')[1] == 30.0
+
+        resp = c.post('/pending_bills/bulk', data={'action': 'set_reason', 'reason': 'Settled in bulk',
+                                                   'bill_ids': [str(i) for i in ids[2:]]})
+        assert resp.status_code == 302
+        assert PendingBill.query.filter_by(reason='Settled in bulk').count() == 3
+
+        # No filters at all is refused rather than touching every bill
+        resp = c.post('/pending_bills/bulk', json={'action': 'mark_paid', 'apply_to': 'filter', 'filters': {}})
+        assert resp.status_code == 400
+        assert c.post('/pending_bills/bulk', json={'action': 'explode', 'ids': ids}).status_code == 400
+
+        # Auto-applied bills carry no client code; their uncoded entries still follow them
+        PendingBill.query.filter_by(bill_no='BLK-NULL').delete()
+        Entry.query.filter_by(bill_no='BLK-NULL').delete()
+        uncoded = PendingBill(client_name='BulkSource', client_code=None, bill_no='BLK-NULL', amount=5.0)
+        db.session.add(uncoded)
+        db.session.add(Entry(date='2026-06-02', time='10:00:00', type='OUT', material='BulkBrand', qty=1,
+                             client_name='BulkSource', client_code=None, bill_no='BLK-NULL'))
+        db.session.commit()
+        resp = c.post('/pending_bills/bulk', json={'action': 'reassign', 'ids': [uncoded.id],
+                                                   'target_client_code': 'BLK02'})
+        assert resp.get_json()['bills'] == 1 and resp.get_json()['entries'] == 1
+        db.session.expire_all()
+        assert Entry.query.filter_by(bill_no='BLK-NULL').one().client_code == 'BLK02'
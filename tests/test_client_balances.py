@@ -0,0 +1,72 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Booking, Client, DirectSale, Payment, PendingBill, User
+from utils.client_balances import client_balance, rebuild_client_balances
+from werkzeug.security import generate_password_hash
+
+
+def test_client_balance_rows_follow_ledger_writes():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='balancer').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'balancer',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='balancer', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        for model in (Booking, Payment, DirectSale, PendingBill):
+            for row in model.query.filter_by(client_name='BalanceClient'):
+                db.session.delete(row)
+        if not Client.query.filter_by(code='BAL01').first():
+            db.session.add(Client(name='BalanceClient', code='BAL01'))
+        db.session.commit()
+        assert client_balance('BalanceClient') == (0.0, 0.0)
+
+        booking = Booking(client_name='BalanceClient', amount=1000.0, paid_amount=100.0)
+        db.session.add(booking)
+        db.session.add(DirectSale(client_name='BalanceClient', amount=200.0, paid_amount=50.0))
+        db.session.add(PendingBill(client_name='BalanceClient', client_code='BAL01', bill_no='BAL-1', amount=400.0))
+        db.session.commit()
+        assert client_balance('BalanceClient') == (1050.0, 400.0)
+
+        c = app.test_client()
+        c.post('/login', data={'username': 'balancer', 'password': 'testpass'}, follow_redirects=True)
+        c.post('/add_payment', data={'client_name': 'BalanceClient', 'amount': '150', 'method': 'Cash'})
+        # The payment reduces the ledger balance and, through its allocation, the pending balance
+        assert client_balance('BalanceClient') == (900.0, 250.0)
+
+        booking.paid_amount = 300.0
+        db.session.commit()
+        assert client_balance('BalanceClient') == (700.0, 250.0)
+
+        page = c.get('/clients?search=BalanceClient')
+        assert b'700.00' in page.data and b'Pending: 250.00' in page.data
+        assert b'Bal: 700.00' in c.get('/dispatching').data
+
+        # A full rebuild gives the same figures as the incremental updates
+        rebuild_client_balances()
+        assert client_balance('BalanceClient') == (700.0, 250.0)
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['rebuild-client-balances'])
+        assert 'Rebuilt balances' in result.output
@@ -0,0 +1,93 @@
+import os
+import sys
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Booking, Client, DirectSale, DirectSaleItem, Entry, Payment, User
+from utils.ledger import financial_page, material_page
+from werkzeug.security import generate_password_hash
+
+
+def test_financial_ledger_pages_carry_window_running_balance():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='ledgerreader').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'ledgerreader',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='ledgerreader', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        for model in (Booking, Payment, DirectSale):
+            for row in model.query.filter_by(client_name='SqlLedgerClient'):
+                db.session.delete(row)
+        Entry.query.filter_by(client_code='SQL01').delete()
+        client = Client.query.filter_by(code='SQL01').first()
+        if not client:
+            client = Client(name='SqlLedgerClient', code='SQL01')
+            db.session.add(client)
+        for day in range(1, 6):
+            db.session.add(Booking(client_name='SqlLedgerClient', amount=100.0 * day, paid_amount=10.0,
+                                   auto_bill_no=f'#SQLB-{day}', date_posted=datetime(2026, 3, day, 9)))
+            db.session.add(Payment(client_name='SqlLedgerClient', amount=50.0, method='Cash',
+                                   auto_bill_no=f'#SQLP-{day}', date_posted=datetime(2026, 3, day, 15)))
+        delivered = DirectSale(client_name='SqlLedgerClient', amount=40.0, paid_amount=40.0,
+                               auto_bill_no='#SQLS-1', date_posted=datetime(2026, 3, 6, 9))
+        undelivered = DirectSale(client_name='SqlLedgerClient', amount=60.0, paid_amount=0.0,
+                                 auto_bill_no='#SQLS-2', date_posted=datetime(2026, 3, 7, 9))
+        db.session.add_all([delivered, undelivered])
+        db.session.flush()
+        db.session.add_all([DirectSaleItem(sale_id=delivered.id, product_name='SqlBag', qty=1),
+                            DirectSaleItem(sale_id=undelivered.id, product_name='SqlBag', qty=2),
+                            DirectSaleItem(sale_id=undelivered.id, product_name='SqlBlock', qty=3)])
+        db.session.add(Entry(date='2026-03-06', time='10:00:00', type='OUT', material='SqlBag', qty=1,
+                             client='SqlLedgerClient', client_code='SQL01', bill_no='#SQLS-1'))
+        db.session.commit()
+
+        # Walk every page: no duplicates, newest first, balances match a replay of the history
+        rows, after = [], None
+        while True:
+            page, after = financial_page(client, after=after, per_page=3)
+            rows.extend(page)
+            if not after:
+                break
+        assert len(rows) == 12
+        assert len({(r.source, r.source_id) for r in rows}) == 12
+        balance = 0.0
+        for r in reversed(rows):
+            balance += r.debit - r.credit
+            assert abs(r.balance - balance) < 1e-9
+        assert rows[0].bill_no == '#SQLS-2' and rows[0].balance == balance
+
+        # A date filter narrows the rows but keeps the balance over the full history
+        filtered, _ = financial_page(client, start_date=date(2026, 3, 3), end_date=date(2026, 3, 3))
+        assert [r.bill_no for r in filtered] == ['#SQLP-3', '#SQLB-3']
+        by_bill = {r.bill_no: r.balance for r in rows}
+        assert [r.balance for r in filtered] == [by_bill['#SQLP-3'], by_bill['#SQLB-3']]
+
+        # Direct sales already delivered under the same bill are not repeated
+        materials, _ = material_page(client)
+        assert [(m['bill_no'], m['material'], m['qty']) for m in materials] == [
+            ('#SQLS-2', 'SqlBag', 2), ('#SQLS-2', 'SqlBlock', 3), ('#SQLS-1', 'SqlBag', 1)]
+
+        c = app.test_client()
+        c.post('/login', data={'username': 'ledgerreader', 'password': 'testpass'}, follow_redirects=True)
+        page = c.get(f'/ledger/{client.id}?start_date=2026-03-01&end_date=2026-03-31')
+        assert page.status_code == 200 and b'#SQLB-1' in page.data
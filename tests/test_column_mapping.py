@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import update
+from werkzeug.datastructures import FileStorage
+
+from app import create_app
+from models import db, ColumnMappingProfile
+from utils import column_mapping
+
+
+def upload(text, name='sample.csv'):
+    return FileStorage(stream=io.BytesIO(text.encode()), filename=name)
+
+
+def test_mapping_is_detected_once_then_read_from_the_profile():
+    app = create_app()
+    app.testing = True
+    csv_text = "Bill No,Client Name,Qty,Unused Notes\nCM-1,Acme,5,ignore me\n"
+
+    with app.app_context():
+        db.create_all()
+        headers = ['Bill No', 'Client Name', 'Qty', 'Unused Notes']
+        signature = column_mapping.header_signature(headers)
+        ColumnMappingProfile.query.filter_by(signature=signature).delete()
+        db.session.commit()
+
+        df = column_mapping.read_mapped_table(upload(csv_text), 'entries')
+        # Only mapped columns are loaded, already under the importer's names
+        assert list(df.columns) == ['bill_no', 'ClientName', 'Quantity']
+        assert df.iloc[0].tolist() == ['CM-1', 'Acme', 5]
+
+        profile = ColumnMappingProfile.query.filter_by(kind='entries', signature=signature).one()
+        assert json.loads(profile.mapping) == {'Bill No': 'bill_no', 'Client Name': 'ClientName', 'Qty': 'Quantity'}
+
+        # Header order does not change the signature, and the saved profile skips detection
+        detect = column_mapping.MAPPING_KINDS['entries']['detect']
+        column_mapping.MAPPING_KINDS['entries']['detect'] = None
+        try:
+            reordered = column_mapping.read_mapped_table(
+                upload("Unused Notes,Qty,Client Name,Bill No\nx,7,Beta,CM-2\n"), 'entries')
+        finally:
+            column_mapping.MAPPING_KINDS['entries']['detect'] = detect
+        assert reordered.iloc[0]['Quantity'] == 7 and reordered.iloc[0]['bill_no'] == 'CM-2'
+
+        # A profile edited elsewhere (another worker) applies to the next upload
+        db.session.execute(update(ColumnMappingProfile.__table__).where(
+            ColumnMappingProfile.__table__.c.id == profile.id).values(
+            mapping=json.dumps({'Bill No': 'bill_no', 'Qty': 'Quantity'})))
+        db.session.commit()
+        assert column_mapping.resolve_mapping('entries', headers) == {'Bill No': 'bill_no', 'Qty': 'Quantity'}
+
+
+def test_named_profile_overrides_detection_for_recon_uploads():
+    app = create_app()
+    app.testing = True
+    csv_text = "Invoice,Party,Product,Bags\nCM-9,Acme Traders,Cement,3\n"
+
+    with app.app_context():
+        db.create_all()
+        signature = column_mapping.header_signature(['Invoice', 'Party', 'Product', 'Bags'])
+        ColumnMappingProfile.query.filter_by(signature=signature).delete()
+        db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/data_lab/mappings', data={
+            'kind': 'recon', 'name': 'Dispatch register',
+            'sample_file': (io.BytesIO(csv_text.encode()), 'register.csv'),
+            'mapping': 'Invoice = bill_no\nParty = client\nProduct = material\nBags = qty',
+        }, content_type='multipart/form-data')
+        assert resp.status_code == 302
+        profile = ColumnMappingProfile.query.filter_by(kind='recon', signature=signature).one()
+        assert profile.name == 'Dispatch register'
+
+        df = column_mapping.read_mapped_table(upload(csv_text), 'recon')
+        assert df.iloc[0].to_dict() == {'bill_no': 'CM-9', 'client': 'Acme Traders', 'material': 'Cement', 'qty': 3}
+
+        resp = c.post('/data_lab/mappings', data={
+            'kind': 'recon', 'name': 'Broken',
+            'sample_file': (io.BytesIO(csv_text.encode()), 'register.csv'),
+            'mapping': 'Invoice = invoice_total',
+        }, content_type='multipart/form-data', follow_redirects=True)
+        assert 'Unknown column' in resp.get_data(as_text=True)
+        assert ColumnMappingProfile.query.filter_by(kind='recon', signature=signature).one().name == 'Dispatch register'
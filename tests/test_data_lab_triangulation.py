@@ -0,0 +1,279 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Client, Entry, PendingBill, ReconBasket, ReconBill, ReconRun
+
+
+FINANCE_CSV = """bill_no,Client Name,Amount
+DLT-1001,DLT Ahmed Traders,100
+DLT-1002,DLT Bilal Company,50
+DLT-1003,DLT Zeta Stores,20
+DLT-1003,DLT Zeta Stores,25
+"""
+
+DISPATCH_CSV = """bill_no,Client,Material,Qty
+DLT-1001,DLT Ahmed Traders,Cement,10
+DLT-1002,DLT Unrelated Name,Cement,5
+DLT-1004,DLT Someone,Blocks,3
+,DLT Walkin,Sand,2
+"""
+
+
+def reset_recon_state():
+    ReconBasket.query.filter(ReconBasket.bill_no.like('DLT-%')).delete(synchronize_session=False)
+    ReconBasket.query.filter_by(inv_client='DLT Walkin').delete()
+    ReconBill.query.filter(ReconBill.bill_no.like('DLT-%') | (ReconBill.bill_no == '')).delete(synchronize_session=False)
+    ReconRun.query.filter(ReconRun.finance_file.like('dlt_%') | ReconRun.finance_file.like('finance.csv')).delete(
+        synchronize_session=False)
+    Entry.query.filter(Entry.bill_no.like('DLT-%')).delete(synchronize_session=False)
+    PendingBill.query.filter(PendingBill.bill_no.like('DLT-%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def test_upload_classifies_bills_with_merge_and_bulk_inserts():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        reset_recon_state()
+
+        c = app.test_client()
+        resp = c.post('/data_lab/', data={
+            'finance_file': (io.BytesIO(FINANCE_CSV.encode()), 'finance.csv'),
+            'dispatch_file': (io.BytesIO(DISPATCH_CSV.encode()), 'dispatch.csv'),
+        }, content_type='multipart/form-data')
+        assert resp.status_code == 302
+
+        # GREEN: auto-applied as a dispatch entry with a pending bill, not basketed
+        entry = Entry.query.filter_by(bill_no='DLT-1001').one()
+        assert entry.qty == 10 and entry.client_name == 'DLT Ahmed Traders'
+        assert PendingBill.query.filter_by(bill_no='DLT-1001').count() == 1
+        assert ReconBasket.query.filter_by(bill_no='DLT-1001').count() == 0
+
+        yellow = ReconBasket.query.filter_by(bill_no='DLT-1002').one()
+        assert yellow.status == 'YELLOW' and yellow.match_score < 90
+        assert yellow.fin_client == 'DLT Bilal Company' and yellow.inv_client == 'DLT Unrelated Name'
+
+        red_dispatch = ReconBasket.query.filter_by(bill_no='DLT-1004').one()
+        assert red_dispatch.status == 'RED' and red_dispatch.inv_qty == 3 and red_dispatch.fin_client is None
+
+        # Finance-only bills keep one RED row per finance row
+        red_finance = ReconBasket.query.filter_by(bill_no='DLT-1003').all()
+        assert [r.status for r in red_finance] == ['RED', 'RED']
+
+        blue = ReconBasket.query.filter_by(inv_client='DLT Walkin').one()
+        assert blue.status == 'BLUE' and blue.bill_no == '' and blue.inv_material == 'Sand'
+
+
+def test_parallel_scoring_matches_serial_scoring():
+    from blueprints import data_lab
+
+    fin = [f'M/S Client {i % 37} Traders' for i in range(300)]
+    inv = [f'CLIENT {i % 41} TRADERS' for i in range(300)]
+    bills = [f'PB-{i}' for i in range(300)]
+
+    serial = data_lab.score_matches(fin, inv, bills)
+    original = data_lab.PARALLEL_MIN_PAIRS
+    data_lab.PARALLEL_MIN_PAIRS = 1
+    try:
+        parallel = data_lab.score_matches(fin, inv, bills, workers=2)
+    finally:
+        data_lab.PARALLEL_MIN_PAIRS = original
+
+    assert parallel == serial
+    assert data_lab.recon_progress['current'] == data_lab.recon_progress['total'] == 300
+
+
+def test_reupload_is_incremental_and_basket_shows_latest_state():
+    from blueprints import data_lab
+
+    app = create_app()
+    app.testing = True
+
+    def upload(finance_csv, name):
+        return c.post('/data_lab/', data={
+            'finance_file': (io.BytesIO(finance_csv.encode()), name),
+            'dispatch_file': (io.BytesIO(DISPATCH_CSV.encode()), 'dlt_dispatch.csv'),
+        }, content_type='multipart/form-data')
+
+    with app.app_context():
+        db.create_all()
+        reset_recon_state()
+        c = app.test_client()
+
+        assert upload(FINANCE_CSV, 'dlt_finance.csv').status_code == 302
+        first_run = ReconRun.query.filter_by(finance_file='dlt_finance.csv').one()
+        basket_rows = ReconBasket.query.filter(ReconBasket.bill_no.like('DLT-%')).count()
+
+        # Identical files are recognised by hash and not processed again
+        upload(FINANCE_CSV, 'dlt_finance.csv')
+        assert ReconRun.query.filter_by(finance_file='dlt_finance.csv').count() == 1
+        assert ReconBasket.query.filter(ReconBasket.bill_no.like('DLT-%')).count() == basket_rows
+
+        # Fixing DLT-1002 in finance rescores only that bill
+        fixed = FINANCE_CSV.replace('DLT Bilal Company', 'DLT Unrelated Name')
+        upload(fixed, 'dlt_finance_fixed.csv')
+        second_run = ReconRun.query.filter_by(finance_file='dlt_finance_fixed.csv').one()
+        assert second_run.bills_scored == 1 and second_run.bills_skipped == 4
+
+        # GREEN bills are not re-applied; the fixed bill is now applied once
+        assert Entry.query.filter_by(bill_no='DLT-1001').count() == 1
+        assert Entry.query.filter_by(bill_no='DLT-1002').count() == 1
+        assert ReconBill.query.filter_by(bill_no='DLT-1002').one().status == 'GREEN'
+
+        # The old YELLOW row is history; the latest state of the bill has nothing to review
+        assert ReconBasket.query.filter_by(bill_no='DLT-1002', run_id=first_run.id).count() == 1
+        latest = data_lab.latest_basket_query().filter(ReconBasket.bill_no.like('DLT-%')).all()
+        assert sorted(r.bill_no for r in latest) == ['DLT-1003', 'DLT-1003', 'DLT-1004']
+
+
+def test_live_mode_reconciles_finance_against_database():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        reset_recon_state()
+        db.session.add(Entry(date='2026-02-01', time='09:00:00', type='OUT', material='Cement', qty=4,
+                             client_name='DLT Ahmed Traders', bill_no='DLT-1001'))
+        db.session.add(Entry(date='2026-02-01', time='09:05:00', type='OUT', material='Cement', qty=6,
+                             client_name='DLT Other Party', bill_no='DLT-1002'))
+        db.session.add(PendingBill(bill_no='DLT-1003', client_name='DLT Zeta Stores', amount=45))
+        db.session.commit()
+        entries_before = Entry.query.filter(Entry.bill_no.like('DLT-%')).count()
+
+        c = app.test_client()
+        resp = c.post('/data_lab/', data={
+            'mode': 'live',
+            'finance_file': (io.BytesIO(FINANCE_CSV.encode()), 'dlt_live.csv'),
+            'dispatch_file': (io.BytesIO(DISPATCH_CSV.encode()), 'dlt_ignored.csv'),
+        }, content_type='multipart/form-data')
+        assert resp.status_code == 302
+
+        run = ReconRun.query.filter_by(finance_file='dlt_live.csv').one()
+        assert run.mode == 'live' and run.dispatch_hash is None
+
+        # Agreeing bills are not re-applied: the database already is the dispatch side
+        assert Entry.query.filter(Entry.bill_no.like('DLT-%')).count() == entries_before
+        assert ReconBill.query.filter_by(bill_no='DLT-1001').one().status == 'GREEN'
+        # A pending bill with no dispatch still confirms the finance client
+        assert ReconBill.query.filter_by(bill_no='DLT-1003').one().status == 'GREEN'
+
+        yellow = ReconBasket.query.filter_by(bill_no='DLT-1002', run_id=run.id).one()
+        assert yellow.status == 'YELLOW' and yellow.inv_client == 'DLT Other Party' and yellow.inv_qty == 6
+        # Nothing from the ignored dispatch file reaches the basket
+        assert ReconBasket.query.filter_by(bill_no='DLT-1004').count() == 0
+        assert ReconBasket.query.filter_by(inv_client='DLT Walkin').count() == 0
+
+
+def test_basket_view_counts_filters_and_pages_by_status():
+    from datetime import datetime, timedelta
+    from blueprints import data_lab
+
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        reset_recon_state()
+        base = datetime(2026, 3, 1, 12, 0, 0)
+        for i in range(5):
+            db.session.add(ReconBasket(bill_no=f'DLT-P{i}', fin_client='DLT Pager', inv_client='DLT Pager Inv',
+                                       status='RED', created_at=base + timedelta(minutes=i)))
+        db.session.add(ReconBasket(bill_no='DLT-Y1', fin_client='DLT Other', status='YELLOW', created_at=base))
+        db.session.commit()
+
+        c = app.test_client()
+        resp = c.get('/data_lab/basket?bill_no=DLT-P&per_page=2')
+        html = resp.get_data(as_text=True)
+        assert resp.status_code == 200
+        assert 'RED (5)' in html and 'YELLOW (0)' in html
+        # Newest first, one page only
+        assert 'DLT-P4' in html and 'DLT-P3' in html and 'DLT-P2' not in html
+
+        query = data_lab.filtered_basket_query(client='dlt pager')
+        first, cursor = data_lab.basket_page(query, 'RED', per_page=2)
+        second, cursor = data_lab.basket_page(query, 'RED', cursor, per_page=2)
+        third, cursor = data_lab.basket_page(query, 'RED', cursor, per_page=2)
+        assert [r.bill_no for r in first + second + third] == [f'DLT-P{i}' for i in (4, 3, 2, 1, 0)]
+        assert cursor is None
+
+        resp = c.get('/data_lab/basket?bill_no=DLT-&client=Other')
+        html = resp.get_data(as_text=True)
+        assert 'YELLOW (1)' in html and 'DLT-P' not in html
+
+
+def test_purge_removes_only_old_superseded_basket_rows():
+    from datetime import datetime, timedelta
+    from blueprints import data_lab
+
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        reset_recon_state()
+        old = datetime.utcnow() - timedelta(days=data_lab.RECON_RETENTION_DAYS + 1)
+        run = ReconRun(finance_file='dlt_purge.csv')
+        db.session.add(run)
+        db.session.flush()
+        db.session.add(ReconBill(bill_no='DLT-OLD', signature='x', status='GREEN', run_id=run.id))
+        db.session.add(ReconBasket(bill_no='DLT-OLD', status='YELLOW', run_id=None, created_at=old))
+        db.session.add(ReconBasket(bill_no='DLT-OPEN', status='RED', created_at=old))
+        db.session.commit()
+
+        data_lab.purge_resolved_basket_rows()
+        assert ReconBasket.query.filter_by(bill_no='DLT-OLD').count() == 0
+        # Still the latest state of its bill, however old
+        assert ReconBasket.query.filter_by(bill_no='DLT-OPEN').count() == 1
+
+
+def test_bulk_resolution_applies_decisions_and_finance_threshold():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        reset_recon_state()
+        if not Client.query.filter_by(code='DLTC1').first():
+            db.session.add(Client(name='DLT Resolved Client', code='DLTC1'))
+        if not Client.query.filter_by(code='DLTC2').first():
+            db.session.add(Client(name='DLT Finance Name', code='DLTC2'))
+        for bill, fin, score in (('DLT-R1', 'DLT Anything', 40), ('DLT-R2', 'DLT Finance Name', 85),
+                                 ('DLT-R3', 'DLT Unlisted Finance', 80), ('DLT-R4', 'DLT Low Score', 30)):
+            db.session.add(ReconBasket(bill_no=bill, fin_client=fin, inv_client='DLT Typo', status='YELLOW',
+                                       match_score=score))
+            db.session.add(PendingBill(bill_no=bill, client_name='DLT Typo', client_code='OLD'))
+            db.session.add(Entry(date='2026-04-01', time='08:00:00', type='OUT', material='Cement', qty=1,
+                                 client_name='DLT Typo', client_code='OLD', bill_no=bill))
+        db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/data_lab/resolve_bulk', json={
+            'decisions': [{'bill_no': 'DLT-R1', 'client_code': 'DLTC1'}, ['DLT-R4', 'NOPE']]})
+        data = resp.get_json()
+        assert data['success'] and data['bills'] == 1 and data['unknown_client_codes'] == ['NOPE']
+        assert data['entries'] == 1 and data['pending_bills'] == 1 and data['basket_rows'] == 1
+        entry = Entry.query.filter_by(bill_no='DLT-R1').one()
+        assert (entry.client_name, entry.client_code) == ('DLT Resolved Client', 'DLTC1')
+        assert PendingBill.query.filter_by(bill_no='DLT-R1').one().client_code == 'DLTC1'
+
+        resp = c.post('/data_lab/resolve_bulk', json={'accept_finance_min_score': 75})
+        assert resp.get_json()['bills'] == 2
+        # Finance names matching a directory client pick up its code; others keep theirs
+        entry = Entry.query.filter_by(bill_no='DLT-R2').one()
+        assert (entry.client_name, entry.client_code) == ('DLT Finance Name', 'DLTC2')
+        pending = PendingBill.query.filter_by(bill_no='DLT-R3').one()
+        assert (pending.client_name, pending.client_code) == ('DLT Unlisted Finance', 'OLD')
+        # Below the threshold stays in the basket untouched
+        assert ReconBasket.query.filter_by(bill_no='DLT-R4').count() == 1
+        assert Entry.query.filter_by(bill_no='DLT-R4').one().client_name == 'DLT Typo'
+        assert ReconBasket.query.filter(ReconBasket.bill_no.in_(['DLT-R1', 'DLT-R2', 'DLT-R3'])).count() == 0
+
+        resp = c.post('/data_lab/resolve_bulk', json={'accept_finance_min_score': 'high'})
+        assert resp.status_code == 400
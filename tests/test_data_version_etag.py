@@ -0,0 +1,63 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Entry, Material, User
+from werkzeug.security import generate_password_hash
+
+
+def test_read_pages_and_exports_answer_304_until_data_changes():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='etagreader').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'etagreader',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='etagreader', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        if not Material.query.filter_by(code='ETGM').first():
+            db.session.add(Material(name='EtagBrand', code='ETGM'))
+            db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/login', data={'username': 'etagreader', 'password': 'testpass'}, follow_redirects=True)
+        assert resp.status_code == 200
+
+        for url in ['/stock_summary?date=2026-05-01', '/export_pending_bills?format=csv']:
+            first = c.get(url)
+            assert first.status_code == 200
+            etag = first.headers['ETag']
+            # Consume streamed bodies so each response's request context is popped in order
+            assert first.data
+            first.close()
+
+            cached = c.get(url, headers={'If-None-Match': etag})
+            assert cached.status_code == 304
+            assert cached.data == b''
+
+            db.session.add(Entry(date='2026-05-01', time='10:00:00', type='IN', material='EtagBrand', qty=1))
+            db.session.commit()
+
+            changed = c.get(url, headers={'If-None-Match': etag})
+            assert changed.status_code == 200
+            assert changed.headers['ETag'] != etag
+            assert changed.data
+            changed.close()
@@ -0,0 +1,56 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Entry, Material, User
+from werkzeug.security import generate_password_hash
+
+
+def test_csv_export_is_streamed_and_filtered():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='csvexporter').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'csvexporter',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='csvexporter', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        if not Material.query.filter_by(code='CSVM').first():
+            db.session.add(Material(name='CsvStreamBrand', code='CSVM'))
+        Entry.query.filter_by(material='CsvStreamBrand').delete()
+        db.session.add(Entry(date='2026-01-01', time='10:00:00', type='IN', material='CsvStreamBrand', qty=5))
+        db.session.add(Entry(date='2026-01-02', time='11:00:00', type='OUT', material='CsvStreamBrand',
+                             client='CsvClient', client_code='CSV01', qty=2, bill_no='CSV-1', created_by='tester'))
+        db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/login', data={'username': 'csvexporter', 'password': 'testpass'}, follow_redirects=True)
+        assert resp.status_code == 200
+
+        resp = c.get('/export/csv?material=CsvStreamBrand')
+        assert resp.status_code == 200
+        assert resp.is_streamed
+        lines = resp.get_data(as_text=True).strip().split('\n')
+        assert lines[0] == 'Date,Time,Type,Material,ClientName,ClientCode,Quantity,bill_no,nimbus_no,Captured By'
+        # Newest first, blank columns filled the same way the DataFrame export did
+        assert lines[1] == '2026-01-02,11:00:00,OUT,CsvStreamBrand,CsvClient,CSV01,2.0,CSV-1,,tester'
+        assert lines[2] == '2026-01-01,10:00:00,IN,CsvStreamBrand,,,5.0,,,System'
+        assert len(lines) == 3
@@ -0,0 +1,123 @@
+import io
+import os
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Client, Entry, ExportJob, Material, Payment, User
+from utils.export_jobs import EXPORT_PROGRESS_EVERY, JobProgress, fail_orphaned_jobs, local_job_ids, track_rows
+from werkzeug.security import generate_password_hash
+
+
+def _wait_for(c, status_url):
+    for _ in range(100):
+        status = c.get(status_url).get_json()
+        if status['status'] in ('DONE', 'FAILED'):
+            return status
+        time.sleep(0.05)
+    return status
+
+
+def test_export_jobs_write_zip_artifacts_and_reuse_them():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='jobexporter').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'jobexporter',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='jobexporter', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        if not Material.query.filter_by(code='JOBM').first():
+            db.session.add(Material(name='JobExportBrand', code='JOBM'))
+        client = Client.query.filter_by(code='JOB01').first()
+        if not client:
+            client = Client(name='JobLedgerClient', code='JOB01')
+            db.session.add(client)
+        Entry.query.filter_by(material='JobExportBrand').delete()
+        for day in range(1, 4):
+            db.session.add(Entry(date=f'2026-04-0{day}', time='10:00:00', type='IN', material='JobExportBrand', qty=day))
+        db.session.add(Payment(client_name='JobLedgerClient', amount=75.0, method='Cash', auto_bill_no='#JOB-PAY'))
+        db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/login', data={'username': 'jobexporter', 'password': 'testpass'}, follow_redirects=True)
+        assert resp.status_code == 200
+
+        job = c.post('/export_jobs', data={'kind': 'entries', 'format': 'csv', 'material': 'JobExportBrand', 'client': ''}).get_json()
+        assert job['success']
+        status = _wait_for(c, job['status_url'])
+        assert status['status'] == 'DONE'
+        assert status['current'] == status['total'] == 3
+        # Progress is read from the job row, so any worker process can report it
+        done = db.session.get(ExportJob, job['job_id'])
+        assert (done.progress_current, done.progress_total) == (3, 3)
+
+        resp = c.get(job['download_url'])
+        assert resp.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(resp.data)) as zf:
+            csv_text = zf.read(zf.namelist()[0]).decode('utf-8')
+        assert csv_text.count('JobExportBrand') == 3
+
+        # Same request, unchanged data: the finished artifact is reused
+        again = c.post('/export_jobs', data={'kind': 'entries', 'format': 'csv', 'material': 'JobExportBrand'}).get_json()
+        assert again['reused'] and again['job_id'] == job['job_id']
+
+        # Any data change produces a fresh job
+        db.session.add(Entry(date='2026-04-05', time='10:00:00', type='IN', material='JobExportBrand', qty=9))
+        db.session.commit()
+        fresh = c.post('/export_jobs', data={'kind': 'entries', 'format': 'csv', 'material': 'JobExportBrand'}).get_json()
+        assert not fresh['reused'] and fresh['job_id'] != job['job_id']
+        assert _wait_for(c, fresh['status_url'])['status'] == 'DONE'
+
+        ledger = c.post('/export_jobs', data={'kind': 'ledger', 'client_id': str(client.id), 'format': 'csv'}).get_json()
+        assert _wait_for(c, ledger['status_url'])['status'] == 'DONE'
+        with zipfile.ZipFile(io.BytesIO(c.get(ledger['download_url']).data)) as zf:
+            assert '#JOB-PAY' in zf.read(zf.namelist()[0]).decode('utf-8')
+
+        assert c.post('/export_jobs', data={'kind': 'nope'}).status_code == 400
+
+        # A job left running by a worker that went away is failed and re-queued, not reused forever
+        stuck = db.session.get(ExportJob, fresh['job_id'])
+        stuck.status = 'RUNNING'
+        db.session.commit()
+        local_job_ids.discard(stuck.id)
+        requeued = c.post('/export_jobs', data={'kind': 'entries', 'format': 'csv', 'material': 'JobExportBrand'}).get_json()
+        assert not requeued['reused'] and requeued['job_id'] != stuck.id
+        assert _wait_for(c, requeued['status_url'])['status'] == 'DONE'
+        db.session.expire_all()
+        assert db.session.get(ExportJob, stuck.id).status == 'FAILED'
+
+        # At startup, jobs whose worker process is gone are marked failed
+        orphan = ExportJob(kind='entries', params='{}', cache_key='orphan', status='RUNNING', worker_pid=None)
+        db.session.add(orphan)
+        db.session.commit()
+        assert fail_orphaned_jobs() >= 1
+        assert db.session.get(ExportJob, orphan.id).status == 'FAILED'
+
+        # A running job's progress is saved on its row every EXPORT_PROGRESS_EVERY rows
+        progress = JobProgress(orphan.id)
+        rows = track_rows(iter(range(EXPORT_PROGRESS_EVERY + 5)), progress, EXPORT_PROGRESS_EVERY + 5)
+        for _ in range(EXPORT_PROGRESS_EVERY):
+            next(rows)
+        db.session.expire_all()
+        saved = db.session.get(ExportJob, orphan.id)
+        assert (saved.progress_current, saved.progress_total) == (EXPORT_PROGRESS_EVERY, EXPORT_PROGRESS_EVERY + 5)
@@ -0,0 +1,62 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import load_workbook
+from app import create_app
+from models import db, Entry, Material, PendingBill, User
+from werkzeug.security import generate_password_hash
+
+
+def test_xlsx_exports_are_written_from_batched_rows():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='xlsxexporter').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'xlsxexporter',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='xlsxexporter', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        if not Material.query.filter_by(code='XLSM').first():
+            db.session.add(Material(name='XlsxStreamBrand', code='XLSM'))
+        Entry.query.filter_by(material='XlsxStreamBrand').delete()
+        db.session.add(Entry(date='2026-02-01', time='09:00:00', type='IN', material='XlsxStreamBrand', qty=7))
+        if not PendingBill.query.filter_by(bill_no='XLS-PB-1').first():
+            db.session.add(PendingBill(client_code='XLS01', client_name='XlsxClient', bill_no='XLS-PB-1', amount=42.5))
+        db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/login', data={'username': 'xlsxexporter', 'password': 'testpass'}, follow_redirects=True)
+        assert resp.status_code == 200
+
+        resp = c.get('/export/excel?material=XlsxStreamBrand')
+        assert resp.status_code == 200
+        rows = list(load_workbook(io.BytesIO(resp.data)).active.values)
+        assert rows[0][:4] == ('Date', 'Time', 'Type', 'Material')
+        assert rows[1][:4] == ('2026-02-01', '09:00:00', 'IN', 'XlsxStreamBrand')
+        assert rows[1][6] == 7
+        assert len(rows) == 2
+
+        resp = c.get('/export_pending_bills?format=excel')
+        assert resp.status_code == 200
+        rows = list(load_workbook(io.BytesIO(resp.data)).active.values)
+        assert rows[0] == ('ClientCode', 'BillNo', 'ClientName', 'Amount', 'Reason', 'NimbusNo')
+        assert ('XLS01', 'XLS-PB-1', 'XlsxClient', 42.5, None, None) in rows
@@ -85,3 +85,26 @@ def test_auto_invoice_avoids_collision():
         inv_b = Invoice.query.filter(Invoice.client_code == b.code).first()
         assert inv_b is not None
         assert inv_b.invoice_no != next_no
+
+        # A direct sale's auto invoice number skips a manual invoice already holding it
+        from utils.bill_numbers import format_bill_no, peek_next_bill_no
+        # The sale reserves its own bill number first, then the invoice number
+        taken_no = format_bill_no(int(peek_next_bill_no().lstrip('#')) + 1)
+        db.session.add(Invoice(client_code=a.code, client_name=a.name, invoice_no=taken_no, is_manual=True,
+                               total_amount=0, balance=0, created_at=date.today().strftime('%Y-%m-%d'),
+                               created_by='test'))
+        db.session.commit()
+        invoices_before = Invoice.query.filter_by(client_code=b.code).count()
+        resp = c.post('/add_direct_sale', data={
+            'client_name': 'ClientB',
+            'product_name[]': ['Tiles'],
+            'qty[]': ['1'],
+            'unit_rate[]': ['20.0'],
+            'amount': '20.0',
+            'paid_amount': '0.0',
+            'manual_bill_no': '',
+            'create_invoice': '1'
+        }, follow_redirects=True)
+        assert resp.status_code == 200
+        assert Invoice.query.filter_by(invoice_no=taken_no).one().client_code == a.code
+        assert Invoice.query.filter_by(client_code=b.code).count() == invoices_before + 1
@@ -0,0 +1,102 @@
+import io
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Invoice, Entry, DirectSale, DirectSaleItem, User
+from utils import render_cache
+from utils.documents import invoice_cache_key
+from werkzeug.security import generate_password_hash
+
+
+def test_invoice_version_bumps_and_keys_the_rendered_cache():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='invversioner').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'invversioner',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='invversioner', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        Invoice.query.filter_by(invoice_no='#VER-INV-1').delete()
+        inv = Invoice(client_code='VER01', client_name='VersionClient', invoice_no='#VER-INV-1',
+                      date=date(2026, 6, 1), total_amount=100.0, balance=100.0)
+        db.session.add(inv)
+        db.session.commit()
+        assert inv.version == 1
+
+        # A new entry on the invoice bumps it
+        db.session.add(Entry(date='2026-06-01', time='09:00:00', type='OUT', material='VersionBrand', qty=4,
+                             invoice_id=inv.id, bill_no='#VER-INV-1'))
+        db.session.commit()
+        assert inv.version == 2
+
+        c = app.test_client()
+        c.post('/login', data={'username': 'invversioner', 'password': 'testpass'}, follow_redirects=True)
+        page = c.get('/view_bill/VER-INV-1')
+        assert page.status_code == 200 and b'VersionBrand' in page.data
+        cached_key = invoice_cache_key(inv)
+        assert render_cache.load('invoice_cards', cached_key, 'html') is not None
+
+        # Repeat views and downloads are served from the cache
+        assert c.get('/view_bill/VER-INV-1').data == page.data
+        resp = c.get('/download_invoice/VER-INV-1')
+        assert resp.status_code == 200
+        resp.close()
+
+        # Balance changes and direct-sale item changes bump the version, so the old render is not reused
+        inv.balance = 40.0
+        db.session.commit()
+        assert inv.version == 3
+        sale = DirectSale(client_name='VersionClient', amount=100.0, invoice_id=inv.id)
+        db.session.add(sale)
+        db.session.commit()
+        assert inv.version == 4
+        db.session.add(DirectSaleItem(sale_id=sale.id, product_name='VersionBag', qty=2))
+        db.session.commit()
+        assert inv.version == 5
+        assert invoice_cache_key(inv) != cached_key
+        assert b'VersionBag' in c.get('/view_bill/VER-INV-1').data
+
+        # Unrelated writes leave it alone
+        db.session.add(Entry(date='2026-06-02', time='09:00:00', type='IN', material='VersionBrand', qty=1))
+        db.session.commit()
+        assert inv.version == 5
+
+        # Bulk deletes bypass the flush listener but still bump the invoices they touch
+        version = inv.version
+        resp = c.post(f'/edit_bill/DirectSale/{sale.id}', data={'client_name': 'VersionClient', 'amount': '100.0',
+                                                               'paid_amount': '0.0'})
+        assert resp.status_code == 302
+        db.session.refresh(inv)
+        assert inv.version > version
+        version = inv.version
+        page = c.get('/view_bill/VER-INV-1')
+        assert b'VersionBag' not in page.data and b'VersionBrand' in page.data
+
+        csv_text = 'Date,Material,Quantity,Type\n2026-06-01,VersionOther,1,IN\n'
+        resp = c.post('/import_data_ajax', data={'mode': 'daily', 'date': '2026-06-01',
+                                                 'file': (io.BytesIO(csv_text.encode()), 'daily.csv')})
+        assert resp.get_json()['success']
+        db.session.refresh(inv)
+        assert inv.version > version
+        assert b'VersionBrand' not in c.get('/view_bill/VER-INV-1').data
@@ -0,0 +1,96 @@
+import os
+import sys
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, DirectSale, DirectSaleItem, Entry, Material, MaterialStockSnapshot, User
+from utils.stock_ledger import current_stock, opening_stock, stock_page
+from werkzeug.security import generate_password_hash
+
+
+def test_material_ledger_pages_balance_from_snapshot():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='stockreader').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'stockreader',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='stockreader', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        Entry.query.filter_by(material='SnapCement').delete()
+        for sale in DirectSale.query.filter(DirectSale.auto_bill_no.like('#SNAP-%')):
+            db.session.delete(sale)
+        MaterialStockSnapshot.query.filter_by(material='SnapCement').delete()
+        material = Material.query.filter_by(code='SNAP01').first()
+        if not material:
+            material = Material(name='SnapCement', code='SNAP01')
+            db.session.add(material)
+        for month in (1, 2, 3):
+            db.session.add(Entry(date=f'2026-{month:02d}-05', time='08:00:00', type='IN', material='SnapCement',
+                                 qty=100, bill_no=f'GRN-{month}'))
+            db.session.add(Entry(date=f'2026-{month:02d}-10', time='12:00:00', type='OUT', material='SnapCement',
+                                 qty=30, client='SnapClient', bill_no=f'#SNAPD-{month}'))
+        # A current direct sale (with its dispatch entry) and an older one that never got an entry
+        current = DirectSale(client_name='SnapClient', amount=10, auto_bill_no='#SNAP-1',
+                             date_posted=datetime(2026, 3, 12, 9))
+        legacy = DirectSale(client_name='SnapClient', amount=20, auto_bill_no='#SNAP-2',
+                            date_posted=datetime(2026, 2, 20, 9))
+        db.session.add_all([current, legacy])
+        db.session.flush()
+        db.session.add_all([DirectSaleItem(sale_id=current.id, product_name='SnapCement', qty=5),
+                            DirectSaleItem(sale_id=legacy.id, product_name='SnapCement', qty=8)])
+        db.session.add(Entry(date='2026-03-12', time='09:00:00', type='OUT', material='SnapCement', qty=5,
+                             client='SnapClient', bill_no='#SNAP-1', auto_bill_no='#SNAP-1'))
+        db.session.commit()
+
+        # Every movement once, newest first, balances matching a replay
+        rows, after = [], None
+        while True:
+            page, after, opening = stock_page('SnapCement', after=after, per_page=2)
+            rows.extend(page)
+            if not after:
+                break
+        assert opening == 0.0
+        assert len(rows) == 8 and len({(r.source, r.source_id) for r in rows}) == 8
+        balance = 0.0
+        for r in reversed(rows):
+            balance += r.added - r.delivered
+            assert abs(r.balance - balance) < 1e-9
+        assert balance == 300 - 90 - 5 - 8 == current_stock('SnapCement')
+
+        # A ranged page starts from the stock before the range and writes that month's snapshot
+        march, _, opening = stock_page('SnapCement', start_date=date(2026, 3, 1), end_date=date(2026, 3, 31))
+        assert opening == 200 - 60 - 8
+        assert [r.bill_no for r in march] == ['#SNAP-1', '#SNAPD-3', 'GRN-3']
+        assert march[0].balance == balance
+        snapshot = MaterialStockSnapshot.query.filter_by(material='SnapCement', day='2026-03-01').one()
+        assert snapshot.balance == opening
+
+        # An earlier movement drops the stale snapshot, and the next read rebuilds it
+        db.session.add(Entry(date='2026-02-15', time='10:00:00', type='IN', material='SnapCement', qty=50))
+        db.session.commit()
+        assert MaterialStockSnapshot.query.filter_by(material='SnapCement', day='2026-03-01').first() is None
+        assert opening_stock('SnapCement', date(2026, 3, 11)) == opening + 50 + 100 - 30
+
+        c = app.test_client()
+        c.post('/login', data={'username': 'stockreader', 'password': 'testpass'}, follow_redirects=True)
+        page = c.get(f'/material_ledger/{material.id}?start_date=2026-03-01')
+        assert page.status_code == 200 and b'#SNAPD-3' in page.data and b'Opening stock' in page.data
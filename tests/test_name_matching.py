@@ -0,0 +1,117 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Client, Entry, User
+from utils.name_matching import NameIndex, name_similarity, normalize_name
+from werkzeug.security import generate_password_hash
+
+
+def test_normalization_and_similarity():
+    assert normalize_name('M/S Ahmed Traders (Pvt.) Ltd.') == 'ahmed traders'
+    assert name_similarity('M/S Ahmed Traders', 'AHMED TRADERS') == 100
+    assert name_similarity('Traders Ahmed', 'Ahmed Traders') == 100
+    assert name_similarity('Ahmad Traders', 'Ahmed Traders') >= 60
+    assert name_similarity('Ahmed Traders', 'Zeta Builders') < 40
+    assert name_similarity('', 'Ahmed Traders') == 0
+
+
+def test_index_blocks_candidates_and_ranks_matches():
+    index = NameIndex([(1, 'Ahmed Traders'), (2, 'Ahmed Brothers'), (3, 'Zeta Builders')])
+    assert index.best_match('m/s ahmed traders') == (1, 'Ahmed Traders', 100)
+    assert 3 not in index.candidates('ahmed traders')
+    assert index.best_match('Completely Unknown') is None
+
+    index.add(4, 'Khan Cement Co.')
+    assert index.best_match('KHAN CEMENT')[0] == 4
+
+    # Imports add to a copy, leaving the shared index untouched
+    private = index.copy()
+    private.add(5, 'Noor Steel')
+    assert private.best_match('noor steel')[0] == 5
+    assert index.best_match('noor steel') is None
+
+
+def test_client_search_api_falls_back_to_fuzzy_matches():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='fuzzysearcher').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 0, 0)"
+                ), {
+                    'u': 'fuzzysearcher',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='fuzzysearcher', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        if not Client.query.filter_by(code='FZY01').first():
+            db.session.add(Client(name='M/S Qureshi Fuzzy Traders', code='FZY01'))
+            db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/login', data={'username': 'fuzzysearcher', 'password': 'testpass'}, follow_redirects=True)
+        assert resp.status_code == 200
+
+        results = c.get('/api/clients/search?q=QURESHI FUZZY TRADER').get_json()
+        assert {'name': 'M/S Qureshi Fuzzy Traders', 'code': 'FZY01'} in results
+
+
+def test_import_renames_only_exactly_matched_clients():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='fuzzyimporter').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'fuzzyimporter',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='fuzzyimporter', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        client = Client.query.filter_by(code='FZI01').first()
+        if not client:
+            client = Client(name='RVAHMED TRADERS', code='FZI01')
+            db.session.add(client)
+        client.name = 'RVAHMED TRADERS'
+        db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/login', data={'username': 'fuzzyimporter', 'password': 'testpass'}, follow_redirects=True)
+        assert resp.status_code == 200
+
+        csv_text = 'Date,Material,ClientName,Quantity,Type\n2026-05-02,FuzzyImportCement,M/S RvAhmed Traders,3,OUT\n'
+        resp = c.post('/import_data_ajax', data={'file': (io.BytesIO(csv_text.encode()), 'entries.csv')})
+        assert resp.get_json()['success']
+
+        # The fuzzy match is used for the row but does not rename the client
+        assert db.session.get(Client, client.id).name == 'RVAHMED TRADERS'
+        assert Entry.query.filter_by(material='FuzzyImportCement').one().client_code == 'FZI01'
@@ -0,0 +1,88 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Client, Payment, PaymentAllocation, PendingBill, User
+from utils.payment_allocation import client_outstanding, outstanding_by_bill
+from werkzeug.security import generate_password_hash
+
+
+def test_payments_are_recorded_as_allocations_without_touching_bill_amounts():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='allocator').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'allocator',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='allocator', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        PendingBill.query.filter_by(client_name='AllocClient').delete()
+        Payment.query.filter_by(client_name='AllocClient').delete()
+        bills = [PendingBill(client_name='AllocClient', client_code='ALC01', bill_no=f'ALC-{i}', amount=amount)
+                 for i, amount in enumerate((100.0, 200.0, 300.0), 1)]
+        db.session.add_all(bills)
+        db.session.commit()
+        b1, b2, b3 = (b.id for b in bills)
+
+        c = app.test_client()
+        c.post('/login', data={'username': 'allocator', 'password': 'testpass'}, follow_redirects=True)
+
+        resp = c.post('/add_payment', data={'client_name': 'AllocClient', 'amount': '250', 'method': 'Cash'})
+        assert resp.status_code == 302
+        first = Payment.query.filter_by(client_name='AllocClient').one()
+        allocations = PaymentAllocation.query.filter_by(payment_id=first.id).order_by(PaymentAllocation.id).all()
+        assert [(a.bill_id, a.amount) for a in allocations] == [(b1, 100.0), (b2, 150.0)]
+        # Bill amounts are kept; balances come from the allocation sums
+        assert [db.session.get(PendingBill, b).amount for b in (b1, b2, b3)] == [100.0, 200.0, 300.0]
+        assert [db.session.get(PendingBill, b).is_paid for b in (b1, b2, b3)] == [True, False, False]
+        assert outstanding_by_bill([b1, b2, b3]) == {b1: 0.0, b2: 50.0}
+        assert client_outstanding('AllocClient') == 350.0
+
+        c.post('/add_payment', data={'client_name': 'AllocClient', 'amount': '100', 'method': 'Cash'})
+        db.session.expire_all()
+        assert db.session.get(PendingBill, b2).is_paid
+        assert client_outstanding('AllocClient') == 250.0
+
+        # Editing the first payment re-applies it from scratch
+        c.post(f'/edit_bill/Payment/{first.id}', data={'amount': '100', 'manual_bill_no': ''})
+        db.session.expire_all()
+        assert [(a.bill_id, a.amount) for a in PaymentAllocation.query.filter_by(payment_id=first.id)] == [(b1, 100.0)]
+        assert not db.session.get(PendingBill, b2).is_paid
+        assert client_outstanding('AllocClient') == 400.0
+
+        # Deleting it reopens the bill it settled
+        c.get(f'/delete_bill/Payment/{first.id}')
+        db.session.expire_all()
+        assert PaymentAllocation.query.filter_by(payment_id=first.id).count() == 0
+        assert not db.session.get(PendingBill, b1).is_paid
+        assert client_outstanding('AllocClient') == 500.0
+
+        # Editing a bill's amount re-derives its paid flag from what is allocated to it (50 of b2)
+        if not Client.query.filter_by(code='ALC01').first():
+            db.session.add(Client(name='AllocClient', code='ALC01'))
+            db.session.commit()
+        edit = {'client_code': 'ALC01', 'bill_no': 'ALC-2', 'nimbus_no': '', 'reason': '', 'photo_url': ''}
+        c.post(f'/edit_pending_bill/{b2}', data=dict(edit, amount='40'))
+        db.session.expire_all()
+        assert db.session.get(PendingBill, b2).is_paid
+        c.post(f'/edit_pending_bill/{b2}', data=dict(edit, amount='60'))
+        db.session.expire_all()
+        assert not db.session.get(PendingBill, b2).is_paid
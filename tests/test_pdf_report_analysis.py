@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Entry, Material, User
+from utils.data_version import get_data_version
+from werkzeug.security import generate_password_hash
+
+
+def test_pdf_report_analysis_and_cache_follow_data_version():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='pdfreporter').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'pdfreporter',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='pdfreporter', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        if not Material.query.filter_by(code='PDFM').first():
+            db.session.add(Material(name='PdfReportBrand', code='PDFM'))
+        Entry.query.filter_by(material='PdfReportBrand').delete()
+        db.session.add(Entry(date='2026-03-01', time='08:00:00', type='IN', material='PdfReportBrand', qty=40))
+        db.session.add(Entry(date='2026-03-02', time='08:00:00', type='OUT', material='PdfReportBrand', client='PdfClient', qty=15))
+        db.session.commit()
+
+        c = app.test_client()
+        resp = c.post('/login', data={'username': 'pdfreporter', 'password': 'testpass'}, follow_redirects=True)
+        assert resp.status_code == 200
+
+        url = '/export/pdf?material=PdfReportBrand'
+        first = c.get(url).get_data(as_text=True)
+        assert '25 Bags' in first
+        assert c.get(url).get_data(as_text=True) == first
+
+        # A committed change bumps the data version and invalidates the cached render
+        version = get_data_version()
+        db.session.add(Entry(date='2026-03-03', time='08:00:00', type='OUT', material='PdfReportBrand', client='PdfClient', qty=5))
+        db.session.commit()
+        assert get_data_version() > version
+        assert '20 Bags' in c.get(url).get_data(as_text=True)
+
+        # Bulk updates bump it too
+        version = get_data_version()
+        Entry.query.filter_by(material='PdfReportBrand', type='IN').update({'qty': 50})
+        db.session.commit()
+        assert get_data_version() > version
+        assert '30 Bags' in c.get(url).get_data(as_text=True)
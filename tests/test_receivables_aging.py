@@ -0,0 +1,98 @@
+import io
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Client, Invoice, PendingBill, User
+from utils.receivables import aging_report
+from werkzeug.security import generate_password_hash
+
+
+def test_aging_buckets_pending_bills_and_open_invoices():
+    app = create_app()
+    app.testing = True
+
+    with app.app_context():
+        db.create_all()
+        admin = User.query.filter_by(username='ager').first()
+        if not admin:
+            from sqlalchemy import text
+            cols = [r[1] for r in db.session.execute(text("PRAGMA table_info('user')")).fetchall()]
+            if 'password' in cols:
+                db.session.execute(text(
+                    "INSERT INTO user (username, password, password_hash, role, can_view_stock, can_view_daily, can_view_history, can_import_export, can_manage_directory) VALUES (:u, :p, :ph, :r, 1, 1, 1, 1, 0)"
+                ), {
+                    'u': 'ager',
+                    'p': 'testpass',
+                    'ph': generate_password_hash('testpass'),
+                    'r': 'admin'
+                })
+                db.session.commit()
+            else:
+                admin = User(username='ager', password_hash=generate_password_hash('testpass'), role='admin')
+                db.session.add(admin)
+                db.session.commit()
+
+        PendingBill.query.filter_by(client_code='AGE01').delete()
+        Invoice.query.filter_by(client_code='AGE01').delete()
+        if not Client.query.filter_by(code='AGE01').first():
+            db.session.add(Client(name='AgingClient', code='AGE01', category='Misc'))
+        db.session.add_all([
+            # Aged from the recorded date when the bill has no date of its own
+            PendingBill(client_name='AgingClient', client_code='AGE01', bill_no='AGE-1', amount=100.0,
+                        created_at='2026-05-25 10:00'),
+            PendingBill(client_name='AgingClient', client_code='AGE01', bill_no='AGE-2', amount=200.0,
+                        date=date(2026, 4, 1)),
+            PendingBill(client_name='AgingClient', client_code='AGE01', bill_no='AGE-3', amount=999.0,
+                        date=date(2026, 1, 1), is_paid=True),
+            Invoice(client_name='AgingClient', client_code='AGE01', invoice_no='#AGE-INV-1', date=date(2026, 1, 15),
+                    total_amount=500.0, balance=300.0, status='PARTIAL'),
+            Invoice(client_name='AgingClient', client_code='AGE01', invoice_no='#AGE-INV-2', date=date(2026, 5, 1),
+                    total_amount=500.0, balance=0.0, status='PAID'),
+        ])
+        db.session.commit()
+        assert PendingBill.query.filter_by(bill_no='AGE-1').one().created_on == date(2026, 5, 25)
+
+        report = aging_report(date(2026, 6, 1))
+        row = next(r for r in report['rows'] if r['client'] == 'AgingClient')
+        assert row['category'] == 'Misc'
+        assert (row['days_0_30'], row['days_31_60'], row['days_61_90'], row['days_90_plus']) == (100.0, 0.0, 200.0, 300.0)
+        assert row['total'] == 600.0
+        # Unchanged data: the cached report object is served
+        assert aging_report(date(2026, 6, 1)) is report
+
+        # An earlier as_of leaves out bills dated after it, so the buckets still add up to the total
+        earlier = next(r for r in aging_report(date(2026, 5, 1))['rows'] if r['client'] == 'AgingClient')
+        assert (earlier['days_0_30'], earlier['days_61_90'], earlier['days_90_plus']) == (200.0, 0.0, 300.0)
+        assert earlier['total'] == 500.0
+        assert sum(earlier[key] for key in ('days_0_30', 'days_31_60', 'days_61_90', 'days_90_plus', 'undated')) == 500.0
+
+        c = app.test_client()
+        c.post('/login', data={'username': 'ager', 'password': 'testpass'}, follow_redirects=True)
+        page = c.get('/receivables_aging?as_of=2026-06-01')
+        assert page.status_code == 200 and b'AgingClient' in page.data
+        csv_text = c.get('/receivables_aging?as_of=2026-06-01&format=csv').data.decode('utf-8')
+        assert 'AgingClient,Misc,100.0,0.0,200.0,300.0,0.0,600.0' in csv_text
+        assert c.get('/receivables_aging?format=excel').status_code == 200
+
+        # An invoiced direct sale creates a pending bill and an invoice with the same number; it is counted once
+        def client_total():
+            return next((r['total'] for r in aging_report()['rows'] if r['client'] == 'AgingClient'), 0.0)
+
+        before = client_total()
+        for _ in range(2):
+            resp = c.post('/add_direct_sale', data={
+                'client_name': 'AgingClient',
+                'product_name[]': ['AgingCement'],
+                'qty[]': ['1'],
+                'unit_rate[]': ['10.0'],
+                'amount': '10.0',
+                'paid_amount': '0.0',
+                'manual_bill_no': '',
+                'create_invoice': '1'
+            }, follow_redirects=True)
+            assert resp.status_code == 200
+        assert client_total() == before + 20.0
@@ -0,0 +1,147 @@
+"""
+Bill numbers.
+Auto numbers come from the single BillCounter row through one atomic
+``UPDATE ... RETURNING``, so concurrent workers never hand out the same
+number. It runs in its own short transaction unless the caller's session has
+already flushed writes: that session then holds SQLite's write lock, so the
+update joins its transaction instead of waiting on it (and is rolled back
+with it). A worker may reserve a block of numbers per round-trip and serve
+from it, except inside such a transaction.
+
+Models with a ``bill_no_num`` column keep the integer value of ``bill_no``
+in it, set on every ORM write and backfilled at startup, so numeric ordering
+and range filters use an index instead of ``CAST(bill_no AS INTEGER)``.
+"""
+import os
+import re
+import threading
+
+from sqlalchemy import Integer, cast, event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, BillCounter, Entry, PendingBill
+
+# First number handed out on a fresh database
+BILL_COUNTER_START = 1000
+
+# Numbers reserved per database round-trip by get_next_bill_no. Numbers left in a
+# worker's block when it exits are skipped, so keep this at 1 unless gaps are acceptable.
+BILL_BLOCK_SIZE = 1
+
+_counter_table = BillCounter.__table__
+_block = {'pid': None, 'next': 0, 'end': 0}
+_block_lock = threading.Lock()
+
+
+def _session_write_connection():
+    """The session's connection if it holds uncommitted, flushed writes, else None."""
+    session = db.session()
+    if not session.in_transaction():
+        return None
+    connection = session.connection()
+    # pysqlite opens its transaction at the first write statement
+    return connection if connection.connection.dbapi_connection.in_transaction else None
+
+
+def reserve_bill_numbers(count=1, engine=None):
+    """
+    Atomically reserve ``count`` consecutive bill numbers.
+
+    Args:
+        count: Size of the block to reserve
+        engine: Engine to allocate on (defaults to the app database; the
+            session's transaction is joined when it already holds writes)
+
+    Returns:
+        range of the reserved integers
+    """
+    counter_id = select(func.min(_counter_table.c.id)).scalar_subquery()
+    stmt = update(_counter_table).where(_counter_table.c.id == counter_id).values(
+        count=_counter_table.c.count + count).returning(_counter_table.c.count)
+    connection = _session_write_connection() if engine is None else None
+    if connection is not None:
+        end = connection.execute(stmt).scalar()
+        if end is not None:
+            return range(end - count, end)
+        connection.execute(insert(_counter_table).values(id=1, count=BILL_COUNTER_START + count))
+        return range(BILL_COUNTER_START, BILL_COUNTER_START + count)
+
+    engine = engine or db.engine
+    while True:
+        with engine.begin() as conn:
+            end = conn.execute(stmt).scalar()
+        if end is not None:
+            return range(end - count, end)
+        # First allocation on this database: create the row, or lose the race and retry the update
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(_counter_table).values(id=1, count=BILL_COUNTER_START + count))
+            return range(BILL_COUNTER_START, BILL_COUNTER_START + count)
+        except IntegrityError:
+            continue
+
+
+def format_bill_no(number):
+    return f"#{number}"
+
+
+def get_next_bill_no():
+    """Return the next auto bill number ('#1234'), reserving a new block when the current one runs out."""
+    if _session_write_connection() is not None:
+        # Reserved in the caller's transaction: a rollback returns it, so it must not be kept in a block
+        return format_bill_no(reserve_bill_numbers(1).start)
+    with _block_lock:
+        # A forked worker must not reuse its parent's block
+        if _block['pid'] != os.getpid() or _block['next'] >= _block['end']:
+            numbers = reserve_bill_numbers(BILL_BLOCK_SIZE)
+            _block.update(pid=os.getpid(), next=numbers.start, end=numbers.stop)
+        number = _block['next']
+        _block['next'] += 1
+    return format_bill_no(number)
+
+
+def peek_next_bill_no():
+    """The number the next allocation will most likely return, for display only."""
+    with _block_lock:
+        if _block['pid'] == os.getpid() and _block['next'] < _block['end']:
+            return format_bill_no(_block['next'])
+    count = db.session.execute(select(_counter_table.c.count).order_by(_counter_table.c.id).limit(1)).scalar()
+    return format_bill_no(count if count is not None else BILL_COUNTER_START)
+
+
+# Models carrying a bill_no_num column
+NUMBERED_BILL_MODELS = (PendingBill, Entry)
+
+_LEADING_INTEGER = re.compile(r'\s*([+-]?\d+)')
+
+
+def bill_no_number(bill_no):
+    """
+    Integer value of a bill number, matching SQLite's CAST(bill_no AS INTEGER).
+
+    The leading integer is used ('1001', '1001-A' -> 1001); text without one
+    gives 0 and a missing bill number gives None.
+    """
+    if bill_no is None:
+        return None
+    match = _LEADING_INTEGER.match(str(bill_no))
+    return int(match.group(1)) if match else 0
+
+
+def _set_bill_no_num(mapper, connection, target):
+    target.bill_no_num = bill_no_number(target.bill_no)
+
+
+for _model in NUMBERED_BILL_MODELS:
+    event.listen(_model, 'before_insert', _set_bill_no_num)
+    event.listen(_model, 'before_update', _set_bill_no_num)
+
+
+def backfill_bill_no_numbers():
+    """Fill bill_no_num for rows written before the column existed (or by raw SQL)."""
+    # Core statements: a derived column is not a data change, so the data version is left alone
+    for model in NUMBERED_BILL_MODELS:
+        table = model.__table__
+        db.session.execute(update(table).where(table.c.bill_no.isnot(None), table.c.bill_no_num.is_(None)).values(
+            bill_no_num=cast(table.c.bill_no, Integer)))
+    db.session.commit()
@@ -0,0 +1,146 @@
+"""
+Registry of bill and invoice numbers.
+Every number held by a booking, payment, direct sale, invoice, pending bill or
+dispatch entry has a BillRegistry row pointing at its owner, so "which record
+is bill X" is one indexed probe instead of a query per table. ORM writes keep
+the registry in step from a flush listener; bulk writers call ``sync_bills``.
+Lookups re-check the owner row, so a registry row left behind by a bulk
+delete is ignored rather than trusted.
+"""
+from itertools import chain
+
+from sqlalchemy import and_, delete, event, insert, inspect, literal, select, tuple_
+from sqlalchemy.orm import Session
+
+from models import db, BillRegistry, Booking, Payment, DirectSale, Invoice, PendingBill, Entry
+
+# Model -> columns holding bill numbers
+REGISTERED_FIELDS = {
+    Booking: ('auto_bill_no', 'manual_bill_no'),
+    Payment: ('auto_bill_no', 'manual_bill_no'),
+    DirectSale: ('auto_bill_no', 'manual_bill_no'),
+    Invoice: ('invoice_no',),
+    PendingBill: ('bill_no',),
+    Entry: ('bill_no',),
+}
+
+MODELS_BY_NAME = {model.__name__: model for model in REGISTERED_FIELDS}
+
+# Bill numbers per IN (...) chunk
+SYNC_CHUNK_SIZE = 500
+
+_registry = BillRegistry.__table__
+
+
+def _rows_for(obj):
+    owner_type = type(obj).__name__
+    for field in REGISTERED_FIELDS[type(obj)]:
+        value = getattr(obj, field)
+        if value:
+            yield {'bill_no': value, 'owner_type': owner_type, 'owner_id': obj.id, 'field': field}
+
+
+def _bill_fields_changed(obj):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in REGISTERED_FIELDS[type(obj)])
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_on_flush(session, flush_context):
+    """Replace the registry rows of registered objects whose bill numbers were written or deleted."""
+    changed = [obj for obj in session.new if type(obj) in REGISTERED_FIELDS]
+    changed += [obj for obj in session.dirty if type(obj) in REGISTERED_FIELDS and _bill_fields_changed(obj)]
+    deleted = [obj for obj in session.deleted if type(obj) in REGISTERED_FIELDS]
+    if not changed and not deleted:
+        return
+
+    connection = session.connection()
+    owners = [(type(obj).__name__, obj.id) for obj in chain(changed, deleted)]
+    for i in range(0, len(owners), SYNC_CHUNK_SIZE):
+        connection.execute(delete(_registry).where(
+            tuple_(_registry.c.owner_type, _registry.c.owner_id).in_(owners[i:i + SYNC_CHUNK_SIZE])))
+    rows = [row for obj in changed for row in _rows_for(obj)]
+    if rows:
+        connection.execute(insert(_registry), rows)
+
+
+def _owner_select(model, field, condition=None):
+    column = getattr(model, field)
+    stmt = select(column, literal(model.__name__), model.id, literal(field)).where(column.isnot(None), column != '')
+    return stmt.where(condition(column)) if condition is not None else stmt
+
+
+def sync_bills(bill_nos):
+    """Rebuild the registry rows of the given numbers from the owner tables (for bulk writes)."""
+    bill_nos = [b for b in dict.fromkeys(bill_nos) if b]
+    columns = [_registry.c.bill_no, _registry.c.owner_type, _registry.c.owner_id, _registry.c.field]
+    for i in range(0, len(bill_nos), SYNC_CHUNK_SIZE):
+        chunk = bill_nos[i:i + SYNC_CHUNK_SIZE]
+        db.session.execute(delete(_registry).where(_registry.c.bill_no.in_(chunk)))
+        for model, fields in REGISTERED_FIELDS.items():
+            for field in fields:
+                db.session.execute(insert(_registry).from_select(
+                    columns, _owner_select(model, field, lambda column: column.in_(chunk))))
+
+
+def rebuild_bill_registry():
+    """Rebuild the whole registry with set-based INSERT ... SELECTs (startup backfill)."""
+    columns = [_registry.c.bill_no, _registry.c.owner_type, _registry.c.owner_id, _registry.c.field]
+    db.session.execute(delete(_registry))
+    for model, fields in REGISTERED_FIELDS.items():
+        for field in fields:
+            db.session.execute(insert(_registry).from_select(columns, _owner_select(model, field)))
+    db.session.commit()
+
+
+def ensure_bill_registry():
+    """Backfill the registry when it is empty (first start with the registry table)."""
+    if db.session.execute(select(_registry.c.id).limit(1)).first() is None:
+        rebuild_bill_registry()
+
+
+def find_bill_owner(bill_no, owners):
+    """
+    Return the first live record holding ``bill_no`` among ``owners``.
+
+    Args:
+        bill_no: Exact bill or invoice number
+        owners: Sequence of (model name, field) pairs in order of preference
+
+    Returns:
+        Tuple of (model name, record), or (None, None)
+    """
+    rows = db.session.execute(select(_registry.c.owner_type, _registry.c.owner_id, _registry.c.field).where(
+        _registry.c.bill_no == bill_no,
+        _registry.c.owner_type.in_({owner_type for owner_type, _ in owners}))).all()
+    found = {(row.owner_type, row.field): row.owner_id for row in rows}
+    for owner_type, field in owners:
+        owner_id = found.get((owner_type, field))
+        if owner_id is None:
+            continue
+        record = db.session.get(MODELS_BY_NAME[owner_type], owner_id)
+        # Skip registry rows left behind by bulk deletes or renumbering
+        if record is not None and getattr(record, field) == bill_no:
+            return owner_type, record
+    return None, None
+
+
+def first_entry_for_bill(bill_no):
+    """First dispatch entry carrying ``bill_no``, probed through the registry."""
+    return Entry.query.join(BillRegistry, and_(
+        BillRegistry.owner_id == Entry.id, BillRegistry.owner_type == 'Entry', BillRegistry.bill_no == Entry.bill_no
+    )).filter(BillRegistry.bill_no == bill_no).order_by(Entry.id).first()
+
+
+def search_bill_numbers(prefix, limit=20):
+    """Distinct registered numbers starting with ``prefix`` (an index range scan on bill_no)."""
+    if not prefix:
+        return []
+    # At most one distinct row per owner type per number, so this limit always covers ``limit`` numbers
+    stmt = select(_registry.c.bill_no, _registry.c.owner_type).distinct().where(
+        _registry.c.bill_no >= prefix, _registry.c.bill_no < prefix + '\uffff'
+    ).order_by(_registry.c.bill_no).limit(limit * len(REGISTERED_FIELDS))
+    results = {}
+    for bill_no, owner_type in db.session.execute(stmt):
+        results.setdefault(bill_no, set()).add(owner_type)
+    return [{'bill_no': bill_no, 'types': sorted(types)} for bill_no, types in list(results.items())[:limit]]
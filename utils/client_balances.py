@@ -0,0 +1,128 @@
+"""
+Materialized per-client balances.
+One ClientBalance row per client name holds the ledger balance (bookings and
+direct sales billed minus everything paid against them, as on the financial
+ledger) and the outstanding amount of unpaid pending bills. Rows are
+recomputed from indexed per-client sums in the same transaction as any ORM
+write to a booking, payment, direct sale, pending bill or allocation; bulk
+writers call ``refresh_client_balances`` with the names they touched.
+Reading a balance is a single lookup on the unique client_name index.
+"""
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import delete, event, func, insert, inspect, select, union_all
+from sqlalchemy.orm import Session
+
+from models import db, ClientBalance, Booking, Payment, DirectSale, PendingBill, PaymentAllocation
+from utils.payment_allocation import allocated_amount
+
+# Models whose client_name feeds a balance
+BALANCE_SOURCES = (Booking, Payment, DirectSale, PendingBill)
+
+# Client names per IN (...) chunk
+REFRESH_CHUNK_SIZE = 500
+
+_balance_table = ClientBalance.__table__
+
+
+def _ledger_select(names=None):
+    parts = [
+        select(Booking.client_name.label('client_name'), func.coalesce(Booking.amount, 0.0).label('debit'),
+               func.coalesce(Booking.paid_amount, 0.0).label('credit')),
+        select(Payment.client_name, 0.0, func.coalesce(Payment.amount, 0.0)),
+        select(DirectSale.client_name, func.coalesce(DirectSale.amount, 0.0),
+               func.coalesce(DirectSale.paid_amount, 0.0)),
+    ]
+    if names is not None:
+        parts = [part.where(part.selected_columns[0].in_(names)) for part in parts]
+    ledger = union_all(*parts).subquery()
+    return select(ledger.c.client_name, func.sum(ledger.c.debit - ledger.c.credit)).where(
+        ledger.c.client_name.isnot(None)).group_by(ledger.c.client_name)
+
+
+def _pending_select(names=None):
+    stmt = select(PendingBill.client_name,
+                  func.sum(func.coalesce(PendingBill.amount, 0.0) - allocated_amount())).where(
+        PendingBill.is_paid == False, PendingBill.client_name.isnot(None))
+    if names is not None:
+        stmt = stmt.where(PendingBill.client_name.in_(names))
+    return stmt.group_by(PendingBill.client_name)
+
+
+def _write_balances(connection, names=None):
+    ledger = dict(connection.execute(_ledger_select(names)).all())
+    pending = dict(connection.execute(_pending_select(names)).all())
+    stmt = delete(_balance_table)
+    if names is not None:
+        stmt = stmt.where(_balance_table.c.client_name.in_(names))
+    connection.execute(stmt)
+    now = datetime.utcnow()
+    rows = [{'client_name': name, 'ledger_balance': ledger.get(name) or 0.0,
+             'pending_balance': pending.get(name) or 0.0, 'updated_at': now}
+            for name in set(ledger) | set(pending)]
+    if rows:
+        connection.execute(insert(_balance_table), rows)
+    return len(rows)
+
+
+def refresh_client_balances(names, connection=None):
+    """Recompute the balances of the given client names (for bulk writes that bypass the flush)."""
+    connection = connection or db.session.connection()
+    names = [n for n in set(names) if n]
+    for i in range(0, len(names), REFRESH_CHUNK_SIZE):
+        _write_balances(connection, names[i:i + REFRESH_CHUNK_SIZE])
+
+
+def rebuild_client_balances():
+    """Recompute every client's balance from scratch; returns the number of balance rows."""
+    count = _write_balances(db.session.connection())
+    db.session.commit()
+    return count
+
+
+def ensure_client_balances():
+    """Build the balances on the first start with the table (empty table, existing ledger rows)."""
+    if db.session.execute(select(_balance_table.c.id).limit(1)).first() is not None:
+        return
+    if any(db.session.execute(select(model.id).limit(1)).first() for model in BALANCE_SOURCES):
+        rebuild_client_balances()
+
+
+def _history_names(obj):
+    history = inspect(obj).attrs['client_name'].history
+    return [n for n in chain(history.added, history.unchanged, history.deleted) if n]
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_on_flush(session, flush_context):
+    names, bill_ids = set(), set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, BALANCE_SOURCES):
+            names.update(_history_names(obj))
+        elif isinstance(obj, PaymentAllocation) and obj.bill_id:
+            bill_ids.add(obj.bill_id)
+    connection = session.connection()
+    if bill_ids:
+        names.update(n for (n,) in connection.execute(
+            select(PendingBill.client_name).where(PendingBill.id.in_(bill_ids))) if n)
+    if names:
+        refresh_client_balances(names, connection)
+
+
+def client_balance(client_name):
+    """(ledger balance, pending balance) of one client; zeros when it has no rows."""
+    row = db.session.execute(select(_balance_table.c.ledger_balance, _balance_table.c.pending_balance).where(
+        _balance_table.c.client_name == client_name)).first()
+    return (row.ledger_balance, row.pending_balance) if row else (0.0, 0.0)
+
+
+def client_balances(names):
+    """{client name: (ledger balance, pending balance)} for the given names (missing names omitted)."""
+    names = [n for n in set(names) if n]
+    if not names:
+        return {}
+    rows = db.session.execute(select(
+        _balance_table.c.client_name, _balance_table.c.ledger_balance, _balance_table.c.pending_balance
+    ).where(_balance_table.c.client_name.in_(names))).all()
+    return {row.client_name: (row.ledger_balance, row.pending_balance) for row in rows}
@@ -0,0 +1,151 @@
+"""
+Saved column-mapping profiles for uploaded tables.
+A file's header row is hashed into a signature. The first upload with a new
+signature detects the mapping and saves it as a profile; later uploads with
+the same headers reuse the profile (or a named one saved by a user) without
+detection. Files are read with only the mapped columns and renamed to the
+canonical names in one step.
+"""
+import hashlib
+import io
+import json
+import re
+from functools import partial
+
+import pandas as pd
+
+from models import db, ColumnMappingProfile
+
+# kind -> {'columns': canonical column names, 'detect': fn(headers) -> {source: canonical}}
+MAPPING_KINDS = {}
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def header_key(header):
+    """Compact form of a header for alias matching ('Bill No' -> 'billno')."""
+    return _NON_WORD.sub('', str(header).lower())
+
+
+def header_signature(headers):
+    """Order-independent hash of a file's header row."""
+    names = sorted(str(h).strip() for h in headers)
+    return hashlib.sha256('\x1f'.join(names).encode('utf-8')).hexdigest()
+
+
+def register_mapping_kind(kind, columns):
+    """Decorator registering the detector used the first time a header signature is seen."""
+    def decorator(detect):
+        MAPPING_KINDS[kind] = {'columns': list(columns), 'detect': detect}
+        return detect
+    return decorator
+
+
+def detect_by_aliases(headers, aliases):
+    """Map headers whose compact form is in ``aliases``; the first header wins per canonical column."""
+    mapping, taken = {}, set()
+    for header in headers:
+        canonical = aliases.get(header_key(header))
+        if canonical and canonical not in taken:
+            mapping[header] = canonical
+            taken.add(canonical)
+    return mapping
+
+
+ENTRY_IMPORT_COLUMNS = ['Date', 'Time', 'Type', 'Material', 'ClientName', 'ClientCode', 'Quantity',
+                        'bill_no', 'nimbus_no', 'Captured By']
+
+
+@register_mapping_kind('entries', ENTRY_IMPORT_COLUMNS)
+def detect_entry_import_columns(headers):
+    aliases = {header_key(c): c for c in ENTRY_IMPORT_COLUMNS}
+    aliases.update({'client': 'ClientName', 'qty': 'Quantity', 'capturedby': 'Captured By'})
+    return detect_by_aliases(headers, aliases)
+
+
+PENDING_BILL_IMPORT_COLUMNS = ['ClientName', 'ClientCode', 'BillNo', 'NimbusNo', 'Amount', 'Reason']
+
+
+@register_mapping_kind('pending_bills', PENDING_BILL_IMPORT_COLUMNS)
+def detect_pending_bill_import_columns(headers):
+    aliases = {header_key(c): c for c in PENDING_BILL_IMPORT_COLUMNS}
+    aliases.update({'client': 'ClientName'})
+    return detect_by_aliases(headers, aliases)
+
+
+def resolve_mapping(kind, headers):
+    """
+    Return the {source header: canonical column} mapping for a header row.
+
+    Uses the saved profile (one probe on the unique kind/signature index, so
+    edits made by any worker apply at once); on a miss the mapping is
+    detected once and saved as an automatic profile.
+    """
+    signature = header_signature(headers)
+    profile = ColumnMappingProfile.query.filter_by(kind=kind, signature=signature).first()
+    if profile:
+        mapping = json.loads(profile.mapping)
+    else:
+        mapping = MAPPING_KINDS[kind]['detect']([h for h in headers if isinstance(h, str)])
+        db.session.add(ColumnMappingProfile(name=f"{kind}-{signature[:8]}", kind=kind, signature=signature,
+                                            mapping=json.dumps(mapping), headers=json.dumps(list(map(str, headers)))))
+        db.session.commit()
+    return mapping
+
+
+def save_profile(kind, name, headers, mapping):
+    """Create or replace the profile for this kind and header row."""
+    columns = MAPPING_KINDS[kind]['columns']
+    unknown = [c for c in mapping.values() if c not in columns]
+    if unknown:
+        raise ValueError(f"Unknown column(s) for {kind}: {', '.join(unknown)}")
+    missing = [h for h in mapping if h not in headers]
+    if missing:
+        raise ValueError(f"Header(s) not in the sample file: {', '.join(missing)}")
+
+    signature = header_signature(headers)
+    profile = ColumnMappingProfile.query.filter_by(kind=kind, signature=signature).first()
+    if not profile:
+        profile = ColumnMappingProfile(kind=kind, signature=signature)
+        db.session.add(profile)
+    profile.name = name or f"{kind}-{signature[:8]}"
+    profile.mapping = json.dumps(mapping)
+    profile.headers = json.dumps(list(map(str, headers)))
+    db.session.commit()
+    return profile
+
+
+def table_reader(filename):
+    """pandas reader for an uploaded file, by extension."""
+    if filename.lower().endswith('.csv'):
+        return pd.read_csv
+    return partial(pd.read_excel, engine='openpyxl')
+
+
+def read_headers(file_storage):
+    """Return (raw bytes, reader, header row) of an uploaded table without parsing its rows."""
+    data = file_storage.read()
+    file_storage.stream.seek(0)
+    reader = table_reader(file_storage.filename)
+    try:
+        headers = list(reader(io.BytesIO(data), nrows=0).columns)
+    except Exception:
+        # Misnamed files: fall back to CSV
+        reader = pd.read_csv
+        headers = list(reader(io.BytesIO(data), nrows=0).columns)
+    return data, reader, headers
+
+
+def read_mapped_table(file_storage, kind):
+    """
+    Read an uploaded table with only its mapped columns, renamed to canonical names.
+
+    Returns:
+        DataFrame whose columns are a subset of the kind's canonical columns
+    """
+    data, reader, headers = read_headers(file_storage)
+    mapping = resolve_mapping(kind, headers)
+    if not mapping:
+        # Nothing recognised: keep the row count, drop every column
+        return reader(io.BytesIO(data), usecols=headers[:1]).iloc[:, :0]
+    return reader(io.BytesIO(data), usecols=list(mapping)).rename(columns=mapping)
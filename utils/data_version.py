@@ -0,0 +1,50 @@
+"""
+Global data version counter.
+Every flush or bulk write that touches a tracked model bumps the single
+``data_version`` row inside the same transaction, so anything cached against
+the version is invalidated exactly when committed business data changes.
+"""
+from itertools import chain
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import (db, DataVersion, Entry, PendingBill, Client, Material, Booking, BookingItem,
+                    Payment, PaymentAllocation, DirectSale, DirectSaleItem, Invoice)
+
+# Models whose changes invalidate version-keyed caches
+TRACKED_MODELS = (Entry, PendingBill, Client, Material, Booking, BookingItem, Payment,
+                  PaymentAllocation, DirectSale, DirectSaleItem, Invoice)
+
+_version_table = DataVersion.__table__
+
+
+def get_data_version():
+    """Return the current data version (0 before the first tracked change)."""
+    return db.session.execute(
+        select(_version_table.c.version).where(_version_table.c.id == 1)).scalar() or 0
+
+
+def bump_data_version(connection):
+    """Increment the data version on the given connection's transaction."""
+    result = connection.execute(
+        update(_version_table).where(_version_table.c.id == 1).values(version=_version_table.c.version + 1))
+    if result.rowcount == 0:
+        connection.execute(insert(_version_table).values(id=1, version=1))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_flush(session, flush_context):
+    """Bump when a flush wrote any tracked ORM object."""
+    if any(isinstance(obj, TRACKED_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        bump_data_version(session.connection())
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bump_on_bulk_write(orm_execute_state):
+    """Bump for bulk ``query.update()``/``delete()`` and ORM bulk inserts, which bypass the flush."""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, TRACKED_MODELS):
+        bump_data_version(orm_execute_state.session.connection())
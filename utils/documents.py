@@ -0,0 +1,135 @@
+"""
+Printable documents: invoices and client statements.
+HTML is rendered from the templates in the calling process; the expensive
+HTML -> PDF conversion runs in a process pool when a batch is large enough.
+Every rendered document is cached on disk under a key naming its owner and
+version, so unchanged documents are never rendered twice.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from types import SimpleNamespace
+
+from flask import render_template
+
+from utils import render_cache
+
+# Below this many documents to convert, PDF conversion stays in-process
+PARALLEL_MIN_DOCUMENTS = 4
+
+
+def pdf_available():
+    try:
+        import weasyprint  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def document_extension():
+    """'pdf' when weasyprint is installed, otherwise documents are shipped as 'html'."""
+    return 'pdf' if pdf_available() else 'html'
+
+
+def html_to_pdf(html):
+    """Convert one HTML document to PDF bytes (top-level so process pools can run it)."""
+    from weasyprint import HTML
+    return HTML(string=html).write_pdf()
+
+
+def invoice_view(invoice):
+    """
+    Shape an Invoice into the fields the bill card expects, leaving the ORM object untouched.
+
+    Returns:
+        Tuple of (bill namespace, items list)
+    """
+    items = []
+    if invoice.direct_sales:
+        items = [{'name': it.product_name, 'qty': it.qty} for it in invoice.direct_sales[0].items]
+    if not items and invoice.entries:
+        items = [{'name': e.material, 'qty': e.qty} for e in invoice.entries]
+    total = invoice.total_amount or 0.0
+    bill = SimpleNamespace(
+        auto_bill_no=invoice.invoice_no,
+        client_name=invoice.client_name,
+        amount=total,
+        paid_amount=(total - invoice.balance) if invoice.balance is not None else 0,
+        date_posted=datetime.combine(invoice.date, datetime.min.time()) if invoice.date else None,
+    )
+    return bill, items
+
+
+def invoice_cache_key(invoice):
+    """Render-cache key of an invoice: changes exactly when ``Invoice.version`` is bumped."""
+    return render_cache.cache_key('invoice', invoice.id, invoice.version or 0)
+
+
+def render_invoice_html(invoice):
+    bill, items = invoice_view(invoice)
+    return render_template('invoice_document.html', bill=bill, type='Invoice', items=items)
+
+
+def invoice_card_html(invoice):
+    """The bill card of an invoice for view_bill, rendered once per invoice version."""
+    key = invoice_cache_key(invoice)
+    body = render_cache.load('invoice_cards', key, 'html')
+    if body is None:
+        bill, items = invoice_view(invoice)
+        body = render_template('_bill_card.html', bill=bill, type='Invoice', items=items).encode('utf-8')
+        render_cache.store('invoice_cards', key, 'html', body)
+    return body.decode('utf-8')
+
+
+def invoice_document_path(invoice):
+    """Path of the cached printable invoice (rendered on a miss), and its download file name."""
+    return render_document_path(f"invoice-{invoice.invoice_no}", 'invoices', invoice_cache_key(invoice),
+                                lambda: render_invoice_html(invoice))
+
+
+def render_documents(specs, progress=None, workers=None):
+    """
+    Render documents, serving cached ones from disk.
+
+    Args:
+        specs: Iterable of (name, cache namespace, cache key, render_html callable)
+        progress: Optional dict whose 'current' counts finished documents
+        workers: Process count for PDF conversion (defaults to all cores)
+
+    Yields:
+        Tuples of (file name with extension, document bytes)
+    """
+    ext = document_extension()
+    progress = progress if progress is not None else {}
+    progress.setdefault('current', 0)
+
+    pending = []
+    for name, namespace, key, render_html in specs:
+        body = render_cache.load(namespace, key, ext)
+        if body is not None:
+            progress['current'] += 1
+            yield f"{name}.{ext}", body
+        else:
+            pending.append((name, namespace, key, render_html()))
+
+    def finish(name, namespace, key, body):
+        render_cache.store(namespace, key, ext, body)
+        progress['current'] += 1
+        return f"{name}.{ext}", body
+
+    if ext == 'html' or len(pending) < PARALLEL_MIN_DOCUMENTS:
+        for name, namespace, key, html in pending:
+            body = html_to_pdf(html) if ext == 'pdf' else html.encode('utf-8')
+            yield finish(name, namespace, key, body)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = {pool.submit(html_to_pdf, html): (name, namespace, key) for name, namespace, key, html in pending}
+        for future in as_completed(futures):
+            yield finish(*futures[future], future.result())
+
+
+def render_document_path(name, namespace, key, render_html):
+    """Render a single document unless cached; returns (cache file path, file name with extension)."""
+    file_name, _ = next(render_documents([(name, namespace, key, render_html)]))
+    return render_cache.cache_path(namespace, key, document_extension()), file_name
@@ -0,0 +1,220 @@
+"""
+Background export jobs.
+Large exports run on a small thread pool instead of inside the request and
+write a zip artifact under ``instance/exports``. Identical requests made
+before the data changes reuse the finished (or in-flight) job. Progress is
+saved on the ExportJob row every few hundred rows, so a status poll served by
+any worker process sees it.
+"""
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from models import db, ExportJob
+from utils.data_version import get_data_version
+from utils.render_cache import cache_key
+
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'instance', 'exports')
+
+# Finished artifacts older than this are deleted when new jobs are submitted
+EXPORT_RETENTION_DAYS = 7
+
+# A job still queued or running after this long is assumed lost with its worker
+EXPORT_JOB_TIMEOUT = timedelta(hours=2)
+
+UNFINISHED_STATUSES = ('QUEUED', 'RUNNING')
+
+# Progress is written to the job row whenever it advances by this many rows
+EXPORT_PROGRESS_EVERY = 500
+
+# kind -> writer(params, progress) returning (file name inside the zip, iterable of chunks),
+# or for bundle kinds (zip file name, iterable of (member name, bytes))
+JOB_WRITERS = {}
+JOB_BUNDLES = set()
+
+# Ids of the jobs this process queued and has not finished yet
+local_job_ids = set()
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='export-job')
+
+
+def register_export_job(kind, bundle=False):
+    """Decorator registering the writer function for an export kind (``bundle`` for multi-file zips)."""
+    def decorator(fn):
+        JOB_WRITERS[kind] = fn
+        if bundle:
+            JOB_BUNDLES.add(kind)
+        return fn
+    return decorator
+
+
+class JobProgress(dict):
+    """
+    A writer's {'current': rows written, 'total': rows expected} dict, saved on its job row.
+
+    The update is committed on the job thread's own session: a second
+    connection could not commit while that session streams a query.
+    """
+
+    def __init__(self, job_id):
+        super().__init__(current=0, total=0)
+        self.job_id = job_id
+        self._saved = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if key == 'total' or self['current'] - self._saved >= EXPORT_PROGRESS_EVERY:
+            self.save()
+
+    def save(self):
+        db.session.execute(update(ExportJob).where(ExportJob.id == self.job_id).values(
+            progress_current=self['current'], progress_total=self['total']))
+        db.session.commit()
+        self._saved = self['current']
+
+
+def track_rows(rows, progress, total):
+    """Yield rows unchanged while counting them into a job progress dict."""
+    progress['total'] = total
+    for i, row in enumerate(rows, 1):
+        progress['current'] = i
+        yield row
+
+
+def artifact_path(job):
+    """Absolute path of a job's zip artifact."""
+    return os.path.join(EXPORT_DIR, f"export_{job.id}.zip")
+
+
+def submit_export_job(app, kind, params, username):
+    """
+    Queue an export job, or return an existing one for the same request.
+
+    Returns:
+        Tuple of (ExportJob, reused) where reused is True if no new work was queued
+    """
+    if kind not in JOB_WRITERS:
+        raise ValueError(f"Unknown export kind: {kind}")
+
+    key = cache_key(kind, params, get_data_version())
+    existing = ExportJob.query.filter(ExportJob.cache_key == key,
+                                      ExportJob.status.in_(['QUEUED', 'RUNNING', 'DONE'])
+                                      ).order_by(ExportJob.id.desc()).first()
+    if existing and existing.status in UNFINISHED_STATUSES and _job_orphaned(existing):
+        _mark_failed(existing)
+        db.session.commit()
+    elif existing and (existing.status != 'DONE' or os.path.exists(artifact_path(existing))):
+        return existing, True
+
+    purge_expired_exports()
+    job = ExportJob(kind=kind, params=json.dumps(params, sort_keys=True), cache_key=key,
+                    status='QUEUED', created_by=username, worker_pid=os.getpid())
+    db.session.add(job)
+    db.session.commit()
+    local_job_ids.add(job.id)
+    _executor.submit(_run_job, app, job.id)
+    return job, False
+
+
+def _worker_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _job_orphaned(job):
+    """True for a queued/running job whose worker has gone (restarted, crashed) or that timed out."""
+    if job.created_at and datetime.utcnow() - job.created_at > EXPORT_JOB_TIMEOUT:
+        return True
+    if not job.worker_pid:
+        return True
+    if job.worker_pid == os.getpid():
+        # A job of an earlier process that had the same pid
+        return job.id not in local_job_ids
+    return not _worker_alive(job.worker_pid)
+
+
+def _mark_failed(job, error='Export interrupted: its worker stopped before finishing'):
+    job.status = 'FAILED'
+    job.error = error
+    job.finished_at = datetime.utcnow()
+
+
+def fail_orphaned_jobs():
+    """Mark queued/running jobs whose worker is gone as failed (run at startup); returns how many."""
+    orphaned = [job for job in ExportJob.query.filter(ExportJob.status.in_(UNFINISHED_STATUSES))
+                if _job_orphaned(job)]
+    for job in orphaned:
+        _mark_failed(job)
+    db.session.commit()
+    return len(orphaned)
+
+
+def job_status(job):
+    """JSON-serialisable status for a job, with the progress last saved on its row."""
+    return {
+        'job_id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'current': job.progress_current or 0,
+        'total': job.progress_total or 0,
+        'error': job.error,
+        'file_name': job.file_name,
+    }
+
+
+def _run_job(app, job_id):
+    with app.app_context():
+        job = db.session.get(ExportJob, job_id)
+        job.status = 'RUNNING'
+        db.session.commit()
+
+        progress = JobProgress(job_id)
+        path = artifact_path(job)
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            name, contents = JOB_WRITERS[job.kind](json.loads(job.params or '{}'), progress)
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                if job.kind in JOB_BUNDLES:
+                    for member_name, body in contents:
+                        zf.writestr(member_name, body)
+                else:
+                    with zf.open(name, 'w') as fh:
+                        for chunk in contents:
+                            fh.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            os.replace(tmp_path, path)
+            job.status = 'DONE'
+            job.progress_current, job.progress_total = progress['current'], progress['total']
+            job.file_name = name if job.kind in JOB_BUNDLES else f"{os.path.splitext(name)[0]}.zip"
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(ExportJob, job_id)
+            job.status = 'FAILED'
+            job.error = str(e)[:500]
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        db.session.remove()
+        local_job_ids.discard(job_id)
+
+
+def purge_expired_exports(days=EXPORT_RETENTION_DAYS):
+    """Delete artifacts and records of jobs finished more than ``days`` ago."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    for job in ExportJob.query.filter(ExportJob.finished_at < cutoff).all():
+        path = artifact_path(job)
+        if os.path.exists(path):
+            os.remove(path)
+        db.session.delete(job)
+    db.session.commit()
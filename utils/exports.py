@@ -0,0 +1,93 @@
+"""
+Streaming export helpers.
+Exports are written straight from batched query results so a worker never
+holds the whole result set (or the finished file) in memory.
+"""
+import csv
+import io
+import tempfile
+
+from openpyxl import Workbook
+
+# Rows fetched per database round-trip and written per yielded chunk
+EXPORT_BATCH_SIZE = 1000
+
+
+def iter_query_rows(query, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Iterate plain column tuples from a column-only query in batches.
+
+    Args:
+        query: SQLAlchemy query selecting columns (not ORM entities)
+        batch_size: Number of rows fetched per batch
+    """
+    return query.yield_per(batch_size)
+
+
+def stream_csv(headers, rows, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield CSV text chunks: the header line first, then one chunk per batch.
+
+    Args:
+        headers: Column names written as the first line
+        rows: Iterable of row sequences
+        batch_size: Number of rows buffered before a chunk is yielded
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    def flush():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return chunk
+
+    # Send the header straight away so the download starts immediately
+    writer.writerow(headers)
+    yield flush()
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= batch_size:
+            yield flush()
+            pending = 0
+    if pending:
+        yield flush()
+
+
+def write_xlsx(headers, rows, sheet_title='Sheet1'):
+    """
+    Write rows into an xlsx file spooled to disk and return it rewound.
+
+    Uses an openpyxl write-only worksheet, so rows are flushed as they are
+    appended instead of building the whole workbook in memory. The caller
+    owns the returned file (``send_file`` closes it once sent).
+
+    Args:
+        headers: Column names written as the first row
+        rows: Iterable of row sequences
+        sheet_title: Name of the single worksheet
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title)
+    sheet.append(headers)
+    for row in rows:
+        # Result rows are tuple-like but openpyxl only accepts plain sequences
+        sheet.append(tuple(row))
+
+    output = tempfile.TemporaryFile(suffix='.xlsx')
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def iter_file_chunks(fh, chunk_size=64 * 1024):
+    """Yield the contents of an open binary file in chunks, closing it afterwards."""
+    with fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,42 @@
+"""
+Conditional GET support keyed by the global data version.
+Read pages and exports answer ``If-None-Match`` with 304 Not Modified before
+the view runs, so unchanged data costs one tiny version lookup instead of the
+page's queries and rendering.
+"""
+import hashlib
+from datetime import date
+from functools import wraps
+
+from flask import make_response, request, session
+from flask_login import current_user
+
+from utils.data_version import get_data_version
+
+
+def data_version_etag_value():
+    """ETag for the current request: data version, user, full URL and today's date."""
+    user_id = current_user.get_id() if current_user.is_authenticated else None
+    raw = f"{get_data_version()}|{user_id}|{request.full_path}|{date.today()}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def data_version_etag(view):
+    """Decorator adding data-version ETags and 304 responses to a GET view."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Pending flash messages must be rendered, never swallowed by a 304
+        if request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        etag = data_version_etag_value()
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
@@ -0,0 +1,87 @@
+"""
+Per-invoice version counter.
+``Invoice.version`` is bumped in the flushing transaction whenever the
+invoice row itself, one of its dispatch entries, one of its direct sales or
+a direct sale's items is written, so a render cached under (invoice id,
+version) is stale exactly when the printed invoice would change. Bulk
+writers that bypass the flush call ``bump_invoice_versions``, or
+``bump_linked_invoices`` before deleting entries or direct sales in bulk.
+"""
+from itertools import chain
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from models import db, Invoice, Entry, DirectSale, DirectSaleItem
+
+_invoice_table = Invoice.__table__
+_direct_sale_table = DirectSale.__table__
+_version_bump = update(_invoice_table).values(version=func.coalesce(_invoice_table.c.version, 0) + 1)
+
+
+def _history_values(obj, attr):
+    """Current and previous values of a column attribute (both invoices of a moved row)."""
+    history = inspect(obj).attrs[attr].history
+    return [v for v in chain(history.added, history.unchanged, history.deleted) if v is not None]
+
+
+def _invoice_changed(obj):
+    state = inspect(obj)
+    return any(attr.history.has_changes() for attr in state.attrs if attr.key != 'version')
+
+
+def bump_invoice_versions(invoice_ids=(), sale_ids=(), connection=None):
+    """Increment the version of the given invoices and of the invoices linked to the given direct sales."""
+    connection = connection or db.session.connection()
+    invoice_ids, sale_ids = set(invoice_ids), set(sale_ids)
+    if invoice_ids:
+        connection.execute(_version_bump.where(_invoice_table.c.id.in_(invoice_ids)))
+    if sale_ids:
+        # An invoice bumped above for the same flush is bumped twice, which is harmless
+        bump_linked_invoices(DirectSale, DirectSale.id.in_(sale_ids), connection=connection)
+
+
+def bump_linked_invoices(model, *criteria, connection=None):
+    """
+    Increment the version of the invoices linked to the matching rows of ``model``.
+
+    Args:
+        model: Entry or DirectSale
+        criteria: Filters selecting the rows (none = every row); call before
+            a bulk delete, while the rows still exist
+    """
+    connection = connection or db.session.connection()
+    table = model.__table__
+    linked = select(table.c.invoice_id).where(*criteria, table.c.invoice_id.isnot(None))
+    connection.execute(_version_bump.where(_invoice_table.c.id.in_(linked)))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_flush(session, flush_context):
+    invoice_ids, sale_ids = set(), set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Invoice):
+            if obj not in session.new and obj not in session.deleted and _invoice_changed(obj):
+                invoice_ids.add(obj.id)
+        elif isinstance(obj, (Entry, DirectSale)):
+            invoice_ids.update(_history_values(obj, 'invoice_id'))
+        elif isinstance(obj, DirectSaleItem):
+            sale_ids.update(_history_values(obj, 'sale_id'))
+    if not invoice_ids and not sale_ids:
+        return
+    bump_invoice_versions(invoice_ids, sale_ids, session.connection())
+    session.info.setdefault('bumped_invoice_ids', set()).update(invoice_ids)
+    if sale_ids:
+        session.info['bumped_invoice_ids'].update(
+            obj.id for obj in session.identity_map.values() if isinstance(obj, Invoice))
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_bumped_versions(session, flush_context):
+    """Reload ``version`` on in-session invoices after the Core update changed it."""
+    bumped = session.info.pop('bumped_invoice_ids', None)
+    if not bumped:
+        return
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Invoice) and obj.id in bumped:
+            session.expire(obj, ['version'])
@@ -0,0 +1,219 @@
+"""
+Client ledgers computed in SQL.
+The financial ledger is one UNION ALL over bookings, payments and direct
+sales with the running balance from a window function over the client's
+whole history, so a filtered or paginated page still shows true balances.
+Pages are keyset-paginated newest first. The material ledger pages OUT
+deliveries and undelivered direct sales the same way, then loads only the
+page's rows with their sale items eagerly. Batch statements compute many
+clients per query, grouped and partitioned by client name.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import String, cast, func, literal, or_, select, tuple_, union_all
+from sqlalchemy.orm import selectinload
+
+from models import db, Booking, Payment, DirectSale, Entry
+
+# Rows per ledger page
+LEDGER_PAGE_SIZE = 50
+
+# Client names per IN (...) chunk of a batch statement run
+STATEMENT_CHUNK_SIZE = 500
+
+
+def _ledger_parts():
+    """Booking, payment and direct sale selects sharing the ledger columns, client_name first."""
+    bookings = select(Booking.client_name.label('client_name'), Booking.date_posted.label('posted_at'),
+                      literal('Booking').label('description'), Booking.auto_bill_no.label('bill_no'),
+                      func.coalesce(Booking.amount, 0.0).label('debit'),
+                      func.coalesce(Booking.paid_amount, 0.0).label('credit'),
+                      literal('Booking').label('source'), Booking.id.label('source_id'))
+    payments = select(Payment.client_name, Payment.date_posted,
+                      ('Payment (' + func.coalesce(Payment.method, '') + ')'), Payment.auto_bill_no,
+                      literal(0.0), func.coalesce(Payment.amount, 0.0), literal('Payment'), Payment.id)
+    direct_sales = select(DirectSale.client_name, DirectSale.date_posted, literal('Direct Sale'),
+                          DirectSale.auto_bill_no, func.coalesce(DirectSale.amount, 0.0),
+                          func.coalesce(DirectSale.paid_amount, 0.0), literal('DirectSale'), DirectSale.id)
+    return bookings, payments, direct_sales
+
+
+def ledger_union(client_name):
+    """Bookings, payments and direct sales of a client as one unordered UNION ALL select."""
+    return union_all(*(part.where(part.selected_columns[0] == client_name) for part in _ledger_parts()))
+
+
+def clients_ledger_union(names):
+    """The ledger rows of several clients at once; ``client_name`` tells them apart."""
+    return union_all(*(part.where(part.selected_columns[0].in_(names)) for part in _ledger_parts()))
+
+
+def ledger_history_query(client):
+    """Date, description, bill number, debit and credit of a client's ledger, newest first (for exports)."""
+    history = ledger_union(client.name).subquery()
+    return select(history.c.posted_at, history.c.description, history.c.bill_no, history.c.debit,
+                  history.c.credit).order_by(history.c.posted_at.desc(), history.c.source.desc(),
+                                             history.c.source_id.desc())
+
+
+def ledger_with_balance(client_name):
+    """The ledger with ``posted_key`` (stored timestamp text) and a window running ``balance`` per row."""
+    history = ledger_union(client_name).subquery()
+    posted_key = cast(history.c.posted_at, String)
+    balance = func.sum(history.c.debit - history.c.credit).over(
+        order_by=(posted_key, history.c.source, history.c.source_id))
+    return select(history, posted_key.label('posted_key'), balance.label('balance')).subquery()
+
+
+def encode_ledger_cursor(*key):
+    return '|'.join(str(part) for part in key)
+
+
+def decode_ledger_cursor(cursor):
+    """Parse a 'sortkey|source|id' cursor; None when missing or malformed."""
+    try:
+        sort_key, source, row_id = cursor.rsplit('|', 2)
+        return sort_key, source, int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _day_bounds(start_date, end_date):
+    start = datetime.combine(start_date, datetime.min.time()) if start_date else None
+    end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1) if end_date else None
+    return start, end
+
+
+def financial_page(client, start_date=None, end_date=None, after=None, per_page=LEDGER_PAGE_SIZE):
+    """
+    One page of a client's financial ledger, newest first.
+
+    Args:
+        client: Client
+        start_date, end_date: Optional inclusive date range
+        after: Cursor returned with the previous page
+
+    Returns:
+        Tuple of (rows with posted_at, description, bill_no, debit, credit,
+        source, source_id and balance; cursor of the next page or None)
+    """
+    ledger = ledger_with_balance(client.name)
+    stmt = select(ledger)
+    start, end = _day_bounds(start_date, end_date)
+    if start:
+        stmt = stmt.where(ledger.c.posted_at >= start)
+    if end:
+        stmt = stmt.where(ledger.c.posted_at < end)
+    key = decode_ledger_cursor(after)
+    if key:
+        stmt = stmt.where(tuple_(ledger.c.posted_key, ledger.c.source, ledger.c.source_id) < key)
+    stmt = stmt.order_by(ledger.c.posted_key.desc(), ledger.c.source.desc(), ledger.c.source_id.desc())
+
+    rows = db.session.execute(stmt.limit(per_page + 1)).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        next_cursor = encode_ledger_cursor(last.posted_key, last.source, last.source_id)
+    return rows[:per_page], next_cursor
+
+
+def client_statements(clients, start_date=None, end_date=None, chunk_size=STATEMENT_CHUNK_SIZE):
+    """
+    Statements of many clients over [start_date, end_date], a chunk of clients per query.
+
+    Each chunk costs one grouped query for the opening balances and one for
+    the rows in range, whose running balance is a window partitioned by client.
+
+    Yields:
+        Tuples of (client, dict with opening_balance, rows (posted_at,
+        description, bill_no, debit, credit, balance), total_debit,
+        total_credit and closing_balance)
+    """
+    start, end = _day_bounds(start_date, end_date)
+    clients = list(clients)
+    for i in range(0, len(clients), chunk_size):
+        chunk = clients[i:i + chunk_size]
+        history = clients_ledger_union(list({c.name for c in chunk})).subquery()
+        openings = {}
+        if start:
+            openings = dict(db.session.execute(
+                select(history.c.client_name, func.sum(history.c.debit - history.c.credit)).where(
+                    history.c.posted_at < start).group_by(history.c.client_name)).all())
+
+        ranged = select(history)
+        if start:
+            ranged = ranged.where(history.c.posted_at >= start)
+        if end:
+            ranged = ranged.where(history.c.posted_at < end)
+        ranged = ranged.subquery()
+        order = (ranged.c.posted_at, ranged.c.source, ranged.c.source_id)
+        balance = func.sum(ranged.c.debit - ranged.c.credit).over(partition_by=ranged.c.client_name, order_by=order)
+        rows_by_name = {}
+        for row in db.session.execute(select(ranged, balance.label('balance')).order_by(ranged.c.client_name, *order)):
+            rows_by_name.setdefault(row.client_name, []).append(row)
+
+        for client in chunk:
+            opening = openings.get(client.name) or 0.0
+            rows = [{'posted_at': row.posted_at, 'description': row.description, 'bill_no': row.bill_no,
+                     'debit': row.debit, 'credit': row.credit, 'balance': opening + row.balance}
+                    for row in rows_by_name.get(client.name, [])]
+            yield client, {'opening_balance': opening, 'rows': rows,
+                           'total_debit': sum(r['debit'] for r in rows),
+                           'total_credit': sum(r['credit'] for r in rows),
+                           'closing_balance': rows[-1]['balance'] if rows else opening}
+
+
+def material_page(client, start_date=None, end_date=None, after=None, per_page=LEDGER_PAGE_SIZE):
+    """
+    One page of a client's material ledger, newest first.
+
+    OUT deliveries are listed as they are; direct sales appear (one row per
+    item) only when no delivery already carries their bill number.
+
+    Returns:
+        Tuple of (list of dicts with date, material, qty, bill_no, nimbus_no;
+        cursor of the next page or None)
+    """
+    is_client_entry = or_(Entry.client_code == client.code, Entry.client == client.name)
+    delivered_bills = select(Entry.bill_no).where(is_client_entry, Entry.type == 'OUT', Entry.bill_no.isnot(None))
+    deliveries = select(Entry.date.label('day'), literal('E').label('source'), Entry.id.label('source_id')).where(
+        is_client_entry, Entry.type == 'OUT')
+    sales = select(func.date(DirectSale.date_posted), literal('S'), DirectSale.id).where(
+        DirectSale.client_name == client.name,
+        or_(DirectSale.auto_bill_no.is_(None), DirectSale.auto_bill_no.not_in(delivered_bills)))
+    keys = union_all(deliveries, sales).subquery()
+
+    stmt = select(keys)
+    if start_date:
+        stmt = stmt.where(keys.c.day >= start_date.isoformat())
+    if end_date:
+        stmt = stmt.where(keys.c.day <= end_date.isoformat())
+    key = decode_ledger_cursor(after)
+    if key:
+        stmt = stmt.where(tuple_(keys.c.day, keys.c.source, keys.c.source_id) < key)
+    stmt = stmt.order_by(keys.c.day.desc(), keys.c.source.desc(), keys.c.source_id.desc())
+    page = db.session.execute(stmt.limit(per_page + 1)).all()
+    next_cursor = None
+    if len(page) > per_page:
+        last = page[per_page - 1]
+        next_cursor = encode_ledger_cursor(last.day, last.source, last.source_id)
+    page = page[:per_page]
+
+    # Only this page's rows are loaded; sale items come in one extra IN query
+    entry_ids = [row.source_id for row in page if row.source == 'E']
+    sale_ids = [row.source_id for row in page if row.source == 'S']
+    entries = {e.id: e for e in Entry.query.filter(Entry.id.in_(entry_ids))} if entry_ids else {}
+    sales_by_id = {s.id: s for s in DirectSale.query.options(selectinload(DirectSale.items)).filter(
+        DirectSale.id.in_(sale_ids))} if sale_ids else {}
+
+    history = []
+    for row in page:
+        if row.source == 'E':
+            d = entries[row.source_id]
+            history.append({'date': d.date, 'material': d.material, 'qty': d.qty, 'bill_no': d.bill_no,
+                            'nimbus_no': d.nimbus_no})
+        else:
+            s = sales_by_id[row.source_id]
+            history.extend({'date': row.day, 'material': item.product_name, 'qty': item.qty,
+                            'bill_no': s.auto_bill_no, 'nimbus_no': 'Direct Sale'} for item in s.items)
+    return history, next_cursor
@@ -0,0 +1,179 @@
+"""
+Fuzzy name matching for clients.
+Names are normalized (case, punctuation, "M/S" prefixes, company suffixes),
+blocked through a character-trigram index and scored with a token/trigram
+Dice similarity, so "M/S Ahmed Traders" and "AHMED TRADERS" score 100.
+"""
+import re
+from collections import Counter
+from functools import lru_cache
+
+# Honorific prefixes dropped from the start of a name
+NAME_PREFIXES = ('m s', 'ms', 'messrs', 'mr', 'mrs')
+
+# Legal-form words dropped anywhere in a name
+COMPANY_SUFFIXES = {'pvt', 'private', 'ltd', 'limited', 'co', 'company', 'corp', 'corporation',
+                    'inc', 'llc', 'plc', 'and', 'the'}
+
+# Minimum score for an import to link a row to an existing client by name
+CLIENT_MATCH_THRESHOLD = 95
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+@lru_cache(maxsize=100000)
+def normalize_name(name):
+    """Return the canonical form of a name ('' for blanks)."""
+    if not name:
+        return ''
+    text = _NON_WORD.sub(' ', str(name).lower().replace('&', ' and ')).strip()
+    if text == 'nan':
+        return ''
+    for prefix in NAME_PREFIXES:
+        if text == prefix:
+            return ''
+        if text.startswith(prefix + ' '):
+            text = text[len(prefix) + 1:]
+            break
+    tokens = [t for t in text.split() if t not in COMPANY_SUFFIXES]
+    return ' '.join(tokens) or text
+
+
+@lru_cache(maxsize=100000)
+def name_tokens(name):
+    """Set of words in the normalized name."""
+    return frozenset(normalize_name(name).split())
+
+
+@lru_cache(maxsize=100000)
+def name_trigrams(name):
+    """Set of character trigrams of the normalized name, padded at word edges."""
+    norm = normalize_name(name)
+    if not norm:
+        return frozenset()
+    padded = f"  {norm} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _dice(a, b):
+    if not a or not b:
+        return 0.0
+    return 2.0 * len(a & b) / (len(a) + len(b))
+
+
+def name_similarity(a, b):
+    """
+    Score two names from 0 to 100.
+
+    The better of word-level and trigram-level Dice overlap on the normalized
+    names: word overlap tolerates reordering, trigrams tolerate typos.
+    """
+    norm_a, norm_b = normalize_name(a), normalize_name(b)
+    if not norm_a or not norm_b:
+        return 0
+    if norm_a == norm_b:
+        return 100
+    score = max(_dice(name_tokens(a), name_tokens(b)), _dice(name_trigrams(a), name_trigrams(b)))
+    return int(round(score * 100))
+
+
+def score_pairs(pairs):
+    """Score a list of (name_a, name_b) pairs; top-level so process pools can run it."""
+    return [name_similarity(a, b) for a, b in pairs]
+
+
+class NameIndex:
+    """
+    Trigram-blocked index of names for candidate search.
+
+    Only names sharing trigrams with the query are scored, so a lookup costs
+    roughly the size of its block instead of the whole directory.
+    """
+
+    def __init__(self, items=()):
+        self._names = {}
+        self._postings = {}
+        for key, name in items:
+            self.add(key, name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, key, name):
+        """Index ``name`` under ``key`` (replacing any previous name for the key)."""
+        if key in self._names:
+            self.remove(key)
+        self._names[key] = name
+        for gram in name_trigrams(name):
+            self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        name = self._names.pop(key, None)
+        if name is None:
+            return
+        for gram in name_trigrams(name):
+            keys = self._postings.get(gram)
+            if keys:
+                keys.discard(key)
+
+    def candidates(self, name, max_candidates=50):
+        """Keys sharing the most trigrams with ``name`` (at least a third of them), best first."""
+        grams = name_trigrams(name)
+        counts = Counter()
+        for gram in grams:
+            counts.update(self._postings.get(gram, ()))
+        min_shared = max(1, len(grams) // 3)
+        return [key for key, shared in counts.most_common(max_candidates) if shared >= min_shared]
+
+    def search(self, name, limit=10, min_score=50):
+        """Return up to ``limit`` (key, name, score) tuples scoring at least ``min_score``."""
+        scored = []
+        for key in self.candidates(name):
+            score = name_similarity(name, self._names[key])
+            if score >= min_score:
+                scored.append((key, self._names[key], score))
+        scored.sort(key=lambda item: (-item[2], item[1]))
+        return scored[:limit]
+
+    def best_match(self, name, min_score=90):
+        """Return (key, name, score) of the best match at or above ``min_score``, else None."""
+        results = self.search(name, limit=1, min_score=min_score)
+        return results[0] if results else None
+
+    def copy(self):
+        """An independent index with the same entries (for callers that add to it)."""
+        clone = NameIndex()
+        clone._names = dict(self._names)
+        clone._postings = {gram: set(keys) for gram, keys in self._postings.items()}
+        return clone
+
+
+_client_index_cache = {'version': None, 'index': None}
+
+
+def get_client_index():
+    """
+    NameIndex over all clients (keyed by client id), rebuilt only when the data version changes.
+    """
+    from models import Client
+    from utils.data_version import get_data_version
+
+    version = get_data_version()
+    if _client_index_cache['index'] is None or _client_index_cache['version'] != version:
+        rows = Client.query.with_entities(Client.id, Client.name).all()
+        _client_index_cache['index'] = NameIndex((row.id, row.name) for row in rows)
+        _client_index_cache['version'] = version
+    return _client_index_cache['index']
+
+
+def build_client_index():
+    """A private copy of the client index for an import that adds the clients it creates."""
+    return get_client_index().copy()
+
+
+def match_client(client_name, name_index):
+    """Fuzzy client lookup (ignores case, punctuation, M/S and company suffixes); None if no close match."""
+    from models import db, Client
+
+    match = name_index.best_match(client_name, min_score=CLIENT_MATCH_THRESHOLD)
+    return db.session.get(Client, match[0]) if match else None
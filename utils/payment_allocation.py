@@ -0,0 +1,141 @@
+"""
+Payment allocation.
+A payment is applied FIFO to a client's unpaid pending bills and every
+application is recorded as a PaymentAllocation row, so bill amounts are never
+overwritten and a bill's outstanding balance is its amount minus an indexed
+sum of its allocations. Bills are streamed oldest first and allocation stops
+at the first bill that absorbs the remainder.
+"""
+from sqlalchemy import func, insert, select, update
+
+from models import db, PaymentAllocation, PendingBill
+
+# Bills fetched per round-trip while allocating
+ALLOCATION_BATCH_SIZE = 50
+
+# Remainders below this are treated as fully applied (float rounding)
+AMOUNT_EPSILON = 0.005
+
+
+def allocated_amount(bill_id_column=PendingBill.id):
+    """Correlated sum of allocations for a bill (an index probe on payment_allocation.bill_id)."""
+    return select(func.coalesce(func.sum(PaymentAllocation.amount), 0.0)).where(
+        PaymentAllocation.bill_id == bill_id_column).scalar_subquery()
+
+
+def outstanding_amount():
+    """SQL expression for a pending bill's outstanding balance."""
+    return func.coalesce(PendingBill.amount, 0.0) - allocated_amount()
+
+
+def allocate_payment(payment, bill_no=None):
+    """
+    Apply a flushed payment to unpaid pending bills, oldest first.
+
+    Args:
+        payment: Payment with an id and amount
+        bill_no: Restrict allocation to bills with this number (manual bill number)
+
+    Returns:
+        List of (bill_no, 'paid' | 'partial <amount>') describing what was applied
+    """
+    remaining = float(payment.amount or 0)
+    if remaining <= 0:
+        return []
+
+    stmt = select(PendingBill.id, PendingBill.bill_no, PendingBill.client_name,
+                  outstanding_amount().label('outstanding')).where(
+        PendingBill.is_paid == False)
+    if bill_no:
+        stmt = stmt.where(PendingBill.bill_no == bill_no)
+    else:
+        stmt = stmt.where(PendingBill.client_name == payment.client_name)
+    stmt = stmt.order_by(PendingBill.id.asc())
+
+    allocations, paid_ids, applied, client_names = [], [], [], set()
+    result = db.session.execute(stmt, execution_options={'yield_per': ALLOCATION_BATCH_SIZE})
+    try:
+        for bill in result:
+            outstanding = bill.outstanding or 0.0
+            if outstanding <= AMOUNT_EPSILON:
+                # Settled by earlier allocations but not yet flagged
+                paid_ids.append(bill.id)
+                continue
+            share = min(remaining, outstanding)
+            client_names.add(bill.client_name)
+            allocations.append({'payment_id': payment.id, 'bill_id': bill.id, 'amount': share})
+            remaining -= share
+            if outstanding - share <= AMOUNT_EPSILON:
+                paid_ids.append(bill.id)
+                applied.append((bill.bill_no, 'paid'))
+            else:
+                applied.append((bill.bill_no, f'partial {share:.2f}'))
+            if remaining <= AMOUNT_EPSILON:
+                break
+    finally:
+        result.close()
+
+    if allocations:
+        db.session.execute(insert(PaymentAllocation), allocations)
+    if paid_ids:
+        db.session.execute(update(PendingBill).where(PendingBill.id.in_(paid_ids)).values(is_paid=True),
+                           execution_options={'synchronize_session': False})
+    if allocations:
+        # Imported here: client_balances builds on this module's SQL expressions
+        from utils.client_balances import refresh_client_balances
+        refresh_client_balances(client_names)
+    return applied
+
+
+def release_payment(payment_id):
+    """Remove a payment's allocations and reopen the bills that are no longer settled."""
+    bill_ids = list(db.session.execute(select(PaymentAllocation.bill_id).where(
+        PaymentAllocation.payment_id == payment_id).distinct()).scalars())
+    if not bill_ids:
+        return
+    db.session.execute(PaymentAllocation.__table__.delete().where(PaymentAllocation.payment_id == payment_id))
+    db.session.execute(update(PendingBill).where(
+        PendingBill.id.in_(bill_ids), outstanding_amount() > AMOUNT_EPSILON).values(is_paid=False),
+        execution_options={'synchronize_session': False})
+
+    from utils.client_balances import refresh_client_balances
+    refresh_client_balances(db.session.execute(
+        select(PendingBill.client_name).where(PendingBill.id.in_(bill_ids))).scalars())
+
+
+def sync_bill_paid(bill):
+    """
+    Re-derive a bill's paid flag from its allocations after its amount changed.
+
+    Bills without allocations keep their (manually set) flag.
+    """
+    allocated = db.session.execute(select(func.sum(PaymentAllocation.amount)).where(
+        PaymentAllocation.bill_id == bill.id)).scalar()
+    if allocated is not None:
+        bill.is_paid = (bill.amount or 0.0) - allocated <= AMOUNT_EPSILON
+
+
+def outstanding_by_bill(bill_ids):
+    """{bill id: outstanding balance} for the given bills that have allocations."""
+    if not bill_ids:
+        return {}
+    rows = db.session.execute(select(PaymentAllocation.bill_id, func.sum(PaymentAllocation.amount)).where(
+        PaymentAllocation.bill_id.in_(bill_ids)).group_by(PaymentAllocation.bill_id)).all()
+    allocated = dict(rows)
+    amounts = dict(db.session.execute(select(PendingBill.id, PendingBill.amount).where(
+        PendingBill.id.in_(list(allocated)))).all()) if allocated else {}
+    return {bill_id: (amounts.get(bill_id) or 0.0) - total for bill_id, total in allocated.items()}
+
+
+def client_outstanding(client_name):
+    """Total outstanding balance of a client's unpaid pending bills."""
+    return db.session.execute(select(func.coalesce(func.sum(outstanding_amount()), 0.0)).where(
+        PendingBill.client_name == client_name, PendingBill.is_paid == False)).scalar()
+
+
+def delete_bill_allocations(bill_ids=None):
+    """Drop the allocations of deleted bills (all allocations when ``bill_ids`` is None)."""
+    stmt = PaymentAllocation.__table__.delete()
+    if bill_ids is not None:
+        stmt = stmt.where(PaymentAllocation.bill_id.in_(bill_ids))
+    db.session.execute(stmt)
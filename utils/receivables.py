@@ -0,0 +1,142 @@
+"""
+Receivables aging.
+Unpaid pending bills (at their outstanding balance) and open invoices (at
+their balance) are bucketed by age per client and client category in one
+grouped query. An invoice tracked by a pending bill of the same number is
+counted through that bill only: payments are allocated to the bill and never
+reduce ``Invoice.balance``. Results are cached in-process per as-of date and
+data version.
+
+Pending bills age from their bill date, or the date they were recorded. The
+recorded date lives in the string ``created_at``, so its date part is kept in
+the indexed ``created_on`` column, set on every ORM write and backfilled at
+startup.
+"""
+from datetime import date, datetime
+
+from sqlalchemy import String, case, cast, event, exists, func, literal, or_, select, union_all, update
+
+from models import db, Client, Invoice, PendingBill
+from utils.data_version import get_data_version
+from utils.payment_allocation import outstanding_amount
+
+# (key, label, lowest age in days, highest age in days or None)
+AGING_BUCKETS = (
+    ('days_0_30', '0-30', 0, 30),
+    ('days_31_60', '31-60', 31, 60),
+    ('days_61_90', '61-90', 61, 90),
+    ('days_90_plus', '90+', 91, None),
+)
+
+# Rows without any date cannot be aged
+UNDATED_BUCKET = ('undated', 'No Date')
+
+AGING_EXPORT_HEADERS = (['Client', 'Category'] + [label for _, label, _, _ in AGING_BUCKETS]
+                        + [UNDATED_BUCKET[1], 'Total'])
+
+# Invoice statuses that still have money due
+OPEN_INVOICE_STATUSES = ('OPEN', 'PARTIAL')
+
+# Cached reports kept per process, keyed by (as_of, data version)
+AGING_CACHE_SIZE = 8
+
+_aging_cache = {}
+
+
+def created_on_from(created_at):
+    """Date part of a 'YYYY-MM-DD HH:MM' created_at string, or None."""
+    if not created_at:
+        return None
+    try:
+        return datetime.strptime(str(created_at)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _set_created_on(mapper, connection, target):
+    target.created_on = created_on_from(target.created_at)
+
+
+event.listen(PendingBill, 'before_insert', _set_created_on)
+event.listen(PendingBill, 'before_update', _set_created_on)
+
+
+def backfill_pending_bill_dates():
+    """Fill created_on for rows written before the column existed (or by bulk inserts)."""
+    # Core statement: a derived column is not a data change, so the data version is left alone
+    table = PendingBill.__table__
+    db.session.execute(update(table).where(table.c.created_on.is_(None), table.c.created_at.isnot(None)).values(
+        created_on=func.date(func.substr(table.c.created_at, 1, 10))))
+    db.session.commit()
+
+
+def _aging_rows(as_of):
+    """
+    One row per receivable: client name, client code, aged-from date and amount due.
+
+    Receivables dated after ``as_of`` did not exist yet and are left out, so
+    the buckets and "No Date" always add up to the total. Invoices with a
+    pending bill are left to the bill.
+    """
+    aged_from = func.coalesce(PendingBill.date, PendingBill.created_on)
+    pending = select(
+        PendingBill.client_name.label('client_name'), PendingBill.client_code.label('client_code'),
+        aged_from.label('aged_from'), outstanding_amount().label('amount'),
+    ).where(PendingBill.is_paid == False, or_(aged_from.is_(None), aged_from <= as_of))
+    tracked_by_bill = exists().where(PendingBill.bill_no == Invoice.invoice_no,
+                                     PendingBill.client_code.is_not_distinct_from(Invoice.client_code))
+    invoices = select(
+        Invoice.client_name, Invoice.client_code, Invoice.date, func.coalesce(Invoice.balance, 0.0),
+    ).where(Invoice.status.in_(OPEN_INVOICE_STATUSES), Invoice.balance > 0,
+            or_(Invoice.date.is_(None), Invoice.date <= as_of), ~tracked_by_bill)
+    return union_all(pending, invoices).subquery()
+
+
+def aging_report(as_of=None):
+    """
+    Receivables aging per client and category.
+
+    Args:
+        as_of: Date ages are measured at (defaults to today)
+
+    Returns:
+        Dict with 'rows' (one dict per client/category: client, category, one
+        amount per bucket key, 'undated' and 'total') and 'totals'
+    """
+    as_of = as_of or date.today()
+    cache_key = (as_of, get_data_version())
+    cached = _aging_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    rows = _aging_rows(as_of)
+    age = func.julianday(literal(as_of.isoformat())) - func.julianday(cast(rows.c.aged_from, String))
+    category = func.coalesce(Client.category, 'Unassigned')
+    columns = []
+    for key, _, low, high in AGING_BUCKETS:
+        in_bucket = age >= low if high is None else age.between(low, high)
+        columns.append(func.sum(case((in_bucket, rows.c.amount), else_=0.0)).label(key))
+    columns.append(func.sum(case((rows.c.aged_from.is_(None), rows.c.amount), else_=0.0)).label(UNDATED_BUCKET[0]))
+    columns.append(func.sum(rows.c.amount).label('total'))
+
+    stmt = select(func.coalesce(rows.c.client_name, '').label('client'), category.label('category'), *columns
+                  ).select_from(rows).outerjoin(Client, Client.code == rows.c.client_code
+                  ).group_by(rows.c.client_name, category).having(func.sum(rows.c.amount) > 0
+                  ).order_by(func.sum(rows.c.amount).desc())
+
+    keys = [key for key, _, _, _ in AGING_BUCKETS] + [UNDATED_BUCKET[0], 'total']
+    report_rows = [dict(row._mapping) for row in db.session.execute(stmt)]
+    totals = {key: sum(row[key] or 0.0 for row in report_rows) for key in keys}
+    report = {'as_of': as_of, 'rows': report_rows, 'totals': totals}
+
+    if len(_aging_cache) >= AGING_CACHE_SIZE:
+        _aging_cache.clear()
+    _aging_cache[cache_key] = report
+    return report
+
+
+def iter_aging_export_rows(report):
+    """Export rows in AGING_EXPORT_HEADERS order."""
+    keys = [key for key, _, _, _ in AGING_BUCKETS] + [UNDATED_BUCKET[0], 'total']
+    for row in report['rows']:
+        yield [row['client'], row['category']] + [round(row[key] or 0.0, 2) for key in keys]
@@ -0,0 +1,65 @@
+"""
+On-disk cache for rendered documents (reports, invoices, statements).
+Entries are keyed by a hash of everything that determines the output, so a
+changed input produces a new key and a stale file is never served.
+"""
+import hashlib
+import json
+import os
+
+CACHE_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'instance', 'render_cache')
+
+# Files kept per namespace; older ones are pruned on write
+MAX_ENTRIES_PER_NAMESPACE = 500
+
+
+def cache_key(*parts):
+    """Build a stable hex key from arbitrary JSON-serialisable parts."""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def cache_path(namespace, key, ext):
+    """Return the file path for a cache entry, creating the namespace folder."""
+    folder = os.path.join(CACHE_ROOT, namespace)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{key}.{ext}")
+
+
+def load(namespace, key, ext):
+    """Return cached bytes, or None on a miss."""
+    path = cache_path(namespace, key, ext)
+    try:
+        with open(path, 'rb') as fh:
+            return fh.read()
+    except OSError:
+        return None
+
+
+def store(namespace, key, ext, data):
+    """Atomically write bytes for a cache entry and return its path."""
+    path = cache_path(namespace, key, ext)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
+    prune(namespace)
+    return path
+
+
+def prune(namespace, max_entries=MAX_ENTRIES_PER_NAMESPACE):
+    """Delete the oldest files of a namespace beyond ``max_entries``."""
+    folder = os.path.join(CACHE_ROOT, namespace)
+    try:
+        files = [os.path.join(folder, f) for f in os.listdir(folder) if not f.endswith('.tmp')]
+    except OSError:
+        return
+    if len(files) <= max_entries:
+        return
+    files.sort(key=lambda f: os.path.getmtime(f))
+    for f in files[:len(files) - max_entries]:
+        try:
+            os.remove(f)
+        except OSError:
+            pass
@@ -0,0 +1,215 @@
+"""
+Material stock ledger computed in SQL.
+Every stock movement of a material -- receiving (IN) and dispatch entries,
+plus direct-sale items whose sale never produced a dispatch entry -- is one
+UNION ALL, and a page's running balance is a window sum over the requested
+range on top of the stock held before it. That opening stock starts from the
+nearest month-start MaterialStockSnapshot, so only the movements since the
+snapshot are summed. A snapshot is written the first time its month is
+viewed and dropped by a flush listener when an earlier movement of its
+material changes; bulk writers call ``invalidate_stock_snapshots``.
+"""
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import case, delete, event, func, insert, inspect, literal, or_, select, tuple_, union_all
+from sqlalchemy.orm import Session
+
+from models import db, MaterialStockSnapshot, Entry, DirectSale, DirectSaleItem
+from utils.ledger import LEDGER_PAGE_SIZE, decode_ledger_cursor, encode_ledger_cursor
+
+# Entry / DirectSale columns that move stock or decide whether a sale is counted
+ENTRY_STOCK_FIELDS = ('date', 'type', 'material', 'qty', 'auto_bill_no')
+SALE_STOCK_FIELDS = ('date_posted', 'auto_bill_no')
+
+_snapshot_table = MaterialStockSnapshot.__table__
+
+
+def stock_movements(material_name):
+    """
+    All stock movements of a material as one unordered UNION ALL select.
+
+    Columns: day ('YYYY-MM-DD'), item, bill_no, added, delivered, source
+    ('E' entry / 'S' direct-sale item) and source_id. Direct sales create a
+    dispatch entry per item, so a sale's items are only counted when no
+    dispatch of the material carries its bill number (older sales).
+    """
+    entries = select(Entry.date.label('day'), Entry.material.label('item'), Entry.bill_no.label('bill_no'),
+                     case((Entry.type == 'IN', Entry.qty), else_=0.0).label('added'),
+                     case((Entry.type == 'IN', 0.0), else_=Entry.qty).label('delivered'),
+                     literal('E').label('source'), Entry.id.label('source_id')
+                     ).where(Entry.material == material_name)
+    dispatched_sales = select(Entry.auto_bill_no).where(
+        Entry.material == material_name, Entry.type == 'OUT', Entry.auto_bill_no.isnot(None))
+    sale_items = select(func.date(DirectSale.date_posted), DirectSaleItem.product_name, DirectSale.auto_bill_no,
+                        literal(0.0), func.coalesce(DirectSaleItem.qty, 0.0), literal('S'), DirectSaleItem.id
+                        ).join(DirectSale, DirectSale.id == DirectSaleItem.sale_id).where(
+        DirectSaleItem.product_name == material_name,
+        or_(DirectSale.auto_bill_no.is_(None), DirectSale.auto_bill_no.not_in(dispatched_sales)))
+    return union_all(entries, sale_items)
+
+
+def _net_movement(material_name, from_day=None, to_day=None):
+    """Stock added minus delivered on days in [from_day, to_day) ('YYYY-MM-DD'; None = unbounded)."""
+    moves = stock_movements(material_name).subquery()
+    stmt = select(func.coalesce(func.sum(moves.c.added - moves.c.delivered), 0.0))
+    if from_day:
+        stmt = stmt.where(moves.c.day >= from_day)
+    if to_day:
+        stmt = stmt.where(moves.c.day < to_day)
+    return db.session.execute(stmt).scalar()
+
+
+def _nearest_snapshot(material_name, on_or_before=None):
+    stmt = select(_snapshot_table.c.day, _snapshot_table.c.balance).where(_snapshot_table.c.material == material_name)
+    if on_or_before:
+        stmt = stmt.where(_snapshot_table.c.day <= on_or_before)
+    return db.session.execute(stmt.order_by(_snapshot_table.c.day.desc()).limit(1)).first()
+
+
+def _snapshot_insert(material_name, month_start):
+    """
+    INSERT ... SELECT of a month-start snapshot from the nearest earlier one plus the movements since.
+
+    Reading the base and writing the row in one statement means no write can
+    commit in between, so the flush-listener invalidation of any later
+    movement always sees the row.
+    """
+    earlier = _snapshot_table.alias('earlier')
+    base_day = select(func.max(earlier.c.day)).where(
+        earlier.c.material == material_name, earlier.c.day < month_start).scalar_subquery()
+    base = select(_snapshot_table.c.balance).where(
+        _snapshot_table.c.material == material_name, _snapshot_table.c.day == base_day).scalar_subquery()
+    moves = stock_movements(material_name).subquery()
+    net = select(func.coalesce(func.sum(moves.c.added - moves.c.delivered), 0.0)).where(
+        moves.c.day >= func.coalesce(base_day, ''), moves.c.day < month_start).scalar_subquery()
+    row = select(literal(material_name), literal(month_start), func.coalesce(base, 0.0) + net,
+                 literal(datetime.utcnow()))
+    columns = [_snapshot_table.c.material, _snapshot_table.c.day, _snapshot_table.c.balance,
+               _snapshot_table.c.updated_at]
+    # A snapshot written concurrently for the same month is equally current
+    return insert(_snapshot_table).prefix_with('OR IGNORE').from_select(columns, row)
+
+
+def opening_stock(material_name, day):
+    """
+    Stock of a material before ``day`` (a date).
+
+    Starts from the snapshot of ``day``'s month, writing (and committing) it
+    when the month has none yet.
+    """
+    month_start = day.replace(day=1).isoformat()
+    snapshot = _nearest_snapshot(material_name, month_start)
+    if snapshot is None or snapshot.day != month_start:
+        db.session.execute(_snapshot_insert(material_name, month_start))
+        db.session.commit()
+        # Re-read: a write committed since may already have dropped the new snapshot
+        snapshot = _nearest_snapshot(material_name, month_start)
+    base = (snapshot.balance or 0.0) if snapshot else 0.0
+    return base + _net_movement(material_name, snapshot.day if snapshot else None, day.isoformat())
+
+
+def current_stock(material_name):
+    """Stock of a material after every recorded movement."""
+    snapshot = _nearest_snapshot(material_name)
+    base = (snapshot.balance or 0.0) if snapshot else 0.0
+    return base + _net_movement(material_name, snapshot.day if snapshot else None)
+
+
+def stock_page(material_name, start_date=None, end_date=None, after=None, per_page=LEDGER_PAGE_SIZE):
+    """
+    One page of a material's stock ledger, newest first.
+
+    Args:
+        material_name: Material.name
+        start_date, end_date: Optional inclusive date range
+        after: Cursor returned with the previous page
+
+    Returns:
+        Tuple of (rows with day, item, bill_no, added, delivered, source,
+        source_id and balance; cursor of the next page or None; stock before
+        the range)
+    """
+    moves = stock_movements(material_name).subquery()
+    ranged = select(moves)
+    opening = 0.0
+    if start_date:
+        ranged = ranged.where(moves.c.day >= start_date.isoformat())
+        opening = opening_stock(material_name, start_date)
+    if end_date:
+        ranged = ranged.where(moves.c.day <= end_date.isoformat())
+    ranged = ranged.subquery()
+    balance = literal(opening) + func.sum(ranged.c.added - ranged.c.delivered).over(
+        order_by=(ranged.c.day, ranged.c.source, ranged.c.source_id))
+    ledger = select(ranged, balance.label('balance')).subquery()
+
+    stmt = select(ledger)
+    key = decode_ledger_cursor(after)
+    if key:
+        stmt = stmt.where(tuple_(ledger.c.day, ledger.c.source, ledger.c.source_id) < key)
+    stmt = stmt.order_by(ledger.c.day.desc(), ledger.c.source.desc(), ledger.c.source_id.desc())
+    rows = db.session.execute(stmt.limit(per_page + 1)).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        next_cursor = encode_ledger_cursor(last.day, last.source, last.source_id)
+    return rows[:per_page], next_cursor, opening
+
+
+def invalidate_stock_snapshots(materials=None, since=None, connection=None):
+    """
+    Drop snapshots a movement change makes stale (for bulk writes that bypass the flush).
+
+    Args:
+        materials: Material names, or None for every material
+        since: Earliest changed day ('YYYY-MM-DD'); None drops every snapshot
+    """
+    connection = connection or db.session.connection()
+    stmt = delete(_snapshot_table)
+    if materials is not None:
+        materials = [m for m in set(materials) if m]
+        if not materials:
+            return
+        stmt = stmt.where(_snapshot_table.c.material.in_(materials))
+    if since:
+        # A snapshot only covers the days before its own
+        stmt = stmt.where(_snapshot_table.c.day > since)
+    connection.execute(stmt)
+
+
+def _history_values(obj, attr):
+    history = inspect(obj).attrs[attr].history
+    return [v for v in chain(history.added, history.unchanged, history.deleted) if v is not None]
+
+
+def _stock_fields_changed(obj, fields):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_on_flush(session, flush_context):
+    stale = {}  # material (None = every material) -> earliest changed day ('' = whole history)
+
+    def note(material, day):
+        stale[material] = min(stale.get(material, day), day)
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        written = obj in session.new or obj in session.deleted
+        if isinstance(obj, Entry) and (written or _stock_fields_changed(obj, ENTRY_STOCK_FIELDS)):
+            day = min(_history_values(obj, 'date'), default='')
+            for material in _history_values(obj, 'material'):
+                note(material, day)
+        elif isinstance(obj, DirectSale) and (written or _stock_fields_changed(obj, SALE_STOCK_FIELDS)):
+            posted = _history_values(obj, 'date_posted')
+            note(None, min(p.date().isoformat() for p in posted) if posted else '')
+        elif isinstance(obj, DirectSaleItem):
+            for material in _history_values(obj, 'product_name'):
+                note(material, '')
+    if not stale:
+        return
+    connection = session.connection()
+    if None in stale:
+        invalidate_stock_snapshots(None, stale.pop(None) or None, connection)
+    for material, day in stale.items():
+        invalidate_stock_snapshots([material], day or None, connection)